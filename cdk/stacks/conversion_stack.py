@@ -13,6 +13,7 @@ from aws_cdk import (
     aws_s3_notifications as s3n,
     aws_sns as sns,
     aws_sns_subscriptions as subscriptions,
+    aws_sqs as sqs,
     aws_events as events,
     aws_events_targets as targets,
     Duration,
@@ -160,6 +161,14 @@ class ConversionStack(Stack):
             )
 
         # === LAMBDA FUNCTION FOR CONVERSION TRIGGER ===
+        # The trigger fails an invocation whose files could not all be launched, so Lambda
+        # retries the event; events still failing after the retries are kept here for
+        # replay instead of being dropped.
+        trigger_dlq = sqs.Queue(
+            self, "ConversionTriggerDLQ",
+            queue_name=f"{id.lower()}-conversion-trigger-dlq",
+            retention_period=Duration.days(14),
+        )
         lambda_fn = _lambda.Function(
             self, "ConversionTrigger",
             runtime=_lambda.Runtime.PYTHON_3_9,
@@ -173,9 +182,13 @@ class ConversionStack(Stack):
                 "SUBNET_IDS": ",".join([subnet.subnet_id for subnet in vpc.private_subnets])
                     if vpc.private_subnets else vpc.public_subnets[0].subnet_id,
                 "SECURITY_GROUP_IDS": security_group.security_group_id,
-                "DEST_BUCKET": dest_bucket.bucket_name
+                "DEST_BUCKET": dest_bucket.bucket_name,
+                "FILES_PER_TASK": str(stack_config.get("filesPerTask", 20)),
+                "MAX_CONCURRENT_TASKS": str(stack_config.get("maxConcurrentTasks", 10))
             },
             timeout=Duration.seconds(30),
+            retry_attempts=2,
+            dead_letter_queue=trigger_dlq,
         )
 
         # === NOTIFICATION CONFIGURATION ===
@@ -226,6 +239,14 @@ class ConversionStack(Stack):
                     "SECURITY_GROUP_IDS": security_group.security_group_id,
                     "DEST_BUCKET": dest_bucket.bucket_name,
                     "LAST_PROCESSED_PARAM": "/my-app/last_processed",
+                    "LISTING_CURSOR_PARAM": "/my-app/listing_cursor",
+                    "SOURCE_PREFIX": stack_config.get("sourcePrefix", "data/v2.1/avhrr/"),
+                    "LOOKBACK_MONTHS": str(stack_config.get("lookbackMonths", 0)),
+                    "LEDGER_KEY": "_ledger/processed_keys.json",
+                    "COMPLETED_PREFIX": "_ledger/completed/",
+                    "RELIST_DAYS": str(stack_config.get("relistDays", 7)),
+                    "FILES_PER_TASK": str(stack_config.get("filesPerTask", 20)),
+                    "MAX_CONCURRENT_TASKS": str(stack_config.get("maxConcurrentTasks", 10)),
                     "POLLING_START_TIMESTAMP": "2025-02-23T00:00:00+00:00"
                 },
                 timeout=Duration.seconds(120),
@@ -242,10 +263,16 @@ class ConversionStack(Stack):
             polling_lambda.add_to_role_policy(
                 iam.PolicyStatement(
                     actions=["ssm:GetParameter", "ssm:PutParameter"],
-                    resources=[f"arn:aws:ssm:{Stack.of(self).region}:{self.account}:parameter/my-app/last_processed"]
+                    resources=[
+                        f"arn:aws:ssm:{Stack.of(self).region}:{self.account}:parameter/my-app/last_processed",
+                        f"arn:aws:ssm:{Stack.of(self).region}:{self.account}:parameter/my-app/listing_cursor"
+                    ]
                 )
             )
 
+            # Grant the polling Lambda access to its processed-key ledger in the destination bucket.
+            dest_bucket.grant_read_write(polling_lambda, "_ledger/*")
+
             # Grant polling Lambda permission to run ECS tasks using its task definition.
             # Using a wildcard for revisions, as task definitions include a revision number.
             polling_lambda.add_to_role_policy(
@@ -254,6 +281,13 @@ class ConversionStack(Stack):
                     resources=[f"arn:aws:ecs:{Stack.of(self).region}:{self.account}:task-definition/{id.lower()}-converter*"]
                 )
             )
+            # The launcher counts running converter tasks to respect MAX_CONCURRENT_TASKS.
+            polling_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["ecs:ListTasks"],
+                    resources=["*"]
+                )
+            )
 
         # === ECR REPOSITORY SETUP ===
         try:
@@ -305,9 +339,23 @@ class ConversionStack(Stack):
         )
 
         # === ECS TASK DEFINITION ===
+        task_memory_mib = int(ecs_task_config.get("memory", "4096"))
+        # Opt-in: with ecsTask.memoryBudgetMib set, conversions plan their chunks and threads to
+        # stay under that ceiling (see plan_memory_budget). Unset, the converter falls back to
+        # conversion.memory_budget_mib of the app config, which is null by default.
+        memory_budget_mib = ecs_task_config.get("memoryBudgetMib")
+        container_environment = {
+            "PYTHONPATH": "/app",
+            "SOURCE_BUCKET": source_bucket.bucket_name,
+            "DEST_BUCKET": dest_bucket.bucket_name,
+            "AWS_DEFAULT_REGION": Stack.of(self).region,
+            "DATASET_CONFIG": "/app/config/app_config.json",
+        }
+        if memory_budget_mib is not None:
+            container_environment["MEMORY_BUDGET_MIB"] = str(int(memory_budget_mib))
         task_definition = ecs.FargateTaskDefinition(
             self, "ConversionTask",
-            memory_limit_mib=int(ecs_task_config.get("memory", "4096")),
+            memory_limit_mib=task_memory_mib,
             cpu=int(ecs_task_config.get("cpu", "2048")),
             task_role=task_role,
             family=f"{id.lower()}-converter"
@@ -317,13 +365,7 @@ class ConversionStack(Stack):
             ecs_task_config.get("containerName", "converter"),
             image=ecs.ContainerImage.from_ecr_repository(repository),
             command=["python", "-m", "ecs.worker_app"],
-            environment={
-                "PYTHONPATH": "/app",
-                "SOURCE_BUCKET": source_bucket.bucket_name,
-                "DEST_BUCKET": dest_bucket.bucket_name,
-                "AWS_DEFAULT_REGION": Stack.of(self).region,
-                "DATASET_CONFIG": "/app/config/app_config.json"
-            },
+            environment=container_environment,
             logging=ecs.LogDriver.aws_logs(
                 stream_prefix="converter",
                 log_group=logs.LogGroup(
@@ -348,6 +390,17 @@ class ConversionStack(Stack):
             )
         )
 
+        lambda_fn.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["ecs:ListTasks"],
+                resources=["*"]
+            )
+        )
+        # Launch checkpoints are kept under the ledger prefix of the destination bucket.
+        dest_bucket.grant_read_write(lambda_fn, "_ledger/*")
+        # The trigger checks the source bucket for a final file before converting a preliminary one.
+        source_bucket.grant_read(lambda_fn)
+
         lambda_fn.add_to_role_policy(
             iam.PolicyStatement(
                 actions=["iam:PassRole"],
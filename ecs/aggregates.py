@@ -0,0 +1,310 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import zarr
+import dask
+from ecs.chunk_store import open_store
+from ecs.store_io import open_variables, remove_paths
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_AGGREGATE_VARIABLES = ["sst"]
+DEFAULT_ROLLING_WINDOWS = [7, 30]
+DAYS_IN_CLIMATOLOGY = 366
+
+
+def aggregate_store_path(zarr_store_path, aggregates_config=None):
+    """
+    Return the path of the aggregate store that belongs to a Zarr store.
+    The aggregates live next to the main store (not inside it) so that a full
+    rewrite of the main store with mode="w" does not delete them.
+    """
+    aggregates_config = aggregates_config or {}
+    if aggregates_config.get("store"):
+        return aggregates_config["store"].replace("s3://", "")
+    zarr_store_path = zarr_store_path.replace("s3://", "").rstrip("/")
+    if "/" not in zarr_store_path:
+        # A bare bucket has no sibling prefix; fall back to a prefix inside it.
+        return f"{zarr_store_path}/aggregates"
+    return f"{zarr_store_path}-aggregates"
+
+
+def reset_aggregates(fs, zarr_store_path, aggregates_config=None):
+    """
+    Remove the aggregate store of a Zarr store. Called when the main store is
+    (re)created, so the new days are not accumulated into the old store's state.
+    """
+    agg_path = aggregate_store_path(zarr_store_path.replace("s3://", ""), aggregates_config)
+    try:
+        remove_paths(fs, agg_path, recursive=True)
+        logger.info(f"Removed the aggregates at {agg_path}")
+    except FileNotFoundError:
+        pass
+
+
+def has_aggregates(fs, zarr_store_path, aggregates_config=None):
+    """
+    True if a Zarr store has aggregate state to update. A store that already holds
+    days without it (aggregates were enabled after it was created, or the state was
+    removed) needs rebuild_aggregates instead: the incremental update would remove
+    days leaving the windows that were never added.
+    """
+    agg_path = aggregate_store_path(zarr_store_path.replace("s3://", ""), aggregates_config)
+    try:
+        group = zarr.open_group(store=zarr.storage.FsspecStore(fs=fs, read_only=True, path=agg_path), mode="r")
+    except FileNotFoundError:
+        return False
+    return bool(group.attrs.get("window_end"))
+
+
+def _window_name(window):
+    return f"rolling_{int(window)}d"
+
+
+def _accumulate(total, count, m2, values):
+    """Add one day of values to running sum/count/M2 accumulators (Welford)."""
+    valid = np.isfinite(values)
+    x = np.where(valid, values, 0.0)
+    old_mean = np.divide(total, count, out=x.copy(), where=count > 0)
+    count = count + valid
+    total = total + x
+    new_mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    m2 = m2 + np.where(valid, (x - old_mean) * (x - new_mean), 0.0)
+    return total, count, m2
+
+
+def _deaccumulate(total, count, m2, values):
+    """Remove one day of values from running sum/count/M2 accumulators."""
+    valid = np.isfinite(values) & (count > 0)
+    x = np.where(valid, values, 0.0)
+    old_mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    count = count - valid
+    total = total - x
+    new_mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    m2 = m2 - np.where(valid, (x - old_mean) * (x - new_mean), 0.0)
+    # Guard against round-off drift once a cell has no samples left.
+    total = np.where(count > 0, total, 0.0)
+    m2 = np.where(count > 0, np.maximum(m2, 0.0), 0.0)
+    return total, count, m2
+
+
+def _day_values(ds, var):
+    """Return the (zlev, lat, lon) float64 values of the single time slice in ds."""
+    da_var = ds[var]
+    if "time" in da_var.dims:
+        da_var = da_var.isel(time=0)
+    return np.asarray(da_var.values, dtype=np.float64)
+
+
+def _create_coordinate(group, name, values):
+    """Create a 1-D coordinate array; zarr 3.0 create_array takes no data, so it is filled after."""
+    array = group.create_array(name, shape=values.shape, dtype=values.dtype, dimension_names=[name])
+    array[...] = values
+    return array
+
+
+def _open_aggregate_group(store, ds, variables, windows):
+    """Open (or create) the aggregate group and make sure all arrays exist."""
+    group = zarr.open_group(store=store, mode="a")
+    grid_shape = (ds.sizes.get("zlev", 1), ds.sizes["lat"], ds.sizes["lon"])
+    grid_dims = ["zlev", "lat", "lon"]
+    if "lat" not in group:
+        _create_coordinate(group, "lat", np.asarray(ds.lat.values))
+        _create_coordinate(group, "lon", np.asarray(ds.lon.values))
+        zlev = ds.zlev.values if "zlev" in ds.coords else np.array([1])
+        _create_coordinate(group, "zlev", np.asarray(zlev))
+        _create_coordinate(group, "dayofyear", np.arange(1, DAYS_IN_CLIMATOLOGY + 1, dtype="int16"))
+    for var in variables:
+        prefixes = {"clim": (DAYS_IN_CLIMATOLOGY,) + grid_shape}
+        for window in windows:
+            prefixes[_window_name(window)] = grid_shape
+        for prefix, shape in prefixes.items():
+            dims = (["dayofyear"] + grid_dims) if prefix == "clim" else grid_dims
+            chunks = (1,) + grid_shape if prefix == "clim" else grid_shape
+            for stat, dtype in (("sum", "f8"), ("count", "i4"), ("m2", "f8")):
+                group.require_array(
+                    f"{var}_{prefix}_{stat}",
+                    shape=shape,
+                    dtype=dtype,
+                    chunks=chunks,
+                    fill_value=0,
+                    dimension_names=dims,
+                )
+    return group
+
+
+def _read_stats(group, var, prefix, index=()):
+    return tuple(group[f"{var}_{prefix}_{stat}"][index] for stat in ("sum", "count", "m2"))
+
+
+def _write_stats(group, var, prefix, stats, index=()):
+    for stat, values in zip(("sum", "count", "m2"), stats):
+        group[f"{var}_{prefix}_{stat}"][index] = values
+
+
+def _update_rolling(group, var, window, existing_ds, new_values, new_time, previous_values, window_end):
+    """
+    Update the accumulators of one rolling window for a newly written day.
+    The window covers the days (window_end - window, window_end].
+    """
+    prefix = _window_name(window)
+    stats = _read_stats(group, var, prefix)
+    span = pd.Timedelta(days=window)
+
+    if window_end is None or new_time > window_end:
+        if window_end is not None and existing_ds is not None:
+            # Drop the days that fall out of the window as it advances.
+            new_start = new_time.normalize() - span
+            old_start = window_end.normalize() - span
+            times = pd.to_datetime(existing_ds["time"].values)
+            leaving = times[(times.normalize() > old_start) & (times.normalize() <= new_start) & (times <= window_end)]
+            for t in leaving:
+                stats = _deaccumulate(*stats, _day_values(existing_ds.sel(time=[t]), var))
+        stats = _accumulate(*stats, new_values)
+    elif new_time.normalize() > window_end.normalize() - span:
+        if previous_values is not None:
+            stats = _deaccumulate(*stats, previous_values)
+        stats = _accumulate(*stats, new_values)
+    else:
+        return
+    _write_stats(group, var, prefix, stats)
+
+
+def update_aggregates(fs, zarr_store_path, ds, new_time, previous=None, aggregates_config=None):
+    """
+    Update the climatology and rolling-window accumulators with the day in ds.
+    `previous` holds the values that were stored for new_time before it was
+    overwritten, so they can be removed first. Only the day-of-year row and the
+    days leaving each rolling window are read, so the cost is O(grid) per day.
+    The aggregates must cover every other day of the store (see has_aggregates).
+    """
+    aggregates_config = aggregates_config or {}
+    variables = [v for v in aggregates_config.get("variables", DEFAULT_AGGREGATE_VARIABLES) if v in ds]
+    windows = aggregates_config.get("rolling_windows", DEFAULT_ROLLING_WINDOWS)
+    if not variables:
+        logger.info("No aggregate variables present in dataset; skipping aggregate update.")
+        return
+
+    zarr_store_path = zarr_store_path.replace("s3://", "")
+    agg_path = aggregate_store_path(zarr_store_path, aggregates_config)
+    logger.info(f"Updating aggregates at {agg_path} for {new_time}")
+    agg_store = zarr.storage.FsspecStore(fs=fs, read_only=False, path=agg_path)
+    group = _open_aggregate_group(agg_store, ds, variables, windows)
+
+    window_end = group.attrs.get("window_end")
+    window_end = pd.Timestamp(window_end) if window_end else None
+    existing_ds = None
+    if windows and window_end is not None and new_time > window_end:
+        store = open_store(fs, zarr_store_path, read_only=True)
+        existing_ds = open_variables(store, variables)
+
+    doy_index = new_time.dayofyear - 1
+    for var in variables:
+        new_values = _day_values(ds, var)
+        previous_values = _day_values(previous, var) if previous is not None and var in previous else None
+        stats = _read_stats(group, var, "clim", doy_index)
+        if previous_values is not None:
+            stats = _deaccumulate(*stats, previous_values)
+        stats = _accumulate(*stats, new_values)
+        _write_stats(group, var, "clim", stats, doy_index)
+        for window in windows:
+            _update_rolling(group, var, window, existing_ds, new_values, new_time, previous_values, window_end)
+
+    if window_end is None or new_time > window_end:
+        group.attrs["window_end"] = new_time.isoformat()
+    group.attrs["rolling_windows"] = [int(w) for w in windows]
+    group.attrs["variables"] = variables
+    zarr.consolidate_metadata(agg_store)
+    logger.info(f"Aggregates updated for {new_time}")
+
+
+def _reduce_stats(x):
+    """Lazily compute sum, count and M2 of x along time, ignoring NaNs."""
+    count = x.count("time").astype("int32")
+    total = x.sum("time", skipna=True).astype("float64")
+    mean = total / count.where(count > 0)
+    m2 = ((x - mean) ** 2).sum("time", skipna=True).astype("float64")
+    return total, count, m2
+
+
+def rebuild_aggregates(fs, zarr_store_path, aggregates_config=None, num_workers=None, store=None):
+    """
+    Rebuild all aggregates from scratch by scanning the main store (`store`, if
+    already opened). The reductions for every variable, day of year and window are
+    built as one dask graph and computed in parallel.
+    """
+    aggregates_config = aggregates_config or {}
+    zarr_store_path = zarr_store_path.replace("s3://", "")
+    if store is None:
+        store = open_store(fs, zarr_store_path, read_only=True)
+    ds = open_variables(store, aggregates_config.get("variables", DEFAULT_AGGREGATE_VARIABLES))
+    variables = [v for v in aggregates_config.get("variables", DEFAULT_AGGREGATE_VARIABLES) if v in ds]
+    windows = aggregates_config.get("rolling_windows", DEFAULT_ROLLING_WINDOWS)
+    times = pd.to_datetime(ds["time"].values)
+    window_end = times.max()
+    logger.info(f"Rebuilding aggregates for {variables} over {len(times)} days (windows: {windows})")
+
+    agg_path = aggregate_store_path(zarr_store_path, aggregates_config)
+    reset_aggregates(fs, zarr_store_path, aggregates_config)
+    agg_store = zarr.storage.FsspecStore(fs=fs, read_only=False, path=agg_path)
+    group = _open_aggregate_group(agg_store, ds, variables, windows)
+
+    lazy = {}
+    for var in variables:
+        x = ds[var].astype("float64")
+        if "zlev" not in x.dims:
+            x = x.expand_dims("zlev", axis=1)
+        grouped = x.groupby("time.dayofyear")
+        lazy[(var, "clim")] = (
+            grouped.sum("time", skipna=True).astype("float64"),
+            grouped.count("time").astype("int32"),
+            grouped.map(lambda g: ((g - g.mean("time", skipna=True)) ** 2).sum("time", skipna=True)).astype("float64"),
+        )
+        for window in windows:
+            start = window_end.normalize() - pd.Timedelta(days=window)
+            lazy[(var, _window_name(window))] = _reduce_stats(x.sel(time=times[times.normalize() > start]))
+
+    computed = dask.compute(lazy, num_workers=num_workers)[0]
+    for (var, prefix), stats in computed.items():
+        if prefix == "clim":
+            doy_index = stats[0]["dayofyear"].values - 1
+            for stat, values in zip(("sum", "count", "m2"), stats):
+                arr = group[f"{var}_clim_{stat}"]
+                for i, doy in enumerate(doy_index):
+                    arr[int(doy)] = values.isel(dayofyear=i).transpose("zlev", "lat", "lon").values
+        else:
+            _write_stats(group, var, prefix, tuple(s.transpose("zlev", "lat", "lon").values for s in stats))
+
+    group.attrs["window_end"] = window_end.isoformat()
+    group.attrs["rolling_windows"] = [int(w) for w in windows]
+    group.attrs["variables"] = variables
+    zarr.consolidate_metadata(agg_store)
+    logger.info(f"Rebuilt aggregates at {agg_path}")
+
+
+def _mean_and_variance(total, count, m2):
+    mean = np.divide(total, count, out=np.full(total.shape, np.nan), where=count > 0)
+    variance = np.divide(m2, count - 1, out=np.full(total.shape, np.nan), where=count > 1)
+    return mean, variance
+
+
+def climatology(fs, zarr_store_path, var, time, aggregates_config=None):
+    """Return the (mean, variance) climatology of var for the day of year of time."""
+    agg_path = aggregate_store_path(zarr_store_path, aggregates_config)
+    group = zarr.open_group(store=zarr.storage.FsspecStore(fs=fs, read_only=True, path=agg_path), mode="r")
+    return _mean_and_variance(*_read_stats(group, var, "clim", pd.Timestamp(time).dayofyear - 1))
+
+
+def rolling_statistics(fs, zarr_store_path, var, window, aggregates_config=None):
+    """Return the (mean, variance) of var over the most recent rolling window."""
+    agg_path = aggregate_store_path(zarr_store_path, aggregates_config)
+    group = zarr.open_group(store=zarr.storage.FsspecStore(fs=fs, read_only=True, path=agg_path), mode="r")
+    return _mean_and_variance(*_read_stats(group, var, _window_name(window)))
+
+
+def anomaly(fs, zarr_store_path, ds, var, time, aggregates_config=None):
+    """Return the anomaly of one day of var relative to the stored climatology."""
+    mean, _ = climatology(fs, zarr_store_path, var, time, aggregates_config)
+    return _day_values(ds, var) - mean
@@ -0,0 +1,129 @@
+import logging
+import os
+import pandas as pd
+import xarray as xr
+import zarr.errors
+from ecs.aggregates import has_aggregates, rebuild_aggregates, update_aggregates, reset_aggregates
+from ecs.cell_layout import CELL_DIM, apply_cell_layout, forget_cells, pack_dataset, require_cells
+from ecs.conversion_options import conversion_options
+from ecs.converter import extract_date_from_filename, load_dataset, add_verifier_pubkeys, convert_netcdf_to_zarr, record_io
+from ecs.dask_client import get_dask_client, collect_task_stream
+from ecs.deferred_hashes import tracks_hash_status, add_hash_status
+from ecs.diagnostics import diagnostics_location, profile_conversion
+from ecs.hashing import add_spatial_hashes
+from ecs.io_accounting import io_stats
+from ecs.memory_planner import grid_cells
+from ecs.metrics import ConversionMetrics, emit_metrics
+from ecs.store_io import (
+    split_store_url,
+    get_filesystem,
+    get_store,
+    get_time_index,
+    remember_time_index,
+    forget_time_index,
+    source_size,
+)
+from ecs.store_writes import write_lock, append_to_store, create_store, payload_bytes
+
+logger = logging.getLogger(__name__)
+
+def convert_files_to_zarr(netcdf_files, zarr_store, suffix, conversion_config=None):
+    """
+    Convert a batch of NetCDF files as one graph. Days after the end of the store are
+    prepared lazily, concatenated and appended with a single to_zarr call, so with a
+    distributed client their load, hash and write tasks spread over all workers.
+    Days already in the store (or older than its end) go through convert_netcdf_to_zarr
+    one at a time. Returns the metrics records: one for the batch, then one per such day.
+    """
+    options = conversion_options(conversion_config)
+    client = get_dask_client(options.dask)
+    aggregates_config = options.aggregates
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    store = get_store(zarr_store_path, protocol)
+    try:
+        existing_times = get_time_index(store, zarr_store_path)
+    except (FileNotFoundError, zarr.errors.ContainsArrayAndGroupError):
+        existing_times = pd.DatetimeIndex([])
+
+    days = {}
+    for netcdf_file in netcdf_files:
+        new_time = extract_date_from_filename(netcdf_file, suffix).replace(hour=12, minute=0, second=0)
+        days[new_time] = netcdf_file
+    end = existing_times.max() if len(existing_times) else None
+    appended = {t: f for t, f in sorted(days.items()) if not options.overwrite_store and (end is None or t > end)}
+    sequential = [f for t, f in sorted(days.items()) if t not in appended]
+
+    metrics = ConversionMetrics(operation="convert_files_to_zarr", files=list(appended.values()), store=zarr_store)
+
+    def append_days():
+        nonlocal store
+        # Batched days are hashed inline; the marker is only kept for stores that track it.
+        hash_status = tracks_hash_status(zarr_store, options)
+        datasets = []
+        cells = None
+        rebuild = False
+        for new_time, netcdf_file in appended.items():
+            ds, _ = load_dataset(netcdf_file, suffix, options.config)
+            ds = add_spatial_hashes(ds, options.land_mask)
+            # Every day of the batch is packed over the same cells as the first, and must fit in them.
+            if cells is None:
+                ds = apply_cell_layout(ds, zarr_store, options)
+            else:
+                require_cells(ds, cells, zarr_store)
+                ds = pack_dataset(ds, cells)
+            if CELL_DIM in ds.coords:
+                cells = ds[CELL_DIM].values
+            ds = add_verifier_pubkeys(ds)
+            datasets.append(add_hash_status(ds, pending=False) if hash_status else ds)
+        batch_ds = xr.concat(datasets, dim="time")
+        logger.info(f"Writing {len(datasets)} day(s) to {zarr_store} as one graph")
+        with write_lock:
+            # Load, hash and write run as one graph, so they are measured as one stage.
+            with metrics.stage("batch_graph") as stage:
+                if end is None:
+                    if aggregates_config is not None:
+                        reset_aggregates(get_filesystem(protocol), zarr_store_path, aggregates_config)
+                    store = get_store(zarr_store_path, protocol, options.chunk_dedup)
+                    create_store(batch_ds, store)
+                    forget_time_index(zarr_store_path)
+                    forget_cells(zarr_store_path)
+                else:
+                    rebuild = aggregates_config is not None and not has_aggregates(
+                        get_filesystem(protocol), zarr_store_path, aggregates_config)
+                    append_to_store(batch_ds, store, len(existing_times))
+                    remember_time_index(zarr_store_path, existing_times.append(pd.to_datetime(batch_ds["time"].values)))
+                stage["bytes_in"] = sum(source_size(f) for f in appended.values())
+                stage["bytes_out"] = payload_bytes(batch_ds)
+                stage["cells"] = grid_cells(batch_ds)
+            if aggregates_config is not None:
+                with metrics.stage("aggregates"):
+                    if rebuild:
+                        logger.warning(f"{zarr_store} has no aggregates yet; rebuilding them from the whole store")
+                        rebuild_aggregates(get_filesystem(protocol), zarr_store_path, aggregates_config, store=store)
+                    else:
+                        for ds, new_time in zip(datasets, appended):
+                            update_aggregates(get_filesystem(protocol), zarr_store_path, ds, new_time, None,
+                                              aggregates_config)
+
+    records = []
+    if appended:
+        diagnostics = {}
+        report_name = "batch-" + os.path.splitext(os.path.basename(next(iter(appended.values()))))[0]
+        io_before = io_stats.snapshot()
+        try:
+            with collect_task_stream(client, metrics), \
+                    profile_conversion(client, diagnostics_location(zarr_store, options.config), report_name,
+                                       {"files": list(appended.values()), "store": zarr_store}) as diagnostics:
+                append_days()
+            metrics.properties["diagnostics_report"] = diagnostics.get("report")
+            record_io(metrics, io_before, report_name)
+        except Exception as e:
+            metrics.properties["diagnostics_report"] = diagnostics.get("report")
+            record_io(metrics, io_before, report_name)
+            emit_metrics(metrics.to_record(status="failed", error=str(e)))
+            raise
+        records.append(metrics.to_record())
+        emit_metrics(records[-1])
+    for netcdf_file in sequential:
+        records.append(convert_netcdf_to_zarr(netcdf_file, zarr_store, suffix, options))
+    return records
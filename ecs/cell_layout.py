@@ -0,0 +1,165 @@
+import logging
+import numpy as np
+import dask.array as da
+import xarray as xr
+import zarr
+import zarr.errors
+from ecs.conversion_options import conversion_options
+from ecs.land_mask import ocean_mask
+from ecs.store_io import split_store_url, get_store
+
+logger = logging.getLogger(__name__)
+
+# Dimension (and coordinate) of the packed layout; the coordinate holds each ocean
+# cell's row-major position in the (lat, lon) grid.
+CELL_DIM = "cell"
+# Per-cell variables that are stored packed in the ocean layout.
+CELL_VARIABLES = ("spatial_hash", "verifier_pubkeys")
+
+# Ocean cells of each store in the packed layout, by store path (they never change).
+_cells_cache = {}
+
+def build_cells(ocean):
+    """Row-major grid positions of the True cells of a 2-D (lat, lon) ocean mask."""
+    return np.flatnonzero(np.asarray(ocean, dtype=bool)).astype(np.int64)
+
+def grid_to_cell(cells, grid_shape):
+    """(lat, lon) array of each grid cell's packed position, -1 for cells that are not packed."""
+    positions = np.full(grid_shape[0] * grid_shape[1], -1, dtype=np.int64)
+    positions[cells] = np.arange(len(cells))
+    return positions.reshape(grid_shape)
+
+def gather_cells(values, cells, axis):
+    """
+    Pack the lat and lon axes (axis and axis + 1) of a numpy or dask array into one
+    cell axis holding only `cells`.
+    """
+    shape = values.shape
+    flat = values.reshape(shape[:axis] + (shape[axis] * shape[axis + 1],) + shape[axis + 2:])
+    return np.take(flat, cells, axis=axis)
+
+def scatter_cells(values, cells, grid_shape, fill, axis=-1):
+    """
+    Unpack the cell axis of a numpy array back into lat and lon axes, with `fill` in
+    the cells that are not packed.
+    """
+    values = np.asarray(values)
+    axis = axis % values.ndim
+    shape = values.shape
+    grid = np.full(shape[:axis] + (grid_shape[0] * grid_shape[1],) + shape[axis + 1:], fill, dtype=values.dtype)
+    index = [slice(None)] * values.ndim
+    index[axis] = cells
+    grid[tuple(index)] = values
+    return grid.reshape(shape[:axis] + tuple(grid_shape) + shape[axis + 1:])
+
+def pack_dataset(ds, cells):
+    """
+    Replace the per-cell variables of ds (CELL_VARIABLES on the (zlev, lat, lon) grid)
+    with 1-D arrays over `cells`, chunked to as many cells as a grid chunk held, and
+    add the cell coordinate.
+    """
+    nlat, nlon = ds.sizes["lat"], ds.sizes["lon"]
+    packed = {}
+    for name in CELL_VARIABLES:
+        if name not in ds or CELL_DIM in ds[name].dims:
+            continue
+        var = ds[name].isel(zlev=0, drop=True) if "zlev" in ds[name].dims else ds[name]
+        axis = var.dims.index("lat")
+        data = gather_cells(var.data, cells, axis)
+        if isinstance(data, da.Array):
+            chunk_cells = var.data.chunksize[axis] * var.data.chunksize[axis + 1]
+            data = data.rechunk({axis: min(chunk_cells, len(cells))})
+        packed[name] = (var.dims[:axis] + (CELL_DIM,) + var.dims[axis + 2:], data, var.attrs)
+    if not packed:
+        return ds
+    ds = ds.drop_vars(list(packed)).assign(packed)
+    return ds.assign_coords({CELL_DIM: (CELL_DIM, cells, {
+        "long_name": "Ocean cell",
+        "description": "Row-major position of the cell in the (lat, lon) grid",
+        "grid_shape": [nlat, nlon],
+    })})
+
+def read_cells(store, zarr_store_path=None):
+    """
+    The ocean cells of a store in the packed layout, or None if it uses the grid
+    layout. Raises FileNotFoundError if there is no store.
+    """
+    if zarr_store_path in _cells_cache:
+        return _cells_cache[zarr_store_path]
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    cells = group[CELL_DIM][:] if CELL_DIM in group.array_keys() else None
+    if zarr_store_path is not None and cells is not None:
+        _cells_cache[zarr_store_path] = cells
+    return cells
+
+def forget_cells(zarr_store_path):
+    """Drop the cached cells of a store that is being (re)created."""
+    _cells_cache.pop(zarr_store_path, None)
+
+def unpack_variable(ds, name, fill=""):
+    """
+    A packed variable of a store opened with xarray, loaded and scattered back onto the
+    dataset's (lat, lon) grid; variables in the grid layout are returned as they are.
+    """
+    var = ds[name]
+    if CELL_DIM not in var.dims:
+        return var
+    axis = var.dims.index(CELL_DIM)
+    grid_shape = (ds.sizes["lat"], ds.sizes["lon"])
+    values = scatter_cells(var.values, ds[CELL_DIM].values, grid_shape, fill, axis)
+    dims = var.dims[:axis] + ("lat", "lon") + var.dims[axis + 1:]
+    coords = {dim: ds[dim] for dim in dims if dim in ds.coords}
+    return xr.DataArray(values, dims=dims, coords=coords, attrs=var.attrs, name=name)
+
+def check_cells(ocean, cells):
+    """Number of cells of a 2-D ocean mask outside the packed cells (their per-cell data is not stored)."""
+    packed = np.zeros(np.size(ocean), dtype=bool)
+    packed[cells] = True
+    return int((np.asarray(ocean, dtype=bool).ravel() & ~packed).sum())
+
+def day_mask(ds):
+    """2-D (lat, lon) mask of the cells where any day of ds has data."""
+    mask = ocean_mask(ds)
+    return mask.any([dim for dim in mask.dims if dim not in ("lat", "lon")])
+
+def require_cells(ds, cells, zarr_store):
+    """
+    Raise ValueError if ds has data in cells outside the packed ocean cells of a store
+    (e.g. where sea ice has retreated since the store was created): their hashes
+    cannot be stored, and the index of a packed store is never extended.
+    """
+    outside = check_cells(day_mask(ds).values, cells)
+    if outside:
+        raise ValueError(f"{outside} cell(s) hold data outside the {len(cells)} ocean cells of {zarr_store}, "
+                         f"so their hashes cannot be stored; recreate the store from days covering them, "
+                         f"or with the grid layout")
+
+def apply_cell_layout(ds, zarr_store, conversion_config=None, new_store=False, check=True):
+    """
+    Pack the per-cell variables of ds (spatial_hash, and verifier_pubkeys once added)
+    over the ocean cells if the store uses the packed layout.
+    An existing store keeps the layout it was created with; a new one (or any store
+    with new_store, for a store about to be replaced) is packed when
+    conversion_config["cell_layout"] is "ocean", over the cells where this day has data.
+    With check, cells holding data outside the store's ocean cells raise ValueError
+    (see require_cells).
+    """
+    options = conversion_options(conversion_config)
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    cells = None
+    if not (new_store or options.overwrite_store):
+        try:
+            cells = read_cells(get_store(zarr_store_path, protocol), zarr_store_path)
+            if cells is None:
+                return ds
+        except (FileNotFoundError, zarr.errors.ContainsArrayAndGroupError):
+            pass
+    if cells is None:
+        if options.cell_layout != "ocean":
+            return ds
+        mask = day_mask(ds)
+        cells = build_cells(mask.values)
+        logger.info(f"Packing per-cell variables over {len(cells)} ocean cells of {mask.size}")
+    elif check:
+        require_cells(ds, cells, zarr_store)
+    return pack_dataset(ds, cells)
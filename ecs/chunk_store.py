@@ -0,0 +1,342 @@
+import json
+import logging
+import threading
+import time
+import uuid
+import blake3
+import zarr
+from zarr.core.buffer import default_buffer_prototype
+from zarr.core.sync import sync
+from zarr.storage import FsspecStore, WrapperStore
+
+logger = logging.getLogger(__name__)
+
+# Layout of a content-addressed store, next to the usual Zarr metadata:
+#   chunk_manifest.json      marker: the store's chunks are content addressed
+#   blobs/<hash>             encoded chunk bytes, stored once per distinct content
+#   <array>/manifest.json    compacted chunk key -> hash map of an array
+#   journal/<name>.json      chunk keys written (or deleted) since the last compaction
+MARKER_KEY = "chunk_manifest.json"
+BLOB_PREFIX = "blobs/"
+JOURNAL_PREFIX = "journal/"
+MANIFEST_NAME = "manifest.json"
+# Hex digits of the BLAKE3 digest used as a blob name (128 bits).
+HASH_LENGTH = 32
+# A chunk missing from the manifest re-reads the journal at most this often, to pick up
+# days written by other processes.
+REFRESH_SECONDS = 1.0
+# Blob hashes a process remembers as uploaded before it starts over.
+MAX_KNOWN_BLOBS = 1_000_000
+
+def chunk_hash(data):
+    """Blob name of encoded chunk bytes."""
+    return blake3.blake3(data).hexdigest()[:HASH_LENGTH]
+
+def split_chunk_key(key):
+    """(array path, chunk key within the array) of a Zarr v3 chunk key, or None for any other key."""
+    parts = key.split("/")
+    for index in range(len(parts) - 1, -1, -1):
+        if parts[index] == "c" and all(part.isdigit() for part in parts[index + 1:]):
+            return "/".join(parts[:index]), "/".join(parts[index:])
+    return None
+
+def is_internal(key):
+    """Whether a key belongs to the content-addressed layout rather than to Zarr."""
+    return (key == MARKER_KEY or key.startswith(BLOB_PREFIX) or key.startswith(JOURNAL_PREFIX)
+            or key == MANIFEST_NAME or key.endswith("/" + MANIFEST_NAME))
+
+def journal_name():
+    """Journal entry name; names sort in the order they were written."""
+    return f"{JOURNAL_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+
+def apply_record(chunks, array, record):
+    """Apply one journal record to the chunk map of an array."""
+    if any(array == reset or array.startswith(reset + "/") or not reset for reset in record.get("reset", [])):
+        chunks.clear()
+    for chunk, digest in record.get("arrays", {}).get(array, {}).items():
+        if digest is None:
+            chunks.pop(chunk, None)
+        else:
+            chunks[chunk] = digest
+
+class ContentAddressedStore(WrapperStore):
+    """
+    A Zarr store whose chunks are stored by content. Writing a chunk uploads its bytes
+    to blobs/<hash> unless a blob with that content exists, and records the chunk key
+    in the journal; metadata is stored as usual. Identical chunks (land and polar
+    tiles, empty verifier slots, coordinates) are stored once across days and arrays.
+    The chunks written are published when flush() writes one journal entry for them,
+    so a write must be followed by flush(). scripts/chunk_gc.py folds the journal into
+    the per-array manifests and deletes blobs no manifest references.
+    Copies sent to other processes (dask workers) publish every chunk as it is written.
+    """
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._lock = threading.Lock()
+        self._local = True
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pending = {}
+        self._pending_resets = []
+        self._manifests = {}
+        self._journal = []
+        self._journal_names = set()
+        self._refreshed = 0.0
+        self._known = set()
+        self._marked = False
+
+    def __getstate__(self):
+        return {"store": self._store}
+
+    def __setstate__(self, state):
+        self.__init__(state["store"])
+        self._local = False
+
+    def __eq__(self, value):
+        return type(self) is type(value) and self._store == value._store
+
+    def __repr__(self):
+        return f"ContentAddressedStore({self._store!r})"
+
+    async def _read_json(self, key):
+        buffer = await self._store.get(key, default_buffer_prototype())
+        return None if buffer is None else json.loads(buffer.to_bytes())
+
+    async def _refresh_journal(self):
+        """Read journal entries not seen yet and apply them to the loaded manifests."""
+        names = [key async for key in self._store.list_prefix(JOURNAL_PREFIX)
+                 if key.endswith(".json") and key not in self._journal_names]
+        for name in sorted(names):
+            record = await self._read_json(name)
+            if record is None:
+                continue
+            self._journal.append((name, record))
+            self._journal_names.add(name)
+            for array, chunks in self._manifests.items():
+                apply_record(chunks, array, record)
+        self._refreshed = time.monotonic()
+
+    async def _chunks(self, array):
+        """The chunk key -> hash map of an array: its manifest plus the journal."""
+        if not self._refreshed:
+            await self._refresh_journal()
+        if array not in self._manifests:
+            manifest = await self._read_json(f"{array}/{MANIFEST_NAME}" if array else MANIFEST_NAME)
+            chunks = dict(manifest["chunks"]) if manifest else {}
+            for _, record in self._journal:
+                apply_record(chunks, array, record)
+            self._manifests[array] = chunks
+        return self._manifests[array]
+
+    async def _lookup(self, key):
+        """Blob hash of a chunk key, or None if the chunk is not stored."""
+        array, chunk = split_chunk_key(key)
+        pending = self._pending.get(array, {})
+        if chunk in pending:
+            return pending[chunk]
+        digest = (await self._chunks(array)).get(chunk)
+        if digest is None and time.monotonic() - self._refreshed > REFRESH_SECONDS:
+            await self._refresh_journal()
+            digest = self._manifests[array].get(chunk)
+        return digest
+
+    async def get(self, key, prototype, byte_range=None):
+        if split_chunk_key(key) is None:
+            return await self._store.get(key, prototype, byte_range)
+        digest = await self._lookup(key)
+        if digest is None:
+            return None
+        return await self._store.get(BLOB_PREFIX + digest, prototype, byte_range)
+
+    async def get_partial_values(self, prototype, key_ranges):
+        return [await self.get(key, prototype, byte_range) for key, byte_range in key_ranges]
+
+    async def exists(self, key):
+        if split_chunk_key(key) is None:
+            return await self._store.exists(key)
+        return await self._lookup(key) is not None
+
+    async def set(self, key, value):
+        location = split_chunk_key(key)
+        if location is None:
+            await self._store.set(key, value)
+            return
+        digest = chunk_hash(value.to_bytes())
+        if digest not in self._known:
+            if not await self._store.exists(BLOB_PREFIX + digest):
+                await self._store.set(BLOB_PREFIX + digest, value)
+            if len(self._known) >= MAX_KNOWN_BLOBS:
+                self._known.clear()
+            self._known.add(digest)
+        self._record(location, digest)
+        if not self._local:
+            await self._flush()
+
+    async def set_if_not_exists(self, key, value):
+        if not await self.exists(key):
+            await self.set(key, value)
+
+    async def _set_many(self, values):
+        for key, value in values:
+            await self.set(key, value)
+
+    @property
+    def supports_partial_writes(self):
+        return False
+
+    async def delete(self, key):
+        location = split_chunk_key(key)
+        if location is None:
+            await self._store.delete(key)
+            return
+        self._record(location, None)
+        if not self._local:
+            await self._flush()
+
+    def _record(self, location, digest):
+        array, chunk = location
+        with self._lock:
+            self._pending.setdefault(array, {})[chunk] = digest
+
+    async def delete_dir(self, prefix):
+        await self._store.delete_dir(prefix)
+        array = prefix.strip("/")
+        if not array:
+            # The whole store is gone, blobs and journal included.
+            self._reset_state()
+            return
+        with self._lock:
+            self._pending_resets.append(array)
+            for name in [name for name in self._pending if name == array or name.startswith(array + "/")]:
+                del self._pending[name]
+        for name in [name for name in self._manifests if name == array or name.startswith(array + "/")]:
+            self._manifests[name] = {}
+        if not self._local:
+            await self._flush()
+
+    async def clear(self):
+        await self._store.clear()
+        self._reset_state()
+
+    async def list(self):
+        async for key in self.list_prefix(""):
+            yield key
+
+    async def list_prefix(self, prefix):
+        async for key in self._store.list_prefix(prefix):
+            if not is_internal(key):
+                yield key
+        if not self._refreshed:
+            await self._refresh_journal()
+        arrays = {name for _, record in self._journal for name in record.get("arrays", {})} | set(self._manifests)
+        for array in sorted(arrays):
+            for chunk in sorted(await self._chunks(array)):
+                key = f"{array}/{chunk}" if array else chunk
+                if key.startswith(prefix):
+                    yield key
+
+    async def list_dir(self, prefix):
+        async for key in self._store.list_dir(prefix):
+            if not is_internal(f"{prefix.rstrip('/')}/{key}".lstrip("/")):
+                yield key
+
+    async def _flush(self):
+        with self._lock:
+            arrays, resets = self._pending, self._pending_resets
+            self._pending, self._pending_resets = {}, []
+        if not self._marked:
+            await self._store.set(MARKER_KEY, default_buffer_prototype().buffer.from_bytes(
+                json.dumps({"format": 1, "hash": f"blake3-{HASH_LENGTH * 4}"}).encode()))
+            self._marked = True
+        if not arrays and not resets:
+            return
+        record = {"arrays": arrays, "reset": resets}
+        name = journal_name()
+        await self._store.set(name, default_buffer_prototype().buffer.from_bytes(json.dumps(record).encode()))
+        self._journal.append((name, record))
+        self._journal_names.add(name)
+        for array, chunks in self._manifests.items():
+            apply_record(chunks, array, record)
+
+    def flush(self):
+        """Publish the chunks written since the last flush as one journal entry."""
+        sync(self._flush())
+
+def is_content_addressed(store):
+    """Whether a store (a plain FsspecStore) holds a content-addressed layout."""
+    return sync(store.exists(MARKER_KEY))
+
+def open_store(fs, path, read_only=False):
+    """A store for a Zarr store path, content addressed if the store was created that way."""
+    store = FsspecStore(fs=fs, read_only=read_only, path=path)
+    return ContentAddressedStore(store) if is_content_addressed(store) else store
+
+def flush_store(store):
+    """Publish the chunks written to a content-addressed store; other stores need nothing."""
+    if isinstance(store, ContentAddressedStore):
+        store.flush()
+
+def compact(store):
+    """
+    Fold the journal into the per-array manifests and delete the entries folded in.
+    Returns the manifests (array path -> chunk map) of every array of the store.
+    Only one compaction may run at a time; conversions may keep writing.
+    """
+    sync(store._refresh_journal())
+    entries = list(store._journal)
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    arrays = {name for name, member in group.members(max_depth=None) if isinstance(member, zarr.Array)}
+    arrays |= {name for _, record in entries for name in record.get("arrays", {})}
+    manifests = {}
+    prototype = default_buffer_prototype()
+    for array in sorted(arrays):
+        chunks = dict(sync(store._chunks(array)))
+        manifests[array] = chunks
+        key = f"{array}/{MANIFEST_NAME}" if array else MANIFEST_NAME
+        sync(store._store.set(key, prototype.buffer.from_bytes(json.dumps({"chunks": chunks}).encode())))
+    for name, _ in entries:
+        sync(store._store.delete(name))
+    store._journal = []
+    logger.info(f"Compacted {len(entries)} journal entries into {len(manifests)} manifests")
+    return manifests
+
+def collect_garbage(store, fs, grace_seconds=3600, dry_run=False):
+    """
+    Compact the journal, then delete the blobs no manifest or newer journal entry
+    references and that are older than grace_seconds (blobs of a write not flushed
+    yet are newer). A blob a running conversion decides to reuse could be deleted
+    under it, so run this while no conversion writes to the store.
+    Returns counts and bytes of the blobs kept and deleted.
+    """
+    # ecs.store_io imports this module, so its helpers are imported when needed.
+    from ecs.store_io import find_files, remove_paths
+    manifests = compact(store)
+    sync(store._refresh_journal())
+    referenced = {digest for chunks in manifests.values() for digest in chunks.values()}
+    referenced |= {digest for _, record in store._journal
+                   for chunks in record.get("arrays", {}).values() for digest in chunks.values() if digest}
+    root = store._store.path.rstrip("/")
+    now = time.time()
+    result = {"kept": 0, "kept_bytes": 0, "deleted": 0, "deleted_bytes": 0, "recent": 0}
+    blobs = find_files(fs, f"{root}/{BLOB_PREFIX}")
+    unreferenced = []
+    for path, info in blobs.items():
+        digest = path.rsplit("/", 1)[-1]
+        size = info.get("size", 0)
+        if digest in referenced:
+            result["kept"] += 1
+            result["kept_bytes"] += size
+            continue
+        modified = info.get("LastModified") or info.get("mtime") or info.get("created")
+        modified = modified.timestamp() if hasattr(modified, "timestamp") else float(modified or now)
+        if now - modified < grace_seconds:
+            result["recent"] += 1
+            continue
+        unreferenced.append(path)
+        result["deleted"] += 1
+        result["deleted_bytes"] += size
+    if unreferenced and not dry_run:
+        remove_paths(fs, unreferenced)
+    return result
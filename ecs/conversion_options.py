@@ -0,0 +1,36 @@
+import os
+from dataclasses import dataclass, field
+
+@dataclass(frozen=True)
+class ConversionOptions:
+    """
+    The settings a conversion branches on, parsed once from the "conversion" section
+    of the deployment configuration (and OVERWRITE_ZARR_STORE). `config` keeps the
+    whole section for the steps that read their own keys (variables, packing,
+    time_delta, memory budget, diagnostics).
+    """
+    config: dict = field(default_factory=dict)
+    dask: dict = field(default_factory=dict)
+    aggregates: dict = None
+    land_mask: bool = False
+    chunk_dedup: bool = False
+    cell_layout: str = "grid"
+    deferred_hashes: bool = False
+    # For local development: replace the store instead of appending to it.
+    overwrite_store: bool = False
+
+def conversion_options(conversion_config=None):
+    """The ConversionOptions of a conversion config; ConversionOptions are returned as they are."""
+    if isinstance(conversion_config, ConversionOptions):
+        return conversion_config
+    config = conversion_config or {}
+    return ConversionOptions(
+        config=config,
+        dask=config.get("dask") or {},
+        aggregates=config.get("aggregates"),
+        land_mask=bool(config.get("land_mask", False)),
+        chunk_dedup=bool(config.get("chunk_dedup", False)),
+        cell_layout=config.get("cell_layout", "grid"),
+        deferred_hashes=config.get("hash_phase", "inline") == "deferred",
+        overwrite_store=os.environ.get("OVERWRITE_ZARR_STORE", "false").lower() in ("true", "1"),
+    )
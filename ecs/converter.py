@@ -1,90 +1,36 @@
-import s3fs.errors
 import xarray as xr
 import re
 import pandas as pd
-import zarr
-import s3fs
-import io 
-import fsspec
 import numpy as np
-import blake3
-import struct
 import dask.array as da
-import zarr.errors
 import logging
 import os
+from ecs.conversion_options import conversion_options
+from ecs.metrics import ConversionMetrics, emit_metrics
+from ecs.diagnostics import diagnostics_location, profile_conversion
+from ecs.time_delta import apply_time_delta
+from ecs.cell_layout import CELL_DIM, apply_cell_layout
+from ecs.dask_client import get_dask_client, collect_task_stream
+from ecs.deferred_hashes import add_pending_hashes, tracks_hash_status, add_hash_status
+from ecs.hashing import add_spatial_hashes
+from ecs.io_accounting import io_stats, summarize_io, io_metrics
+from ecs.memory_planner import grid_cells, memory_budget_bytes, store_chunk_cells, plan_memory_budget, release_memory
+from ecs.packing import apply_packing
+from ecs.store_io import get_source_filesystem, source_size
+from ecs.store_writes import write_to_zarr, write_region_to_zarr, payload_bytes, compute_options
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-def calculate_spatial_hash(lat: float, lon: float, sst: float, err: float, 
-                           ice: float, anom: float) -> str:
-    """Calculate BLAKE3 hash for a specific lat/lon point and its associated values."""
-    try:
-        sst_val = -999.0 if np.isnan(sst) else sst
-        err_val = -999.0 if np.isnan(err) else err
-        ice_val = -999.0 if np.isnan(ice) else ice
-        anom_val = -999.0 if np.isnan(anom) else anom
-        value_bytes = struct.pack('6f', lat, lon, sst_val, err_val, ice_val, anom_val)
-        return blake3.blake3(value_bytes).hexdigest()
-    except Exception as e:
-        logger.error(f"Error calculating hash: {str(e)}")
-        raise
-
-def safe_spatial_hash(lat, lon, sst_val, err_val, ice_val, anom_val):
-    try:
-        result = calculate_spatial_hash(lat, lon, sst_val, err_val, ice_val, anom_val)
-        # Debug: print the result for the first few calls.
-        # (You might want to remove or comment this out once confirmed.)
-        # print(f"Hash computed for ({lat}, {lon}): {result}")
-        return result
-    except Exception as e:
-        logger.error(f"Error processing (lat,lon)=({lat},{lon}): {e}")
-        return calculate_spatial_hash(lat, lon, -999.0, -999.0, -999.0, -999.0)
-
-
-def calculate_dataset_hashes(ds: xr.Dataset) -> xr.DataArray:
-    """
-    Calculate spatial hashes for the dataset.
-    If 'zlev' exists, compute using only the first level, then expand the result
-    to include a singleton 'zlev' dimension so that the output dimensions become (time, zlev, lat, lon).
-    """
-    logger.debug("Starting spatial hash calculation.")
-    if 'zlev' in ds.dims:
-        ds_for_hash = ds.isel(zlev=0)
-        logger.debug("Using first zlev level for hash calculation.")
-    else:
-        ds_for_hash = ds
-        logger.debug("No 'zlev' dimension found; using dataset directly for hash calculation.")
-
-    # Broadcast 1D lat and lon to a 2D grid.
-    lat2d, lon2d = xr.broadcast(ds_for_hash.lat, ds_for_hash.lon)
-    # Expand to include time dimension.
-    if 'time' in ds_for_hash.dims:
-        lat3d = lat2d.expand_dims({'time': ds_for_hash.time}, axis=0)
-        lon3d = lon2d.expand_dims({'time': ds_for_hash.time}, axis=0)
-    else:
-        lat3d, lon3d = lat2d, lon2d
-
-    # Let the output be of object dtype so that each element is a full Python string.
-    hash_array = xr.apply_ufunc(
-        safe_spatial_hash,
-        lat3d, lon3d,
-        ds_for_hash.sst, ds_for_hash.err, ds_for_hash.ice, ds_for_hash.anom,
-        vectorize=True,
-        dask="parallelized",
-        output_dtypes=[object]
-    )
-    hash_array.name = "spatial_hash"
-    hash_array = hash_array.assign_coords(time=ds_for_hash.time, lat=ds_for_hash.lat, lon=ds_for_hash.lon)
+# Set once this process has written a day, after which the first-write cost is paid.
+_process_warm = False
 
-    # If the original dataset has 'zlev', add it back as a singleton dimension.
-    if 'zlev' in ds.dims:
-        hash_array = hash_array.expand_dims('zlev', axis=1)
-        hash_array = hash_array.assign_coords(zlev=ds.zlev)
-        logger.debug("Expanded spatial hash to include singleton 'zlev' dimension.")
-    logger.debug("Completed spatial hash calculation.")
-    return hash_array
+# Chunks used when the conversion config has none; the same as config/app_config.json
+# (scripts/analyze_netcdf.py --tune measures the alternatives).
+DEFAULT_CHUNKS = {'time': 1, 'zlev': 1, 'lat': 180, 'lon': 360}
+# Modules whose INFO logs narrate each conversion step (see quiet_conversion_logs).
+CONVERSION_LOGGERS = ("ecs.converter", "ecs.batch_conversion", "ecs.cell_layout", "ecs.deferred_hashes",
+                      "ecs.hashing", "ecs.memory_planner", "ecs.packing", "ecs.store_writes")
 
 def extract_date_from_filename(filepath, suffix):
     """
@@ -109,7 +55,10 @@ def load_dataset(netcdf_file, suffix, conversion_config=None):
     rechunk the dataset (using conversion_config if provided), and extract the new time dimension.
     """
     logger.info(f"Opening dataset from {netcdf_file}")
-    ds = xr.open_dataset(netcdf_file, engine="h5netcdf")
+    if netcdf_file.startswith("s3://"):
+        ds = xr.open_dataset(get_source_filesystem().open(netcdf_file[len("s3://"):], "rb"), engine="h5netcdf")
+    else:
+        ds = xr.open_dataset(netcdf_file, engine="h5netcdf")
     logger.info("Dataset loaded successfully.")
     
     # Add 'zlev' dimension if missing.
@@ -131,8 +80,11 @@ def load_dataset(netcdf_file, suffix, conversion_config=None):
                     ds[var] = ds[var].chunk(valid_chunks)
     else:
         # Use a default chunking if none specified.
-        ds = ds.chunk({'time': 1, 'zlev': 1, 'lat': 72, 'lon': 144})
-        logger.info("Rechunked dataset with default chunks: {'time': 1, 'zlev': 1, 'lat': 72, 'lon': 144}")
+        ds = ds.chunk(DEFAULT_CHUNKS)
+        logger.info(f"Rechunked dataset with default chunks: {DEFAULT_CHUNKS}")
+    
+    ds = apply_packing(ds, conversion_config)
+    ds = apply_time_delta(ds, conversion_config)
     
     try:
         new_time = extract_date_from_filename(netcdf_file, suffix).replace(hour=12, minute=0, second=0)
@@ -142,92 +94,148 @@ def load_dataset(netcdf_file, suffix, conversion_config=None):
         raise
     return ds, new_time
 
-def add_spatial_hashes(ds):
-    """
-    Compute spatial hashes and add the 'spatial_hash' variable to the dataset.
-    """
-    logger.info("Calculating spatial hashes lazily...")
-    spatial_hashes = calculate_dataset_hashes(ds)
-    ds['spatial_hash'] = spatial_hashes
-    logger.info("Spatial hashes added to dataset.")
-    return ds
 
 def add_verifier_pubkeys(ds):
     """
     Add a new variable for verifier public keys.
     (Initially, these are empty strings and will be appended later.)
+    The variable is lazy when the hashes are a dask array, and follows their layout:
+    the (zlev, lat, lon) grid, or the ocean cells when they are packed (see ecs.cell_layout.apply_cell_layout).
     """
     max_verifiers = 10
-    time_len = ds.sizes.get("time", 1)
-    nlat = ds.sizes.get("lat", len(ds.lat))
-    nlon = ds.sizes.get("lon", len(ds.lon))
-    zlev_size = ds.sizes.get("zlev", 1)
-    shape = (time_len, zlev_size, nlat, nlon, max_verifiers)
+    reference = ds["spatial_hash"] if "spatial_hash" in ds else None
+    if reference is not None and CELL_DIM in reference.dims:
+        dims = reference.dims + ("verifier",)
+        shape = reference.shape + (max_verifiers,)
+    else:
+        time_len = ds.sizes.get("time", 1)
+        nlat = ds.sizes.get("lat", len(ds.lat))
+        nlon = ds.sizes.get("lon", len(ds.lon))
+        zlev_size = ds.sizes.get("zlev", 1)
+        dims = ("time", "zlev", "lat", "lon", "verifier")
+        shape = (time_len, zlev_size, nlat, nlon, max_verifiers)
     logger.info(f"Adding verifier_pubkeys variable with shape {shape}")
-    verifier_array = np.full(shape, "", dtype=object)
-    ds["verifier_pubkeys"] = (("time", "zlev", "lat", "lon", "verifier"), verifier_array)
+    # Chunked like the hashes, so the empty slots are created and written one chunk at a
+    # time instead of as a dense object array for the whole day.
+    data = reference.data if reference is not None else None
+    if isinstance(data, da.Array) and data.ndim == len(dims) - 1:
+        verifier_array = da.full(shape, "", dtype=object, chunks=data.chunks + ((max_verifiers,),))
+    else:
+        verifier_array = np.full(shape, "", dtype=object)
+    ds["verifier_pubkeys"] = (dims, verifier_array)
     return ds
 
-def write_to_zarr(ds, zarr_store, new_time):
-    """
-    Write the dataset to a Zarr store on S3.
-    For local testing, if the environment variable OVERWRITE_ZARR_STORE is set to true,
-    the existing store is removed and a new one is created.
-    Otherwise, if a store exists, the new time slice is either appended or overwrites an existing one.
-    """
-    logger.info(f"Preparing to write dataset to Zarr store at {zarr_store}")
-    fs = fsspec.filesystem("s3", asynchronous=False)
-    # Remove extra "s3://" if present.
-    zarr_store_path = zarr_store.replace("s3://", "")
-    store = zarr.storage.FsspecStore(fs=fs, read_only=False, path=zarr_store_path)
-    
-    # For local development, optionally force a new store.
-    overwrite_store = os.environ.get("OVERWRITE_ZARR_STORE", "false").lower() in ("true", "1")
-    if overwrite_store:
-        logger.info("OVERWRITE_ZARR_STORE is true; removing existing store if any.")
-        try:
-            fs.rm(zarr_store_path, recursive=True)
-        except Exception as e:
-            logger.warning(f"Failed to remove existing store: {e}")
-        logger.info("Creating a new Zarr store.")
-        ds.to_zarr(store, mode="w")
-        zarr.consolidate_metadata(store)
-        logger.info(f"Created new Zarr store at {zarr_store}")
-    else:
-        try:
-            existing_ds = xr.open_zarr(store, consolidated=True)
-            logger.info("Existing Zarr store found.")
-            existing_times = pd.to_datetime(existing_ds["time"].values)
-            if new_time in existing_times:
-                logger.info(f"Time slice {new_time} already exists. Overwriting it.")
-                updated_ds = existing_ds.drop_sel(time=new_time)
-                final_ds = xr.concat([updated_ds, ds], dim="time").sortby("time")
-                final_ds.to_zarr(store, mode="w")
-                zarr.consolidate_metadata(store)
-                logger.info(f"Overwrote time slice {new_time} in Zarr store.")
-            else:
-                ds.to_zarr(store, mode="a", append_dim="time")
-                logger.info(f"Appended new date {new_time} to existing Zarr store.")
-        except (FileNotFoundError, zarr.errors.ContainsArrayAndGroupError) as e:
-            logger.info("No existing Zarr store found or error encountered; creating a new one.")
-            ds.to_zarr(store, mode="w")
-            zarr.consolidate_metadata(store)
-            logger.info(f"Created new Zarr store at {zarr_store}.")
-    return
 
-def convert_netcdf_to_zarr(netcdf_file, zarr_store, suffix, conversion_config=None):
+def record_io(metrics, before, name):
+    """Add the storage requests made since `before` (an io_stats snapshot) to the metrics and log them."""
+    summary = summarize_io(io_stats.since(before))
+    metrics.properties["io"] = summary
+    for metric, value in io_metrics(summary).items():
+        metrics.count(metric, value, "Bytes" if metric.startswith("io.bytes") else "Count")
+    operations = ", ".join(f"{operation} {values['requests']}" for operation, values in summary["operations"].items())
+    kinds = ", ".join(f"{kind} {values['requests']}" for kind, values in summary["by_kind"].items())
+    logger.info(f"Storage requests for {name}: {summary['requests']} ({operations}; {kinds}), "
+                f"{summary['bytes_in']} bytes in, {summary['bytes_out']} bytes out")
+
+def convert_netcdf_to_zarr(netcdf_file, zarr_store, suffix, conversion_config=None, write_mode="append"):
     """
     Main function to convert a NetCDF file to a Zarr store.
     It loads and prepares the dataset (using conversion_config for rechunking),
     adds spatial hashes and verifier public keys, and writes the dataset to the specified Zarr store.
+    With write_mode="region" the day is written into its slot of a pre-sized store instead
+    of being appended (used by the backfill).
+    If conversion_config["dask"] (or the DASK_* environment) selects a distributed
+    scheduler, every stage runs on that cluster. Otherwise a memory budget
+    (memory_budget_bytes) picks the chunks and threads with plan_memory_budget, and a
+    conversion that cannot fit fails with MemoryError instead of being OOM-killed.
+    Each stage (download, hashing, verifier_allocation, metadata_open, upload, aggregates)
+    is materialized before the next starts, so its wall time, CPU time, bytes, cells and
+    peak memory are measured separately. On a distributed cluster the stages stay lazy
+    (persisted chunks written with explicit encoding chunks fail there) and the task
+    stream summary attributes the work instead. The storage requests made (see
+    ecs.io_accounting) are added as io.* metrics. The measurements are emitted as one
+    structured record (see ecs.metrics) and returned.
+    If conversion_config["diagnostics"] (or CONVERSION_DIAGNOSTICS) is set, the dask work
+    is also profiled and a per-task report is written (see ecs.diagnostics).
+    With conversion_config["land_mask"], land cells get empty hashes, so chunks that are
+    all land are not stored (see ecs.land_mask for the chunk-presence index).
+    With conversion_config["cell_layout"] = "ocean", a new store holds the hashes and
+    verifier slots of ocean cells only (see ecs.cell_layout.apply_cell_layout).
+    With conversion_config["hash_phase"] = "deferred", the day is published without its
+    spatial hashes and marked hash_pending; the caller attaches them with ecs.deferred_hashes.attach_hashes
+    (the returned record has hash_pending set).
     """
+    global _process_warm
     logger.info(f"Starting conversion for file: {netcdf_file}")
+    options = conversion_options(conversion_config)
+    client = get_dask_client(options.dask)
+    budget = memory_budget_bytes(options.config)
+    metrics = ConversionMetrics(file=netcdf_file, store=zarr_store, write_mode=write_mode)
+    deferred = options.deferred_hashes
+    report_name = os.path.splitext(os.path.basename(netcdf_file))[0]
+    diagnostics = {}
+    io_before = io_stats.snapshot()
+
     try:
-        ds, new_time = load_dataset(netcdf_file, suffix, conversion_config)
-        ds = add_spatial_hashes(ds)
-        ds = add_verifier_pubkeys(ds)
-        write_to_zarr(ds, zarr_store, new_time)
+        with collect_task_stream(client, metrics), \
+                profile_conversion(client, diagnostics_location(zarr_store, options.config), report_name,
+                                   {"file": netcdf_file, "store": zarr_store, "write_mode": write_mode}) as diagnostics:
+            # The planned threads are passed to each compute: dask's configuration is shared
+            # by the conversions a worker runs concurrently.
+            num_workers = None
+            with metrics.stage("download") as stage:
+                ds, new_time = load_dataset(netcdf_file, suffix, options.config)
+                if budget and client is None:
+                    plan = plan_memory_budget(ds, budget, store_chunk_cells(zarr_store),
+                                              aggregates=options.aggregates is not None and write_mode != "region",
+                                              first_write=not _process_warm)
+                    ds = ds.chunk(plan["chunks"])
+                    num_workers = plan["num_workers"]
+                    metrics.properties["memory_plan"] = plan
+                if client is None:
+                    ds = ds.persist(**compute_options(num_workers))
+                stage["bytes_in"] = source_size(netcdf_file)
+                stage["cells"] = grid_cells(ds)
+            metrics.properties["time"] = str(new_time)
+            metrics.properties["hash_pending"] = deferred
+            if deferred:
+                # The science variables are published first; attach_hashes fills the hashes in.
+                ds = apply_cell_layout(add_pending_hashes(ds), zarr_store, options)
+            else:
+                with metrics.stage("hashing") as stage:
+                    ds = add_spatial_hashes(ds, options.land_mask)
+                    ds = apply_cell_layout(ds, zarr_store, options)
+                    if client is None:
+                        ds["spatial_hash"] = ds["spatial_hash"].persist(**compute_options(num_workers))
+                    stage["bytes_out"] = payload_bytes(ds[["spatial_hash"]])
+                    stage["cells"] = ds["spatial_hash"].size
+            if tracks_hash_status(zarr_store, options):
+                ds = add_hash_status(ds, pending=deferred)
+            with metrics.stage("verifier_allocation") as stage:
+                ds = add_verifier_pubkeys(ds)
+                stage["cells"] = grid_cells(ds)
+            if write_mode == "region":
+                write_region_to_zarr(ds, zarr_store, new_time, metrics=metrics, num_workers=num_workers)
+            else:
+                write_to_zarr(ds, zarr_store, new_time, options, metrics=metrics, num_workers=num_workers)
+        metrics.properties["diagnostics_report"] = diagnostics.get("report")
+        record_io(metrics, io_before, report_name)
         logger.info(f"Successfully processed and written to {zarr_store}")
     except Exception as e:
         logger.error(f"Failed to process {netcdf_file}: {str(e)}")
+        metrics.properties["diagnostics_report"] = diagnostics.get("report")
+        record_io(metrics, io_before, report_name)
+        emit_metrics(metrics.to_record(status="failed", error=str(e)))
         raise
+    finally:
+        release_memory()
+    _process_warm = True
+    record = metrics.to_record()
+    emit_metrics(record)
+    return record
+
+
+def quiet_conversion_logs(level=logging.WARNING):
+    """Raise the log level of the conversion modules, for scripts that report their own progress."""
+    for name in CONVERSION_LOGGERS:
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,71 @@
+import logging
+import os
+from contextlib import contextmanager
+from dask.utils import key_split
+
+logger = logging.getLogger(__name__)
+
+_dask_client = None
+
+def get_dask_client(dask_config=None):
+    """
+    Return the distributed client for the configured execution mode, or None to keep
+    the default local scheduler.
+    A scheduler address (DASK_SCHEDULER_ADDRESS or dask_config["scheduler_address"])
+    connects to an existing cluster; otherwise n_workers (DASK_N_WORKERS) starts a
+    LocalCluster with threads_per_worker (DASK_THREADS_PER_WORKER) threads per worker,
+    using processes unless dask_config["processes"] is false.
+    The client is created once per process and reused.
+    """
+    global _dask_client
+    dask_config = dask_config or {}
+    address = os.environ.get("DASK_SCHEDULER_ADDRESS") or dask_config.get("scheduler_address")
+    n_workers = os.environ.get("DASK_N_WORKERS") or dask_config.get("n_workers")
+    if not address and not n_workers:
+        return None
+    if _dask_client is None:
+        from distributed import Client, LocalCluster
+        if address:
+            logger.info(f"Connecting to Dask scheduler at {address}")
+            _dask_client = Client(address)
+        else:
+            threads = int(os.environ.get("DASK_THREADS_PER_WORKER") or dask_config.get("threads_per_worker", 1))
+            processes = dask_config.get("processes", True)
+            logger.info(f"Starting LocalCluster with {n_workers} worker(s), {threads} thread(s) each, processes={processes}")
+            cluster = LocalCluster(n_workers=int(n_workers), threads_per_worker=threads, processes=processes)
+            _dask_client = Client(cluster)
+        logger.info(f"Dask dashboard: {_dask_client.dashboard_link}")
+    return _dask_client
+
+def summarize_task_stream(records):
+    """
+    Summarize distributed task-stream records into per-task-prefix and per-worker
+    totals (task count, compute and transfer seconds, output bytes).
+    """
+    by_prefix = {}
+    by_worker = {}
+    for record in records:
+        prefix = by_prefix.setdefault(key_split(record["key"]), {"tasks": 0, "compute_seconds": 0.0, "transfer_seconds": 0.0, "nbytes": 0})
+        worker = by_worker.setdefault(record.get("worker", "unknown"), {"tasks": 0, "compute_seconds": 0.0})
+        prefix["tasks"] += 1
+        worker["tasks"] += 1
+        prefix["nbytes"] += record.get("nbytes") or 0
+        for startstop in record.get("startstops", []):
+            duration = startstop["stop"] - startstop["start"]
+            if startstop["action"] == "compute":
+                prefix["compute_seconds"] += duration
+                worker["compute_seconds"] += duration
+            elif startstop["action"] == "transfer":
+                prefix["transfer_seconds"] += duration
+    return {"by_prefix": by_prefix, "by_worker": by_worker}
+
+@contextmanager
+def collect_task_stream(client, metrics):
+    """Record a summary of the distributed task stream on metrics when a client is active."""
+    if client is None:
+        yield
+        return
+    from distributed import get_task_stream
+    with get_task_stream(client) as task_stream:
+        yield
+    metrics.properties["dask_tasks"] = summarize_task_stream(task_stream.data)
@@ -0,0 +1,102 @@
+import logging
+import numpy as np
+import pandas as pd
+import dask.array as da
+import zarr
+import zarr.errors
+from ecs.cell_layout import apply_cell_layout
+from ecs.conversion_options import conversion_options
+from ecs.hashing import add_spatial_hashes
+from ecs.land_mask import MASK_VARIABLES
+from ecs.memory_planner import grid_cells, release_memory
+from ecs.metrics import ConversionMetrics, emit_metrics
+from ecs.store_io import split_store_url, get_store, get_time_index, open_variables
+from ecs.store_writes import write_lock, write_days, payload_bytes
+
+logger = logging.getLogger(__name__)
+
+# Per-day marker variable: 1 while the day's spatial hashes are still to be attached.
+HASH_PENDING = "hash_pending"
+
+def add_pending_hashes(ds):
+    """
+    Add empty spatial hashes (the fill value, so nothing is stored) shaped and chunked
+    like sst, for the first phase of a deferred conversion (see attach_hashes).
+    """
+    reference = ds["sst"]
+    if isinstance(reference.data, da.Array):
+        data = da.full(reference.shape, "", dtype=object, chunks=reference.data.chunks)
+    else:
+        data = np.full(reference.shape, "", dtype=object)
+    ds["spatial_hash"] = (reference.dims, data)
+    return ds
+
+def tracks_hash_status(zarr_store, conversion_config=None):
+    """
+    True if the days written to a store carry the hash_pending marker: with the deferred
+    hash phase, or when the store already has the marker (it was created deferred), which
+    has to keep up with its time axis. Other stores never get the variable.
+    """
+    options = conversion_options(conversion_config)
+    if options.deferred_hashes:
+        return True
+    if options.overwrite_store:
+        return False
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    try:
+        group = zarr.open_group(store=get_store(zarr_store_path, protocol), mode="r", use_consolidated=True)
+    except (FileNotFoundError, zarr.errors.ContainsArrayAndGroupError):
+        return False
+    return HASH_PENDING in group.array_keys()
+
+def add_hash_status(ds, pending):
+    """Add the per-day hash_pending marker, set while the day's spatial hashes are still to be attached."""
+    ds[HASH_PENDING] = (("time",), da.full(ds.sizes["time"], 1 if pending else 0, dtype=np.uint8, chunks=1), {
+        "long_name": "Spatial hashes pending",
+        "description": "1 while the spatial hashes of the day have not been attached yet",
+    })
+    return ds
+
+def attach_hashes(zarr_store, new_time, conversion_config=None):
+    """
+    Second phase of a deferred conversion: compute the spatial hashes of a published
+    day from the values stored for it, region-write them and clear the day's
+    hash_pending marker. The stored values decode to exactly the source's, so the
+    hashes equal those of an inline conversion. Any worker with access to the store
+    can run it. Returns the metrics record.
+    """
+    options = conversion_options(conversion_config)
+    new_time = pd.Timestamp(new_time)
+    logger.info(f"Attaching spatial hashes for {new_time} in {zarr_store}")
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    store = get_store(zarr_store_path, protocol)
+    metrics = ConversionMetrics(operation="attach_hashes", store=zarr_store, time=str(new_time))
+    try:
+        with metrics.stage("metadata_open"):
+            existing_times = get_time_index(store, zarr_store_path)
+        if new_time not in existing_times:
+            raise ValueError(f"Time {new_time} is not in {zarr_store}")
+        index = existing_times.get_loc(new_time)
+        with metrics.stage("download") as stage:
+            ds = open_variables(store, list(MASK_VARIABLES), chunks={}).isel(time=[index]).persist()
+            stage["cells"] = grid_cells(ds)
+        with metrics.stage("hashing") as stage:
+            ds = add_spatial_hashes(ds, options.land_mask)
+            ds = apply_cell_layout(ds, zarr_store, options, check=False)
+            ds["spatial_hash"] = ds["spatial_hash"].persist()
+            stage["bytes_out"] = payload_bytes(ds[["spatial_hash"]])
+            stage["cells"] = ds["spatial_hash"].size
+        ds = add_hash_status(ds[["spatial_hash"]], pending=False)
+        with metrics.stage("upload") as stage:
+            with write_lock:
+                write_days(ds, store, index)
+            stage["bytes_out"] = payload_bytes(ds)
+    except Exception as e:
+        logger.error(f"Failed to attach spatial hashes for {new_time}: {str(e)}")
+        emit_metrics(metrics.to_record(status="failed", error=str(e)))
+        raise
+    finally:
+        release_memory()
+    record = metrics.to_record()
+    emit_metrics(record)
+    return record
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+import dask
+import fsspec
+from dask.diagnostics import Profiler, ResourceProfiler
+from dask.utils import key_split
+
+logger = logging.getLogger(__name__)
+
+SLOWEST_TASKS = int(os.environ.get("DIAGNOSTICS_SLOWEST_TASKS", "10"))
+
+def diagnostics_location(zarr_store, conversion_config=None):
+    """
+    Where profiling reports go, or None if profiling is off. CONVERSION_DIAGNOSTICS
+    (or conversion_config["diagnostics"]) is a local directory or URL, or "store" for
+    a diagnostics prefix next to the Zarr store (like the aggregates).
+    """
+    location = os.environ.get("CONVERSION_DIAGNOSTICS") or (conversion_config or {}).get("diagnostics")
+    if not location or location == "off":
+        return None
+    if location != "store":
+        return location.rstrip("/")
+    protocol, path = zarr_store.split("://", 1) if "://" in zarr_store else ("s3", zarr_store)
+    path = path.rstrip("/")
+    # A bare bucket has no sibling prefix; fall back to a prefix inside it.
+    path = f"{path}/diagnostics" if "/" not in path.lstrip("/") else f"{path}-diagnostics"
+    return f"{protocol}://{path}"
+
+def _chunk_index(key):
+    """Chunk index of a dask array task key, e.g. [0, 2, 1]; [] for other keys."""
+    return list(key[1:]) if isinstance(key, tuple) else []
+
+def _local_records(profiler, start):
+    """Task records from the local scheduler's Profiler; workers are scheduler threads."""
+    return [
+        {
+            "key": str(task.key),
+            "prefix": key_split(task.key),
+            "chunk": _chunk_index(task.key),
+            "worker": f"thread-{task.worker_id}",
+            "start": task.start_time - start,
+            "stop": task.end_time - start,
+            "duration": task.end_time - task.start_time,
+        }
+        for task in profiler.results
+    ]
+
+def _distributed_records(task_stream, start):
+    """Task records from a distributed task stream; only compute time counts as busy."""
+    records = []
+    for record in task_stream:
+        for startstop in record.get("startstops", []):
+            if startstop["action"] != "compute":
+                continue
+            records.append({
+                "key": str(record["key"]),
+                "prefix": key_split(record["key"]),
+                "chunk": _chunk_index(record["key"]),
+                "worker": record.get("worker"),
+                "start": startstop["start"] - start,
+                "stop": startstop["stop"] - start,
+                "duration": startstop["stop"] - startstop["start"],
+            })
+    return records
+
+def summarize_tasks(records, wall_seconds, slots):
+    """
+    Summarize task records: per-prefix totals, per-worker busy time and utilization
+    (busy time over wall time), overall utilization of `slots` worker threads and the
+    slowest tasks.
+    """
+    by_prefix, by_worker = {}, {}
+    for record in records:
+        prefix = by_prefix.setdefault(record["prefix"], {"tasks": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        prefix["tasks"] += 1
+        prefix["total_seconds"] += record["duration"]
+        prefix["max_seconds"] = max(prefix["max_seconds"], record["duration"])
+        worker = by_worker.setdefault(record["worker"], {"tasks": 0, "busy_seconds": 0.0})
+        worker["tasks"] += 1
+        worker["busy_seconds"] += record["duration"]
+    for prefix in by_prefix.values():
+        prefix["mean_seconds"] = prefix["total_seconds"] / prefix["tasks"]
+    for worker in by_worker.values():
+        worker["utilization"] = worker["busy_seconds"] / wall_seconds if wall_seconds else 0.0
+    busy = sum(worker["busy_seconds"] for worker in by_worker.values())
+    return {
+        "tasks": len(records),
+        "task_seconds": busy,
+        "slots": slots,
+        "utilization": busy / (wall_seconds * slots) if wall_seconds and slots else 0.0,
+        "by_prefix": dict(sorted(by_prefix.items(), key=lambda item: -item[1]["total_seconds"])),
+        "by_worker": by_worker,
+        "slowest": sorted(records, key=lambda record: -record["duration"])[:SLOWEST_TASKS],
+    }
+
+def write_report(location, name, report, html_path=None):
+    """Write the JSON report (and the HTML performance report, if any) under location; return the JSON URL."""
+    fs, root = fsspec.core.url_to_fs(location)
+    fs.makedirs(root, exist_ok=True)
+    stem = f"{name}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}"
+    with fs.open(f"{root}/{stem}.json", "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    if html_path:
+        fs.put_file(html_path, f"{root}/{stem}.html")
+    return f"{location}/{stem}.json"
+
+@contextmanager
+def profile_conversion(client, location, name, properties=None):
+    """
+    Profile the dask work run inside the block and write a report under `location`
+    named after `name`: every task with its worker and duration, per-prefix totals,
+    worker utilization and (on the local scheduler) process CPU and memory samples.
+    On a distributed client an HTML performance report is added when bokeh is
+    installed. The slowest tasks are logged. Yields a dict that receives the report
+    URL as "report". The report is written even if the block fails.
+    With the local scheduler the profiler sees every task in the process, so
+    concurrent conversions end up in each other's reports.
+    """
+    handle = {}
+    if location is None:
+        yield handle
+        return
+    wall_start, epoch_start = time.perf_counter(), time.time()
+    error = None
+    with tempfile.TemporaryDirectory(prefix="dask-report-") as tmp_dir:
+        html_path = None
+        if client is None:
+            with Profiler() as profiler, ResourceProfiler(dt=0.25) as resources:
+                try:
+                    yield handle
+                except Exception as e:
+                    error = e
+            records = _local_records(profiler, wall_start)
+            samples = resources.results
+            slots = dask.config.get("num_workers", None) or os.cpu_count() or 1
+        else:
+            from distributed import get_task_stream, performance_report
+            try:
+                import bokeh  # noqa: F401 (performance_report renders with bokeh)
+                html_path = os.path.join(tmp_dir, "performance-report.html")
+            except ImportError:
+                logger.info("bokeh is not installed; skipping the HTML performance report")
+            with get_task_stream(client) as task_stream:
+                with performance_report(filename=html_path) if html_path else nullcontext():
+                    try:
+                        yield handle
+                    except Exception as e:
+                        error = e
+            records = _distributed_records(task_stream.data, epoch_start)
+            samples = []
+            slots = sum(client.nthreads().values()) or 1
+        wall_seconds = time.perf_counter() - wall_start
+
+        summary = summarize_tasks(records, wall_seconds, slots)
+        report = {
+            "name": name,
+            "status": "success" if error is None else "failed",
+            "error": None if error is None else str(error),
+            "scheduler": "local" if client is None else "distributed",
+            "wall_seconds": wall_seconds,
+            **(properties or {}),
+            **summary,
+            "resources": {
+                "max_memory_mb": max((sample.mem for sample in samples), default=None),
+                "mean_cpu_percent": sum(sample.cpu for sample in samples) / len(samples) if samples else None,
+            },
+            "task_records": sorted(records, key=lambda record: record["start"]),
+        }
+        slowest = ", ".join(f"{record['prefix']}{record['chunk']} {record['duration']:.3f}s" for record in summary["slowest"])
+        logger.info(f"Slowest tasks in {name}: {slowest}")
+        top_prefixes = ", ".join(f"{prefix} {totals['total_seconds']:.2f}s/{totals['tasks']}"
+                                 for prefix, totals in list(summary["by_prefix"].items())[:5])
+        logger.info(f"Task time by prefix in {name}: {top_prefixes}")
+        logger.info(f"{name}: {summary['tasks']} tasks, {summary['task_seconds']:.1f} task-seconds in "
+                    f"{wall_seconds:.1f}s on {slots} thread(s), utilization {summary['utilization']:.0%}")
+        try:
+            handle["report"] = write_report(location, name, report, html_path)
+            logger.info(f"Wrote conversion diagnostics to {handle['report']}")
+        except Exception as e:
+            logger.warning(f"Failed to write conversion diagnostics to {location}: {e}")
+    if error is not None:
+        raise error
@@ -0,0 +1,105 @@
+import logging
+import struct
+import blake3
+import numpy as np
+import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+def calculate_spatial_hash(lat: float, lon: float, sst: float, err: float, 
+                           ice: float, anom: float) -> str:
+    """Calculate BLAKE3 hash for a specific lat/lon point and its associated values."""
+    try:
+        sst_val = -999.0 if np.isnan(sst) else sst
+        err_val = -999.0 if np.isnan(err) else err
+        ice_val = -999.0 if np.isnan(ice) else ice
+        anom_val = -999.0 if np.isnan(anom) else anom
+        value_bytes = struct.pack('6f', lat, lon, sst_val, err_val, ice_val, anom_val)
+        return blake3.blake3(value_bytes).hexdigest()
+    except Exception as e:
+        logger.error(f"Error calculating hash: {str(e)}")
+        raise
+
+def spatial_hash_batch(lat, lon, sst, err, ice, anom, land_mask=False, hexdigest=True):
+    """
+    calculate_spatial_hash for whole arrays of cells: the six float32 values of every
+    cell are packed by one vectorized cast (the bytes struct.pack('6f') gives) and only
+    the BLAKE3 calls loop. Returns an object array of hex hashes shaped like the
+    broadcast inputs, or with hexdigest=False a (..., 32) uint8 array of raw digests.
+    With land_mask, cells with no value in any variable (land) get "" (zero digests).
+    """
+    lat, lon, sst, err, ice, anom = np.broadcast_arrays(lat, lon, sst, err, ice, anom)
+    shape = lat.shape
+    values = np.stack([lat, lon] + [np.where(np.isnan(v), -999.0, v) for v in (sst, err, ice, anom)],
+                      axis=-1).astype(np.float32).reshape(-1, 6)
+    hashed = np.arange(len(values))
+    if land_mask:
+        hashed = np.flatnonzero(~(np.isnan(sst) & np.isnan(err) & np.isnan(ice) & np.isnan(anom)).ravel())
+    rows = memoryview(np.ascontiguousarray(values[hashed])).cast("B")
+    width = values.itemsize * 6
+    if hexdigest:
+        hashes = np.full(len(values), "", dtype=object)
+        hashes[hashed] = [blake3.blake3(rows[i:i + width]).hexdigest() for i in range(0, len(rows), width)]
+        return hashes.reshape(shape)
+    digests = np.zeros((len(values), 32), dtype=np.uint8)
+    digests[hashed] = np.frombuffer(b"".join(blake3.blake3(rows[i:i + width]).digest()
+                                             for i in range(0, len(rows), width)), dtype=np.uint8).reshape(-1, 32)
+    return digests.reshape(shape + (32,))
+
+def calculate_dataset_hashes(ds: xr.Dataset, land_mask: bool = False) -> xr.DataArray:
+    """
+    Calculate spatial hashes for the dataset.
+    If 'zlev' exists, compute using only the first level, then expand the result
+    to include a singleton 'zlev' dimension so that the output dimensions become (time, zlev, lat, lon).
+    With land_mask, cells with no value in any variable get an empty hash, so chunks
+    that are all land match the fill value and are not stored.
+    """
+    logger.debug("Starting spatial hash calculation.")
+    if 'zlev' in ds.dims:
+        ds_for_hash = ds.isel(zlev=0)
+        logger.debug("Using first zlev level for hash calculation.")
+    else:
+        ds_for_hash = ds
+        logger.debug("No 'zlev' dimension found; using dataset directly for hash calculation.")
+
+    # Broadcast 1D lat and lon to a 2D grid.
+    lat2d, lon2d = xr.broadcast(ds_for_hash.lat, ds_for_hash.lon)
+    # Expand to include time dimension.
+    if 'time' in ds_for_hash.dims:
+        lat3d = lat2d.expand_dims({'time': ds_for_hash.time}, axis=0)
+        lon3d = lon2d.expand_dims({'time': ds_for_hash.time}, axis=0)
+    else:
+        lat3d, lon3d = lat2d, lon2d
+
+    # Each block is hashed by one spatial_hash_batch call. Let the output be of object
+    # dtype so that each element is a full Python string.
+    hash_array = xr.apply_ufunc(
+        spatial_hash_batch,
+        lat3d, lon3d,
+        ds_for_hash.sst, ds_for_hash.err, ds_for_hash.ice, ds_for_hash.anom,
+        kwargs={"land_mask": land_mask},
+        dask="parallelized",
+        output_dtypes=[object]
+    )
+    hash_array.name = "spatial_hash"
+    hash_array = hash_array.assign_coords(time=ds_for_hash.time, lat=ds_for_hash.lat, lon=ds_for_hash.lon)
+
+    # If the original dataset has 'zlev', add it back as a singleton dimension.
+    if 'zlev' in ds.dims:
+        hash_array = hash_array.expand_dims('zlev', axis=1)
+        hash_array = hash_array.assign_coords(zlev=ds.zlev)
+        logger.debug("Expanded spatial hash to include singleton 'zlev' dimension.")
+    logger.debug("Completed spatial hash calculation.")
+    return hash_array
+
+
+def add_spatial_hashes(ds, land_mask=False):
+    """
+    Compute spatial hashes and add the 'spatial_hash' variable to the dataset.
+    With land_mask, land cells get empty hashes (see calculate_dataset_hashes).
+    """
+    logger.info("Calculating spatial hashes lazily...")
+    spatial_hashes = calculate_dataset_hashes(ds, land_mask)
+    ds['spatial_hash'] = spatial_hashes
+    logger.info("Spatial hashes added to dataset.")
+    return ds
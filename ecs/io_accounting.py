@@ -0,0 +1,216 @@
+import copy
+import logging
+import re
+import threading
+import time
+from s3fs import S3FileSystem
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (milliseconds) of the request latency histogram buckets; the last bucket is open.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# S3 bills PUT, COPY, POST and LIST requests at the higher (class A) rate and GET and
+# the rest at the lower (class B) rate; deletes are free.
+CLASS_A_OPERATIONS = {
+    "PutObject", "CopyObject", "CreateMultipartUpload", "UploadPart", "UploadPartCopy",
+    "CompleteMultipartUpload", "ListObjects", "ListObjectsV2", "ListObjectVersions",
+}
+FREE_OPERATIONS = {"DeleteObject", "DeleteObjects", "AbortMultipartUpload"}
+METADATA_NAMES = {"zarr.json", ".zmetadata", ".zarray", ".zattrs", ".zgroup"}
+# Chunk keys: ".../c/0/1/2" (Zarr v3 default encoding) or ".../0.1.2" (v2).
+_CHUNK_KEY = re.compile(r"(/c(/\d+)+|/\d+(\.\d+)*)$")
+# Content-addressed stores (see ecs.chunk_store): chunk blobs, and the manifests and
+# journal entries that map chunk keys to them.
+_BLOB_KEY = re.compile(r"/blobs/[0-9a-f]+$")
+_MANIFEST_KEY = re.compile(r"(/manifest\.json|/chunk_manifest\.json|/journal/[^/]+\.json)$")
+
+def object_kind(operation, key):
+    """Classify a request by what it touches: metadata, chunk, listing or other."""
+    if operation.startswith("List"):
+        return "listing"
+    key = key.rstrip("/")
+    if key.rsplit("/", 1)[-1] in METADATA_NAMES or _MANIFEST_KEY.search(key):
+        return "metadata"
+    if _CHUNK_KEY.search(key) or _BLOB_KEY.search(key):
+        return "chunk"
+    return "other"
+
+def _latency_bucket(seconds):
+    milliseconds = seconds * 1000
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if milliseconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+class IOStats:
+    """
+    Thread-safe request counters for one process, keyed by (operation, object kind):
+    requests, errors, bytes transferred, total latency and a latency histogram.
+    Take a snapshot() before some work and call since() after it to get its share;
+    concurrent conversions in one process show up in each other's share, and requests
+    made by distributed workers are counted in the worker processes, not here.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def record(self, operation, key, nbytes=0, seconds=0.0, error=False, requests=1):
+        kind = object_kind(operation, key)
+        with self.lock:
+            counter = self.counters.setdefault((operation, kind), {
+                "requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0,
+                "latency_ms": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            })
+            counter["requests"] += requests
+            counter["errors"] += int(error)
+            counter["bytes"] += nbytes
+            counter["seconds"] += seconds
+            counter["latency_ms"][_latency_bucket(seconds / requests if requests else seconds)] += requests
+
+    def snapshot(self):
+        with self.lock:
+            return copy.deepcopy(self.counters)
+
+    def since(self, before):
+        """Counters accumulated since `before` (a snapshot)."""
+        delta = {}
+        for key, counter in self.snapshot().items():
+            previous = before.get(key)
+            if previous is None:
+                delta[key] = counter
+                continue
+            change = {field: counter[field] - previous[field] for field in ("requests", "errors", "bytes", "seconds")}
+            change["latency_ms"] = [now - then for now, then in zip(counter["latency_ms"], previous["latency_ms"])]
+            if change["requests"]:
+                delta[key] = change
+        return delta
+
+io_stats = IOStats()
+
+def summarize_io(counters):
+    """
+    Summarize counters (from IOStats.since) as requests and bytes per operation and per
+    object kind, S3 billing class totals and a latency histogram per operation.
+    """
+    bucket_labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+    operations, kinds = {}, {}
+    for (operation, kind), counter in sorted(counters.items()):
+        summary = operations.setdefault(operation, {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0,
+                                                    "latency_ms": dict.fromkeys(bucket_labels, 0)})
+        for field in ("requests", "errors", "bytes", "seconds"):
+            summary[field] += counter[field]
+        for label, count in zip(bucket_labels, counter["latency_ms"]):
+            summary["latency_ms"][label] += count
+        by_kind = kinds.setdefault(kind, {"requests": 0, "bytes": 0})
+        by_kind["requests"] += counter["requests"]
+        by_kind["bytes"] += counter["bytes"]
+    for summary in operations.values():
+        summary["latency_ms"] = {label: count for label, count in summary["latency_ms"].items() if count}
+    return {
+        "requests": sum(summary["requests"] for summary in operations.values()),
+        "class_a_requests": sum(s["requests"] for op, s in operations.items() if op in CLASS_A_OPERATIONS),
+        "class_b_requests": sum(s["requests"] for op, s in operations.items()
+                                if op not in CLASS_A_OPERATIONS and op not in FREE_OPERATIONS),
+        "bytes_in": sum(s["bytes"] for op, s in operations.items() if op == "GetObject"),
+        "bytes_out": sum(s["bytes"] for op, s in operations.items() if op in ("PutObject", "UploadPart")),
+        "operations": operations,
+        "by_kind": kinds,
+    }
+
+def io_metrics(summary):
+    """Flat io.* counters of a summarize_io summary, for a metrics record."""
+    values = {
+        "io.requests": summary["requests"],
+        "io.class_a_requests": summary["class_a_requests"],
+        "io.class_b_requests": summary["class_b_requests"],
+        "io.bytes_in": summary["bytes_in"],
+        "io.bytes_out": summary["bytes_out"],
+    }
+    for operation in ("GetObject", "PutObject", "HeadObject", "ListObjectsV2", "DeleteObjects"):
+        values[f"io.{operation}.requests"] = summary["operations"].get(operation, {}).get("requests", 0)
+    for kind in ("metadata", "chunk"):
+        values[f"io.{kind}.requests"] = summary["by_kind"].get(kind, {}).get("requests", 0)
+    return values
+
+def _body_size(body):
+    """Bytes left to send in a request body (bytes or a seekable file, as botocore passes it)."""
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return len(body)
+    if hasattr(body, "seek") and hasattr(body, "tell"):
+        position = body.tell()
+        end = body.seek(0, 2)
+        body.seek(position)
+        return end - position
+    return 0
+
+def _before_parameter_build(params, context, **kwargs):
+    context["io_start"] = time.perf_counter()
+    context["io_key"] = params.get("Key", params.get("Prefix", ""))
+    context["io_bytes_out"] = _body_size(params.get("Body"))
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    if "io_start" not in context:
+        return
+    error = http_response is None or http_response.status_code >= 400
+    nbytes = parsed.get("ContentLength", 0) if model.name == "GetObject" and not error else context["io_bytes_out"]
+    io_stats.record(model.name, context["io_key"], nbytes, time.perf_counter() - context["io_start"], error=error)
+
+class AccountedS3FileSystem(S3FileSystem):
+    """
+    S3FileSystem that records every S3 API call its client makes (including listing
+    pages and ranged reads of open files) in io_stats.
+    """
+
+    async def set_session(self, refresh=False, kwargs={}):
+        s3 = await super().set_session(refresh, kwargs)
+        if not getattr(s3, "_io_accounted", False):
+            s3.meta.events.register("before-parameter-build.s3", _before_parameter_build)
+            s3.meta.events.register("after-call.s3", _after_call)
+            s3._io_accounted = True
+        return s3
+
+# Methods of a wrapped local filesystem that Zarr calls, and the S3 request each stands for.
+_LOCAL_OPERATIONS = {
+    "_cat_file": "GetObject",
+    "_cat_ranges": "GetObject",
+    "_pipe_file": "PutObject",
+    "_info": "HeadObject",
+    "_exists": "HeadObject",
+    "_ls": "ListObjectsV2",
+    "_find": "ListObjectsV2",
+    "_rm": "DeleteObjects",
+}
+
+def account_local_filesystem(fs):
+    """
+    Record the calls Zarr makes on an AsyncFileSystemWrapper (file:// and memory://
+    stores) in io_stats as the S3 requests they would be, so local runs and benchmarks
+    see the same request counts as S3 (one request per call; s3fs may page long listings).
+    """
+    for name, operation in _LOCAL_OPERATIONS.items():
+        setattr(fs, name, _accounted(getattr(fs, name), operation))
+    return fs
+
+def _accounted(method, operation):
+    async def wrapper(path, *args, **kwargs):
+        paths = path if isinstance(path, list) else [path]
+        start = time.perf_counter()
+        try:
+            result = await method(path, *args, **kwargs)
+        except Exception:
+            io_stats.record(operation, str(paths[0]) if paths else "", seconds=time.perf_counter() - start,
+                            error=True, requests=len(paths) or 1)
+            raise
+        seconds = (time.perf_counter() - start) / (len(paths) or 1)
+        if operation == "GetObject":
+            results = result if isinstance(result, list) else [result]
+            sizes = [_body_size(value) for value in results]
+        elif operation == "PutObject":
+            sizes = [_body_size(args[0] if args else kwargs.get("value"))]
+        else:
+            sizes = [0] * len(paths)
+        for item, nbytes in zip(paths, sizes):
+            io_stats.record(operation, str(item), nbytes, seconds)
+        return result
+    return wrapper
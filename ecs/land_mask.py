@@ -0,0 +1,89 @@
+import logging
+import numpy as np
+import zarr
+
+logger = logging.getLogger(__name__)
+
+# Group attribute holding the chunk-presence index.
+PRESENCE_ATTRIBUTE = "chunk_presence"
+# Variables whose values decide whether a cell holds data.
+MASK_VARIABLES = ("sst", "anom", "err", "ice")
+
+def ocean_mask(ds, variables=MASK_VARIABLES):
+    """
+    Cells (time, ..., lat, lon) where any of the variables has a value; land (and
+    any other cell that is NaN in every variable) is False. Lazy if ds is.
+    """
+    names = [name for name in variables if name in ds]
+    mask = ds[names[0]].notnull()
+    for name in names[1:]:
+        mask = mask | ds[name].notnull()
+    return mask
+
+def chunk_presence(mask, lat_chunk, lon_chunk):
+    """
+    Which lat/lon chunks of a (..., lat, lon) boolean mask hold any True cell, as a
+    (lat chunks, lon chunks) boolean array; leading dimensions are collapsed.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    mask = mask.reshape(-1, *mask.shape[-2:]).any(axis=0)
+    rows = np.logical_or.reduceat(mask, np.arange(0, mask.shape[0], lat_chunk), axis=0)
+    return np.logical_or.reduceat(rows, np.arange(0, mask.shape[1], lon_chunk), axis=1)
+
+def encode_presence(present, lat_chunk, lon_chunk):
+    """The index as a JSON attribute: chunk sizes and one "0"/"1" string per row of chunks."""
+    return {
+        "chunks": [int(lat_chunk), int(lon_chunk)],
+        "variables": list(MASK_VARIABLES),
+        "rows": ["".join("1" if cell else "0" for cell in row) for row in present],
+    }
+
+def decode_presence(attribute):
+    """((lat chunk, lon chunk), boolean presence array) of an encoded index."""
+    present = np.array([[cell == "1" for cell in row] for row in attribute["rows"]], dtype=bool)
+    return tuple(attribute["chunks"]), present
+
+def read_presence(store):
+    """
+    The chunk-presence index of a store as ((lat chunk, lon chunk), presence array),
+    or None if it has none. It is read from the consolidated metadata, so it costs no
+    request beyond opening the store. A chunk marked absent has never held data in any
+    of MASK_VARIABLES: its data chunks (and with the land_mask conversion option, its
+    hash chunks) are not stored and read as fill.
+    """
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    attribute = group.attrs.get(PRESENCE_ATTRIBUTE)
+    return decode_presence(attribute) if attribute else None
+
+def update_presence(store, ds, index=None, create=False):
+    """
+    Add the lat/lon chunks where ds holds data to the store's chunk-presence index and
+    return True if the stored index changed. `index` is the encoded index read before a
+    write that replaced the group attributes (xarray does on append); by default the
+    store's own is used. With create the index is started from ds (for a new store);
+    a store without an index (created before it existed) does not get one, since its
+    earlier days are unknown. The index only grows, so it stays valid for every stored
+    day. Call with the write lock held and consolidate the metadata afterwards if it
+    changed.
+    """
+    group = zarr.open_group(store=store, mode="r+", use_consolidated=False)
+    current = group.attrs.get(PRESENCE_ATTRIBUTE)
+    index = None if create else (index or current)
+    if not index and not create:
+        return False
+    name = next(name for name in MASK_VARIABLES if name in ds)
+    lat_chunk, lon_chunk = group[name].chunks[-2:]
+    present = chunk_presence(ocean_mask(ds).values, lat_chunk, lon_chunk)
+    if index:
+        chunks, stored = decode_presence(index)
+        if chunks == (lat_chunk, lon_chunk) and stored.shape == present.shape:
+            added = present & ~stored
+            if added.any():
+                logger.info(f"{int(added.sum())} chunk(s) hold data for the first time")
+            present = present | stored
+    attribute = encode_presence(present, lat_chunk, lon_chunk)
+    if attribute == current:
+        return False
+    group.attrs.update({PRESENCE_ATTRIBUTE: attribute})
+    logger.info(f"Chunk-presence index: {int(present.sum())} of {present.size} lat/lon chunks hold data")
+    return True
@@ -0,0 +1,119 @@
+import ctypes
+import gc
+import logging
+import os
+import dask.array as da
+import zarr
+import zarr.errors
+from ecs.metrics import rss_bytes
+from ecs.store_io import split_store_url, get_store
+
+logger = logging.getLogger(__name__)
+
+# Memory model used by plan_memory_budget, fitted to the per-stage peak_rss_bytes of
+# conversions of the full 720x1440 grid. A day's decoded variables and hashes stay
+# resident between stages; each running write task holds its chunk of hashes,
+# verifier slots and encoded bytes; the aggregate update reads float64 accumulators
+# for the whole grid; and the first write of a process loads codecs and metadata.
+RESIDENT_BYTES_PER_CELL = 130
+TASK_BYTES_PER_CHUNK_CELL = 400
+AGGREGATE_BYTES_PER_CELL = 120
+FIRST_WRITE_BYTES = 300 * 2**20
+MEMORY_SAFETY_MARGIN = 1.15
+# Smaller chunks multiply the task count (72x144 chunks convert 3-4x slower than 180x360).
+MIN_CHUNK_CELLS = 90 * 180
+
+def grid_cells(ds):
+    """Number of (time, zlev, lat, lon) grid cells in a dataset."""
+    cells = 1
+    for dim in ("time", "zlev", "lat", "lon"):
+        cells *= ds.sizes.get(dim, 1)
+    return cells
+
+def memory_budget_bytes(conversion_config=None):
+    """
+    The RSS ceiling for one conversion: the task budget (MEMORY_BUDGET_MIB or
+    conversion_config["memory_budget_mib"]) shared by conversion_config["concurrent_conversions"]
+    conversions in flight. None if no budget is set.
+    """
+    conversion_config = conversion_config or {}
+    budget_mib = os.environ.get("MEMORY_BUDGET_MIB") or conversion_config.get("memory_budget_mib")
+    if not budget_mib:
+        return None
+    return int(float(budget_mib) * 2**20 / max(1, int(conversion_config.get("concurrent_conversions", 1))))
+
+def store_chunk_cells(zarr_store):
+    """Lat x lon cells per chunk of the hashes in an existing store, or None if there is no store."""
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    try:
+        group = zarr.open_group(store=get_store(zarr_store_path, protocol), mode="r", use_consolidated=True)
+        chunks = group["spatial_hash"].chunks
+    except (FileNotFoundError, KeyError, ValueError, zarr.errors.ContainsArrayAndGroupError):
+        return None
+    return chunks[-2] * chunks[-1]
+
+def estimate_peak_bytes(cells, chunk_cells, threads, write_chunk_cells=None, aggregates=False,
+                        first_write=True, baseline=None):
+    """Estimated peak RSS of converting a day of `cells` grid cells (see the memory model above)."""
+    baseline = rss_bytes() if baseline is None else baseline
+    task_cells = max(chunk_cells, write_chunk_cells or 0)
+    working = threads * task_cells * TASK_BYTES_PER_CHUNK_CELL
+    if aggregates:
+        working = max(working, cells * AGGREGATE_BYTES_PER_CELL)
+    warmup = FIRST_WRITE_BYTES if first_write else 0
+    return int((baseline + warmup + cells * RESIDENT_BYTES_PER_CELL + working) * MEMORY_SAFETY_MARGIN)
+
+def plan_memory_budget(ds, budget_bytes, write_chunk_cells=None, aggregates=False, threads=None, first_write=True):
+    """
+    Pick the lat/lon chunks and the number of dask threads that keep the estimated peak
+    RSS of converting ds under budget_bytes. write_chunk_cells is the chunk size of an
+    existing store (writes are aligned to it); for a new store the planned chunks become
+    the on-disk chunks. Threads are reduced before chunks: the hashing holds the GIL, so
+    threads add little, while small chunks multiply the scheduling overhead.
+    Raises MemoryError if a single thread on the smallest chunks does not fit.
+    """
+    threads = threads or os.cpu_count() or 1
+    reference = next(var for var in ds.data_vars.values()
+                     if isinstance(var.data, da.Array) and "lat" in var.dims and "lon" in var.dims)
+    chunks = dict(zip(reference.dims, reference.data.chunksize))
+    lat_chunk, lon_chunk = chunks["lat"], chunks["lon"]
+    cells = grid_cells(ds)
+    baseline = rss_bytes()
+
+    def estimate():
+        return estimate_peak_bytes(cells, lat_chunk * lon_chunk, threads, write_chunk_cells, aggregates,
+                                   first_write, baseline)
+
+    while estimate() > budget_bytes:
+        if threads > 1:
+            threads -= 1
+        elif lat_chunk * lon_chunk > max(MIN_CHUNK_CELLS, write_chunk_cells or 0):
+            if lon_chunk >= lat_chunk:
+                lon_chunk = (lon_chunk + 1) // 2
+            else:
+                lat_chunk = (lat_chunk + 1) // 2
+        else:
+            raise MemoryError(
+                f"Converting {cells} cells needs about {estimate() / 2**20:.0f} MiB, "
+                f"over the memory budget of {budget_bytes / 2**20:.0f} MiB"
+            )
+    plan = {
+        "chunks": {"lat": lat_chunk, "lon": lon_chunk},
+        "num_workers": threads,
+        "estimated_peak_bytes": estimate(),
+        "budget_bytes": budget_bytes,
+    }
+    logger.info(f"Memory plan: {plan}")
+    return plan
+
+def release_memory():
+    """
+    Free what a finished conversion leaves behind: the hash strings sit in reference
+    cycles until the next garbage collection, and glibc keeps freed heap pages unless
+    trimmed, so a warm worker would otherwise start each day a few hundred MiB higher.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "Databreaker/Conversion")
+# How often resident memory is sampled while a stage runs.
+MEMORY_SAMPLE_SECONDS = float(os.environ.get("MEMORY_SAMPLE_SECONDS", "0.05"))
+
+# Measurements recorded for every stage, with their CloudWatch units.
+STAGE_FIELDS = (
+    ("wall_seconds", "Seconds"),
+    ("cpu_seconds", "Seconds"),
+    ("bytes_in", "Bytes"),
+    ("bytes_out", "Bytes"),
+    ("cells", "Count"),
+    ("peak_rss_bytes", "Bytes"),
+)
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return max_rss_bytes()
+
+def max_rss_bytes():
+    """Highest resident set size this process has reached."""
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class RssSampler(threading.Thread):
+    """Background thread that records the highest resident memory seen until stopped."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_SECONDS):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_bytes()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, rss_bytes())
+        return self.peak
+
+class ConversionMetrics:
+    """
+    Per-stage measurements for one conversion: wall time, CPU time (all threads of the
+    process), bytes in and out, cells processed and the peak resident memory of the
+    process while the stage ran (workers of a distributed cluster are not included).
+    to_record() renders them as a single
+    JSON record in CloudWatch Embedded Metric Format, so the same log line is readable
+    and is turned into metrics by CloudWatch Logs.
+    """
+
+    def __init__(self, operation="convert_netcdf_to_zarr", **properties):
+        self.operation = operation
+        self.properties = properties
+        self.stages = {}
+        self.counters = {}
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure a stage; the yielded dict takes bytes_in, bytes_out and cells. Repeated
+        stages add up, except peak_rss_bytes which keeps the highest peak.
+        """
+        values = self.stages.setdefault(name, {field: 0 for field, _ in STAGE_FIELDS})
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        max_rss_start = max_rss_bytes()
+        sampler = RssSampler()
+        sampler.start()
+        try:
+            yield values
+        finally:
+            values["wall_seconds"] += time.perf_counter() - wall_start
+            values["cpu_seconds"] += time.process_time() - cpu_start
+            peak = sampler.stop()
+            # A new process high-water mark during the stage is exact; sampling can miss short spikes.
+            max_rss_end = max_rss_bytes()
+            if max_rss_end > max_rss_start:
+                peak = max(peak, max_rss_end)
+            values["peak_rss_bytes"] = max(values["peak_rss_bytes"], peak)
+
+    def count(self, name, value, unit="Count"):
+        """Record a conversion-wide metric that is not tied to a stage (e.g. io.requests)."""
+        self.counters[name] = (value, unit)
+
+    def to_record(self, status="success", error=None):
+        """Return the conversion as one metric-friendly record."""
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Operation"]],
+                    "Metrics": [],
+                }],
+            },
+            "Operation": self.operation,
+            "status": status,
+        }
+        record.update(self.properties)
+        if error is not None:
+            record["error"] = error
+        definitions = record["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+        for stage, values in self.stages.items():
+            for field, unit in STAGE_FIELDS:
+                name = f"{stage}.{field}"
+                record[name] = round(values[field], 6) if isinstance(values[field], float) else values[field]
+                definitions.append({"Name": name, "Unit": unit})
+        for name, (value, unit) in self.counters.items():
+            record[name] = value
+            definitions.append({"Name": name, "Unit": unit})
+        record["total.wall_seconds"] = round(time.perf_counter() - self.wall_start, 6)
+        record["total.cpu_seconds"] = round(time.process_time() - self.cpu_start, 6)
+        record["total.peak_rss_bytes"] = max([values["peak_rss_bytes"] for values in self.stages.values()] or [rss_bytes()])
+        definitions.append({"Name": "total.wall_seconds", "Unit": "Seconds"})
+        definitions.append({"Name": "total.cpu_seconds", "Unit": "Seconds"})
+        definitions.append({"Name": "total.peak_rss_bytes", "Unit": "Bytes"})
+        return record
+
+@contextmanager
+def measure(metrics, name):
+    """Measure a stage on `metrics`, or do nothing if no metrics are being collected."""
+    if metrics is None:
+        yield {}
+    else:
+        with metrics.stage(name) as values:
+            yield values
+
+def emit_metrics(record, sink=None):
+    """
+    Emit a metrics record. `sink` (a callable taking the record) overrides the
+    METRICS_SINK setting: "stdout" (default) prints one JSON line, "off" drops the
+    record, and anything else is a file the JSON line is appended to.
+    """
+    if sink is not None:
+        sink(record)
+        return
+    target = os.environ.get("METRICS_SINK", "stdout")
+    if target == "off":
+        return
+    line = json.dumps(record, default=str)
+    if target == "stdout":
+        print(line, flush=True)
+    else:
+        with open(target, "a") as f:
+            f.write(line + "\n")
@@ -0,0 +1,43 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# CF encoding keys that pack a float variable into scaled integers on disk.
+PACKING_KEYS = ("dtype", "scale_factor", "add_offset", "_FillValue", "missing_value")
+
+def apply_packing(ds, conversion_config=None):
+    """
+    Set the integer packing each variable is written with, in its CF encoding. With
+    conversion_config["packing"] == "source" variables keep the scaled int packing of
+    the source file (OISST: int16, scale_factor 0.01); a variable's own "packing"
+    ({"dtype", "scale_factor", "add_offset", "_FillValue"}) packs it explicitly, and
+    "packing": null in a variable writes it as floats. Otherwise the decoded floats are
+    written. The data stays decoded, so the hashes are computed on the same values.
+    Only a new store takes the packing; appends and overwrites follow the store's.
+    """
+    conversion_config = conversion_config or {}
+    for name, var in ds.data_vars.items():
+        var_conf = conversion_config.get("variables", {}).get(name, {})
+        packing = var_conf.get("packing", conversion_config.get("packing"))
+        source_packed = np.issubdtype(np.dtype(var.encoding.get("dtype", var.dtype)), np.integer)
+        if isinstance(packing, dict):
+            for key in PACKING_KEYS:
+                var.encoding.pop(key, None)
+            var.encoding.update(packing)
+        elif packing == "source" and source_packed:
+            continue
+        else:
+            for key in PACKING_KEYS:
+                var.encoding.pop(key, None)
+    packed = [name for name, var in ds.data_vars.items() if "dtype" in var.encoding]
+    if packed:
+        logger.info(f"Packing {', '.join(packed)} as scaled integers")
+    return ds
+
+def packing_encoding(var):
+    """
+    The packing keys and Zarr filters (see ecs.time_delta) of a variable's encoding,
+    to pass with explicit Zarr encoding.
+    """
+    return {key: var.encoding[key] for key in PACKING_KEYS + ("filters",) if key in var.encoding}
@@ -0,0 +1,77 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fsspec
+import pandas as pd
+import xarray as xr
+from ecs.converter import extract_date_from_filename
+
+# Public NOAA OISST v2.1 bucket, with one YYYYMM/ directory per month.
+DEFAULT_SOURCE = "s3://noaa-cdr-sea-surface-temp-optimum-interpolation-pds/data/v2.1/avhrr/"
+
+def storage_options(url):
+    """fsspec options for a source URL; the public NOAA bucket is read anonymously."""
+    return {"anon": True} if url.startswith("s3://") else {}
+
+def enumerate_source_files(source, start, end, suffix):
+    """
+    Return {date: url} for the days in [start, end] found under the source prefix.
+    Month prefixes (YYYYMM/) are listed one by one; a flat directory is listed once.
+    Final files are preferred over files carrying the preliminary suffix.
+    """
+    fs, root = fsspec.core.url_to_fs(source, **storage_options(source))
+    root = root.rstrip("/")
+    paths = []
+    for month in pd.period_range(start, end, freq="M"):
+        month_dir = f"{root}/{month.strftime('%Y%m')}"
+        if fs.exists(month_dir):
+            paths.extend(fs.ls(month_dir, detail=False))
+    if not paths:
+        paths = fs.ls(root, detail=False)
+
+    files = {}
+    for path in paths:
+        if not path.endswith(".nc"):
+            continue
+        try:
+            day = extract_date_from_filename(path, suffix).normalize()
+        except ValueError:
+            continue
+        if not (start <= day <= end):
+            continue
+        is_preliminary = bool(suffix) and suffix in path.split("/")[-1]
+        if day in files and is_preliminary:
+            continue
+        files[day] = fs.unstrip_protocol(path)
+    return dict(sorted(files.items()))
+
+def partition_days(days, days_per_range, time_chunk=1, first_day=None):
+    """
+    Split sorted days into contiguous ranges of at most days_per_range days. With a
+    time_chunk of several days (see ecs.time_delta), the store's time axis from
+    first_day is cut into chunks and every range holds whole chunks (at least one),
+    so no two ranges write the same chunk.
+    """
+    if time_chunk <= 1:
+        return [days[i:i + days_per_range] for i in range(0, len(days), days_per_range)]
+    chunks = {}
+    for day in days:
+        chunks.setdefault((pd.Timestamp(day) - pd.Timestamp(first_day)).days // time_chunk, []).append(day)
+    ranges = []
+    for chunk_days in chunks.values():
+        if ranges and len(ranges[-1]) + len(chunk_days) <= days_per_range:
+            ranges[-1].extend(chunk_days)
+        else:
+            ranges.append(list(chunk_days))
+    return ranges
+
+# Worker processes are spawned rather than forked: the parent already runs zarr's
+# event-loop thread, which a forked child would inherit in a locked state.
+SPAWN_CONTEXT = multiprocessing.get_context("spawn")
+
+def spawn_pool(workers):
+    """A process pool of at most workers spawned processes."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=SPAWN_CONTEXT)
+
+def open_source(url):
+    """Open a source NetCDF file (local or s3://) with h5netcdf."""
+    return xr.open_dataset(fsspec.open(url, "rb", **storage_options(url)).open(), engine="h5netcdf")
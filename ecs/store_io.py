@@ -0,0 +1,164 @@
+import logging
+import fsspec
+import numpy as np
+import pandas as pd
+import xarray as xr
+import zarr
+from zarr.core.sync import sync
+from ecs.chunk_store import ContentAddressedStore, MARKER_KEY
+from ecs.io_accounting import AccountedS3FileSystem, account_local_filesystem
+# Registers the time-delta codec, so stores using it can be read.
+import ecs.time_delta  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+# Hot state reused across conversions in a long-lived worker process.
+_filesystems = {}
+_store_cache = {}
+_time_index_cache = {}
+
+def split_store_url(zarr_store):
+    """
+    Return (protocol, path) for a store location. Locations without a protocol are
+    S3 paths; file:// and memory:// stores are used for local runs and benchmarks.
+    """
+    if "://" in zarr_store:
+        protocol, path = zarr_store.split("://", 1)
+        if protocol == "memory":
+            # The memory filesystem lists paths with a leading slash; match it so Zarr can find its keys.
+            path = "/" + path.lstrip("/")
+        return protocol, path
+    return "s3", zarr_store
+
+def get_filesystem(protocol="s3"):
+    """
+    Return the process-wide filesystem for a protocol, creating it on first use.
+    Its requests are counted in ecs.io_accounting.io_stats.
+    """
+    if protocol not in _filesystems:
+        if protocol == "s3":
+            # AWS_ENDPOINT_URL_S3 points this at a local S3 stand-in (moto, LocalStack).
+            _filesystems[protocol] = AccountedS3FileSystem(asynchronous=False)
+        else:
+            # FsspecStore needs an async filesystem, so the local ones are wrapped.
+            from fsspec.implementations.asyn_wrapper import AsyncFileSystemWrapper
+            options = {"auto_mkdir": True} if protocol == "file" else {}
+            _filesystems[protocol] = account_local_filesystem(AsyncFileSystemWrapper(fsspec.filesystem(protocol, **options)))
+    return _filesystems[protocol]
+
+def remove_paths(fs, paths, recursive=False):
+    """
+    Delete a path (or list of paths) of a store filesystem. Zarr drives the filesystem
+    from its own event loop, which the filesystem's client is bound to, so the call runs there.
+    """
+    sync(fs._rm(paths, recursive=recursive))
+
+def find_files(fs, path):
+    """Files under a path of a store filesystem (path -> details), on Zarr's event loop; empty if there are none."""
+    try:
+        return sync(fs._find(path, detail=True))
+    except FileNotFoundError:
+        return {}
+
+def get_source_filesystem():
+    """
+    Return the process-wide S3 filesystem for reading source files, with its requests
+    counted like the store's. Zarr drives the store filesystem from its own event loop,
+    so sources get a separate client instead of sharing it.
+    """
+    if "s3-source" not in _filesystems:
+        _filesystems["s3-source"] = AccountedS3FileSystem(skip_instance_cache=True)
+    return _filesystems["s3-source"]
+
+def source_size(netcdf_file):
+    """Size in bytes of the source file, or 0 if it cannot be determined."""
+    try:
+        if netcdf_file.startswith("s3://"):
+            return get_source_filesystem().size(netcdf_file[len("s3://"):])
+        fs, path = fsspec.core.url_to_fs(netcdf_file)
+        return fs.size(path)
+    except Exception as e:
+        logger.warning(f"Could not determine the size of {netcdf_file}: {e}")
+        return 0
+
+def get_store(zarr_store_path, protocol="s3", dedup=None):
+    """
+    Return the cached Zarr store object for a path, content addressed (see
+    ecs.chunk_store) if the store was created that way. A path holding no store yet is
+    checked again on the next call. `dedup` picks the layout of a store about to be
+    created (conversion_config["chunk_dedup"]).
+    """
+    key = (protocol, zarr_store_path)
+    store = _store_cache.get(key)
+    if store is None:
+        store = zarr.storage.FsspecStore(fs=get_filesystem(protocol), read_only=False, path=zarr_store_path)
+        if sync(store.exists(MARKER_KEY)):
+            store = _store_cache[key] = ContentAddressedStore(store)
+        elif sync(store.exists("zarr.json")):
+            _store_cache[key] = store
+    if dedup is not None and dedup != isinstance(store, ContentAddressedStore):
+        base = store._store if isinstance(store, ContentAddressedStore) else store
+        store = ContentAddressedStore(base) if dedup else base
+    if dedup is not None:
+        _store_cache[key] = store
+    return store
+
+def get_time_index(store, zarr_store_path):
+    """
+    Return the time index of an existing store.
+    The index is cached per store and only re-read when the length of the time array
+    changes (e.g. another task appended a day), so a warm worker avoids reading it every time.
+    Raises FileNotFoundError if the store does not exist.
+    """
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    time_array = group["time"]
+    cached = _time_index_cache.get(zarr_store_path)
+    if cached is not None and len(cached) == time_array.shape[0]:
+        return cached
+    existing_times = pd.to_datetime(open_variables(store, ["time"])["time"].values)
+    _time_index_cache[zarr_store_path] = existing_times
+    return existing_times
+
+def remember_time_index(zarr_store_path, times):
+    """Cache the time index of a store this process just extended."""
+    _time_index_cache[zarr_store_path] = times
+
+def forget_time_index(zarr_store_path):
+    """Drop the cached time index of a store this process just (re)created."""
+    _time_index_cache.pop(zarr_store_path, None)
+
+def open_variables(store, variables, chunks="auto"):
+    """
+    Open only the given variables (and the coordinates) of the main store. Opening
+    the string variables reads them in full, which for spatial_hash and
+    verifier_pubkeys costs hundreds of MiB per stored day, so the rest is dropped.
+    chunks=None opens lazily indexed arrays instead of dask arrays.
+    Variables packed as scaled 16-bit integers decode to float64 (Zarr attributes do
+    not keep the float32 type of scale_factor); with dask chunks they are rounded back
+    to float32, which gives exactly the values decoded from the source file.
+    """
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    keep = set(variables) | {"time", "zlev", "lat", "lon"}
+    drop = [name for name in group.array_keys() if name not in keep]
+    ds = xr.open_zarr(store, consolidated=True, drop_variables=drop, chunks=chunks)
+    if chunks is not None:
+        for name in variables:
+            if name in ds and is_packed_16bit(ds[name]):
+                ds[name] = ds[name].astype(np.float32)
+    return ds
+
+def time_chunk_days(store):
+    """Most days held by one chunk of an array of a store: 1 unless variables use the time-delta codec."""
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    days = 1
+    for name, array in group.arrays():
+        dims = array.metadata.dimension_names or ()
+        if name != "time" and "time" in dims:
+            days = max(days, array.chunks[dims.index("time")])
+    return days
+
+def is_packed_16bit(var):
+    """True if a variable is stored as scaled integers of at most 16 bits but decoded as float64."""
+    stored = np.dtype(var.encoding.get("dtype", var.dtype))
+    return (np.issubdtype(stored, np.integer) and stored.itemsize <= 2 and var.dtype == np.float64
+            and "scale_factor" in var.encoding)
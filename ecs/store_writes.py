@@ -0,0 +1,368 @@
+import logging
+import threading
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+import dask.array as da
+import zarr
+import zarr.errors
+from ecs.aggregates import has_aggregates, rebuild_aggregates, update_aggregates, reset_aggregates
+from ecs.cell_layout import CELL_DIM, forget_cells
+from ecs.chunk_store import flush_store
+from ecs.conversion_options import conversion_options
+from ecs.land_mask import update_presence, PRESENCE_ATTRIBUTE
+from ecs.metrics import measure
+from ecs.packing import packing_encoding
+from ecs.time_delta import time_chunk
+from ecs.store_io import (
+    split_store_url,
+    get_filesystem,
+    get_store,
+    get_time_index,
+    remember_time_index,
+    forget_time_index,
+    open_variables,
+    remove_paths,
+)
+
+logger = logging.getLogger(__name__)
+
+# Serializes writes so concurrent conversions in one process never append to a store at the same time.
+write_lock = threading.RLock()
+
+# Per-day variable: when (Unix seconds) the day's spatial hashes were last written.
+# Exports compare it with the version they recorded to find the days rewritten since,
+# without listing the store's chunks.
+HASH_VERSION = "hash_version"
+
+def store_chunks(var):
+    """
+    On-disk chunks of a variable in a new store: its dask chunks, one day long, or
+    several days for a variable stored with the time-delta codec (see ecs.time_delta).
+    """
+    chunks = var.data.chunksize if isinstance(var.data, da.Array) else var.shape
+    if "time" not in var.dims:
+        return chunks
+    axis = var.dims.index("time")
+    return chunks[:axis] + (time_chunk(var),) + chunks[axis + 1:]
+
+def chunk_encoding(ds):
+    """
+    On-disk chunks for a new store (see store_chunks). Without them string
+    variables get Zarr's default chunking, which the dask chunks straddle, and
+    parallel tasks would then rewrite the same chunk concurrently. Explicit encoding
+    replaces each variable's own, so its packing (see apply_packing) is carried over.
+    """
+    return {name: {"chunks": store_chunks(var), **packing_encoding(var)}
+            for name, var in ds.data_vars.items() if isinstance(var.data, da.Array)}
+
+def _time_chunks(days, chunk, start):
+    """Dask chunks of `days` days written from time index `start` that end on the store's chunk boundaries."""
+    first = min(days, chunk - start % chunk)
+    rest = days - first
+    return (first,) + (chunk,) * (rest // chunk) + ((rest % chunk,) if rest % chunk else ())
+
+def align_chunks_to_store(ds, store, start=0):
+    """
+    Rechunk dask variables to the on-disk chunks of an existing store, the days
+    written from time index `start` included, so each chunk is written by one task.
+    """
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    for name, var in ds.data_vars.items():
+        if isinstance(var.data, da.Array) and name in group:
+            chunks = dict(zip(var.dims, group[name].chunks))
+            if "time" in chunks:
+                chunks["time"] = _time_chunks(var.sizes["time"], chunks["time"], start)
+            ds[name] = var.chunk(chunks)
+    return ds
+
+def drop_unstored(ds, store):
+    """
+    Drop the data variables an existing store has no array for (it was created before
+    they existed), so writing the rest still succeeds.
+    """
+    group = zarr.open_group(store=store, mode="r", use_consolidated=True)
+    missing = [name for name in ds.data_vars if name not in group]
+    if missing:
+        logger.warning(f"The store has no {', '.join(missing)}; not written")
+    return ds.drop_vars(missing)
+
+def compute_options(num_workers=None):
+    """
+    Keyword arguments computing a conversion's dask work on the threaded scheduler with
+    its own thread count (see plan_memory_budget); none to use the default scheduler.
+    Passed to each compute instead of set in dask's configuration, which is shared by
+    the conversions a worker runs concurrently.
+    """
+    return {} if num_workers is None else {"scheduler": "threads", "num_workers": num_workers}
+
+def add_hash_version(ds):
+    """Stamp the days of a dataset holding spatial hashes with the current time as their hash version."""
+    if "spatial_hash" not in ds:
+        return ds
+    return ds.assign({HASH_VERSION: (("time",), da.full(ds.sizes["time"], time.time(), dtype=np.float64, chunks=1), {
+        "long_name": "Spatial hash version",
+        "description": "Time (seconds since 1970-01-01) the spatial hashes of the day were last written",
+    })})
+
+def payload_bytes(ds):
+    """Uncompressed size of the time-dependent variables of a dataset; strings count by length."""
+    total = 0
+    for var in ds.data_vars.values():
+        if "time" not in var.dims:
+            continue
+        if var.dtype == object:
+            first = var.isel({dim: 0 for dim in var.dims}).values.item()
+            total += var.size * len(str(first).encode("utf-8"))
+        else:
+            total += var.nbytes
+    return total
+
+def write_to_zarr(ds, zarr_store, new_time, conversion_config=None, metrics=None, num_workers=None):
+    """
+    Write the dataset to a Zarr store on S3.
+    For local testing, if the environment variable OVERWRITE_ZARR_STORE is set to true,
+    the existing store is removed and a new one is created.
+    Otherwise, if a store exists, the new time slice is either appended or overwrites an existing one.
+    With conversion_config["aggregates"], the climatology and rolling-window aggregates
+    are updated in place with the written day, or rebuilt if an existing store has none yet.
+    If metrics (a ConversionMetrics) is given, the metadata_open, upload and
+    aggregates stages are recorded on it.
+    With conversion_config["chunk_dedup"], a new store is content addressed (see
+    ecs.chunk_store); an existing store keeps its layout.
+    num_workers limits the threads writing the chunks (see compute_options).
+    """
+    options = conversion_options(conversion_config)
+    logger.info(f"Preparing to write dataset to Zarr store at {zarr_store}")
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    fs = get_filesystem(protocol)
+    store = get_store(zarr_store_path, protocol)
+    with write_lock:
+        _write_dataset(ds, fs, store, zarr_store, zarr_store_path, new_time, options, metrics, num_workers)
+
+def _write_dataset(ds, fs, store, zarr_store, zarr_store_path, new_time, options, metrics=None, num_workers=None):
+    """Append, overwrite or create the store; called with the write lock held."""
+    aggregates_config = options.aggregates
+    previous = None
+    rebuild = False
+    if options.overwrite_store:
+        logger.info("OVERWRITE_ZARR_STORE is true; removing existing store if any.")
+        try:
+            remove_paths(fs, zarr_store_path, recursive=True)
+        except Exception as e:
+            logger.warning(f"Failed to remove existing store: {e}")
+        logger.info("Creating a new Zarr store.")
+        if aggregates_config is not None:
+            reset_aggregates(fs, zarr_store_path, aggregates_config)
+        store = get_store(zarr_store_path, split_store_url(zarr_store)[0], options.chunk_dedup)
+        with measure(metrics, "upload") as stage:
+            create_store(ds, store, num_workers)
+            stage["bytes_out"] = payload_bytes(ds)
+        forget_time_index(zarr_store_path)
+        forget_cells(zarr_store_path)
+        logger.info(f"Created new Zarr store at {zarr_store}")
+    else:
+        try:
+            with measure(metrics, "metadata_open"):
+                existing_times = get_time_index(store, zarr_store_path)
+            logger.info("Existing Zarr store found.")
+            rebuild = aggregates_config is not None and not has_aggregates(fs, zarr_store_path, aggregates_config)
+            if new_time in existing_times:
+                logger.info(f"Time slice {new_time} already exists. Overwriting it.")
+                if aggregates_config is not None and not rebuild:
+                    # Keep the replaced values so they can be removed from the aggregates.
+                    previous = open_variables(store, aggregates_config.get("variables", [])).sel(time=[new_time]).load()
+                # Rewrite only the chunks of that day; the rest of the store is untouched.
+                with measure(metrics, "upload") as stage:
+                    _write_region(ds, store, existing_times.get_loc(new_time), new_time, num_workers)
+                    stage["bytes_out"] = payload_bytes(ds)
+                logger.info(f"Overwrote time slice {new_time} in Zarr store.")
+            else:
+                with measure(metrics, "upload") as stage:
+                    append_to_store(ds, store, len(existing_times), num_workers)
+                    stage["bytes_out"] = payload_bytes(ds)
+                remember_time_index(zarr_store_path, existing_times.append(pd.to_datetime(ds["time"].values)))
+                logger.info(f"Appended new date {new_time} to existing Zarr store.")
+        except (FileNotFoundError, zarr.errors.ContainsArrayAndGroupError):
+            logger.info("No existing Zarr store found or error encountered; creating a new one.")
+            if aggregates_config is not None:
+                reset_aggregates(fs, zarr_store_path, aggregates_config)
+            store = get_store(zarr_store_path, split_store_url(zarr_store)[0], options.chunk_dedup)
+            with measure(metrics, "upload") as stage:
+                create_store(ds, store, num_workers)
+                stage["bytes_out"] = payload_bytes(ds)
+            forget_time_index(zarr_store_path)
+            forget_cells(zarr_store_path)
+            logger.info(f"Created new Zarr store at {zarr_store}.")
+    if aggregates_config is not None:
+        with measure(metrics, "aggregates"):
+            if rebuild:
+                logger.warning(f"{zarr_store} has no aggregates yet; rebuilding them from the whole store")
+                rebuild_aggregates(fs, zarr_store_path, aggregates_config, store=store)
+            else:
+                update_aggregates(fs, zarr_store_path, ds, new_time, previous, aggregates_config)
+
+def create_presized_store(ds, zarr_store, times, dedup=False):
+    """
+    Create a Zarr store whose time axis already holds every timestamp in `times`.
+    Only metadata and coordinates are written; `ds` (a prepared single-day dataset)
+    serves as the template for variables, dtypes, chunking and attributes. Days are
+    filled later with write_region_to_zarr, which lets many workers write in parallel.
+    With dedup the store is content addressed (see ecs.chunk_store).
+    """
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    store = get_store(zarr_store_path, protocol, dedup)
+    times = pd.DatetimeIndex(times)
+    # Days not written yet have no hash version (the NaN fill).
+    ds = add_hash_version(ds)
+    data_vars = {}
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if "time" not in var.dims:
+            data_vars[name] = var
+            continue
+        shape = (len(times),) + var.shape[1:]
+        chunks = store_chunks(var)
+        if var.dtype == object:
+            data = da.full(shape, "", chunks=chunks, dtype=object)
+        else:
+            data = da.empty(shape, chunks=chunks, dtype=var.dtype)
+        data_vars[name] = (var.dims, data, var.attrs)
+        encoding[name] = {"chunks": chunks, **packing_encoding(var)}
+    coords = {name: coord for name, coord in ds.coords.items() if name != "time"}
+    coords["time"] = ("time", times, ds["time"].attrs)
+    template = xr.Dataset(data_vars, coords=coords, attrs=ds.attrs)
+    logger.info(f"Creating pre-sized Zarr store at {zarr_store} with {len(times)} time steps")
+    with write_lock:
+        template.to_zarr(store, mode="w", compute=False, encoding=encoding)
+        set_fill_values(store, ds)
+        flush_store(store)
+        # Land is static, so the template day seeds the index; region writes extend it.
+        update_presence(store, ds, create=True)
+        zarr.consolidate_metadata(store)
+        forget_time_index(zarr_store_path)
+        forget_cells(zarr_store_path)
+    logger.info(f"Created pre-sized Zarr store at {zarr_store}")
+
+def write_region_to_zarr(ds, zarr_store, new_time, metrics=None, num_workers=None):
+    """
+    Write one day into its slot of a pre-sized store (see create_presized_store).
+    Only the chunks of that day are written and no metadata changes, so separate
+    processes can fill different days of the same store concurrently, unless the days
+    share multi-day time chunks (see ecs.time_delta), which are rewritten whole. The
+    aggregates are not updated; rebuild them once the store is filled (rebuild_aggregates).
+    """
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    store = get_store(zarr_store_path, protocol)
+    with measure(metrics, "metadata_open"):
+        existing_times = get_time_index(store, zarr_store_path)
+    if new_time not in existing_times:
+        raise ValueError(f"Time {new_time} is not part of the pre-sized time axis of {zarr_store}")
+    index = existing_times.get_loc(new_time)
+    logger.info(f"Writing {new_time} into time index {index} of {zarr_store}")
+    # Days of one multi-day chunk are read, merged and rewritten, so writes in this process take turns.
+    with write_lock, measure(metrics, "upload") as stage:
+        _write_region(ds, store, index, new_time, num_workers)
+        stage["bytes_out"] = payload_bytes(ds)
+    logger.info(f"Wrote time slice {new_time} into pre-sized Zarr store.")
+
+def _write_region(ds, store, index, new_time, num_workers=None):
+    """
+    Write a single-day dataset over time index `index` of an existing store. The
+    metadata is only rewritten if the day holds data in chunks the chunk-presence
+    index marks as absent, which land never does.
+    """
+    write_days(ds.assign_coords(time=[new_time]), store, index, num_workers)
+    if update_presence(store, ds):
+        zarr.consolidate_metadata(store)
+
+def write_days(ds, store, start, num_workers=None):
+    """Write the days in ds over time indexes start.. of a store whose time axis already covers them."""
+    ds = add_hash_version(ds.drop_vars([name for name in ds.variables if "time" not in ds[name].dims]))
+    ds = align_chunks_to_store(drop_unstored(ds, store), store, start)
+    strings = _store_strings(ds, store, start, num_workers)
+    # Each chunk is written by one task; xarray would refuse days that fill part of a
+    # multi-day time chunk, which zarr reads, merges and rewrites.
+    ds.drop_vars(strings).to_zarr(store, region={"time": slice(start, start + ds.sizes["time"])}, safe_chunks=False,
+                                  compute=False).compute(**compute_options(num_workers))
+    flush_store(store)
+
+def append_to_store(ds, store, start, num_workers=None):
+    """Append ds along time to an existing store whose time axis has `start` entries."""
+    ds = align_chunks_to_store(drop_unstored(add_hash_version(ds), store), store, start)
+    strings = _store_strings(ds, store, start, num_workers)
+    # xarray replaces the group attributes on append; the chunk-presence index is carried over.
+    index = zarr.open_group(store=store, mode="r", use_consolidated=False).attrs.get(PRESENCE_ATTRIBUTE)
+    # The ocean cells of a packed store never change, so they are not rewritten.
+    ds.drop_vars(strings + [CELL_DIM], errors="ignore").to_zarr(
+        store, mode="a", append_dim="time", compute=False).compute(**compute_options(num_workers))
+    flush_store(store)
+    update_presence(store, ds, index)
+    zarr.consolidate_metadata(store)
+
+def create_store(ds, store, num_workers=None):
+    """
+    Create a new store holding the days in ds. The arrays are created first and given
+    fill values that match the data (see set_fill_values), so chunks that are
+    entirely land are not written; then the days are written into them and the
+    chunk-presence index is published.
+    """
+    # Only the metadata is written here; write_days aligns the dask chunks of the days
+    # to multi-day time chunks before writing them.
+    ds = add_hash_version(ds)
+    ds.to_zarr(store, mode="w", encoding=chunk_encoding(ds), compute=False, safe_chunks=False)
+    set_fill_values(store, ds)
+    # A content-addressed store is marked as such before any day is written.
+    flush_store(store)
+    zarr.consolidate_metadata(store)
+    write_days(ds, store, 0, num_workers)
+    update_presence(store, ds, create=True)
+    zarr.consolidate_metadata(store)
+
+def set_fill_values(store, ds):
+    """
+    Give the float variables of a newly created store a Zarr fill value equal to their
+    encoded _FillValue (NaN, or the packed integer fill). xarray leaves Zarr's default
+    of 0, so all-NaN chunks would differ from the fill and be written, and a missing
+    chunk would read as 0. Zarr skips writing chunks that equal the fill value (as it
+    already does for all-empty string chunks). The arrays must not hold chunks yet.
+    """
+    group = zarr.open_group(store=store, mode="r+", use_consolidated=False)
+    for name, var in ds.data_vars.items():
+        if name not in group or not np.issubdtype(var.dtype, np.floating):
+            continue
+        fill_value = var.encoding.get("_FillValue") if "dtype" in var.encoding else np.nan
+        array = group[name]
+        if fill_value is None or np.array_equal(array.fill_value, fill_value, equal_nan=True):
+            continue
+        zarr.create_array(store, name=array.path, shape=array.shape, dtype=array.dtype, chunks=array.chunks,
+                          filters=array.filters, compressors=array.compressors, serializer=array.serializer,
+                          fill_value=fill_value, attributes=dict(array.attrs),
+                          chunk_key_encoding=array.metadata.chunk_key_encoding,
+                          dimension_names=array.metadata.dimension_names, overwrite=True)
+
+def _store_strings(ds, store, start, num_workers=None):
+    """
+    Write the string variables of ds that already exist in the store straight into
+    their Zarr arrays from time index `start`, growing the time axis if needed, and
+    return their names. xarray decodes every existing variable it appends to or writes
+    a region of, and string arrays are decoded eagerly, which would read every stored
+    day of hashes and verifier slots on each write.
+    """
+    group = zarr.open_group(store=store, mode="r+", use_consolidated=False)
+    names = [name for name, var in ds.data_vars.items()
+             if var.dtype == object and "time" in var.dims and name in group]
+    for name in names:
+        var, array = ds[name], group[name]
+        axis = var.dims.index("time")
+        end = start + var.sizes["time"]
+        if array.shape[axis] < end:
+            array.resize(array.shape[:axis] + (end,) + array.shape[axis + 1:])
+        region = tuple(slice(start, end) if dim == "time" else slice(None) for dim in var.dims)
+        if isinstance(var.data, da.Array):
+            # The chunks are aligned to the store, so each task writes whole chunks.
+            da.store(var.data, array, regions=region, lock=False, **compute_options(num_workers))
+        else:
+            array[region] = var.values
+    return names
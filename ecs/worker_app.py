@@ -2,60 +2,353 @@ import os
 import json
 import logging
 import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from urllib.parse import unquote_plus
+import boto3
+from ecs.batch_conversion import convert_files_to_zarr
 from ecs.converter import convert_netcdf_to_zarr
+from ecs.dask_client import get_dask_client
+from ecs.deferred_hashes import attach_hashes
 
 # Suppress Botocore HTTP checksum INFO messages
 logging.getLogger("botocore.httpchecksum").setLevel(logging.WARNING)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def main():
-    # If command-line arguments are provided, use them.
-    # Expected usage: python worker_app.py <INPUT_FILE> <DEST_BUCKET> <CONFIG_PATH>
-    if len(sys.argv) >= 4:
-        netcdf_file = sys.argv[1]
-        dest_bucket = sys.argv[2]
-        config_path = sys.argv[3]
-        logger.info("Using command-line arguments for configuration.")
-    else:
-        netcdf_file = os.environ.get('INPUT_FILE')
-        dest_bucket = os.environ.get('DEST_BUCKET')
-        config_path = os.environ.get('DATASET_CONFIG', '/app/config/app_config.json')
-    
+def load_deployment_config(config_path):
+    """Load the deployment configuration JSON, exiting if it cannot be read."""
     print(f"Loading deployment configuration from: {config_path}")
     try:
         with open(config_path, 'r') as f:
-            deployment_config = json.load(f)
+            return json.load(f)
     except Exception as e:
         print(f"Failed to load deployment configuration from {config_path}: {e}")
         sys.exit(1)
 
-    # Determine the subfolder (if specified) and build the final S3 path.
+def build_zarr_store(dest_bucket, deployment_config):
+    """Determine the subfolder (if specified) and build the final S3 path."""
     dest_subfolder = deployment_config.get("sub_folder", "").strip("/")
     if dest_subfolder:
         zarr_store = f"{dest_bucket}/{dest_subfolder}"
-        print(f"Zarr store: {zarr_store}")
     else:
         zarr_store = f"{dest_bucket}"
-        print(f"Zarr store: {zarr_store}")
+    print(f"Zarr store: {zarr_store}")
+    return zarr_store
 
-    if not netcdf_file:
-        print("INPUT_FILE is not set or provided")
-        sys.exit(1)
+def get_sqs_client():
+    """
+    Create the SQS client. If ENVIRONMENT names an entry in the environments config
+    (e.g. "local"), its endpoint and credentials are used so the worker can run
+    against a local SQS stand-in such as LocalStack.
+    """
+    environment = os.environ.get('ENVIRONMENT', 'production')
+    environments_path = os.environ.get('ENVIRONMENTS_CONFIG', '/app/config/environments.json')
+    sqs_config = {}
+    if os.path.exists(environments_path):
+        with open(environments_path, 'r') as f:
+            sqs_config = json.load(f).get(environment, {}).get('sqs', {})
+    client_kwargs = {'region_name': sqs_config.get('region', os.environ.get('AWS_DEFAULT_REGION'))}
+    if sqs_config.get('endpoint_url'):
+        client_kwargs['endpoint_url'] = sqs_config['endpoint_url']
+    if sqs_config.get('access_key_id'):
+        client_kwargs['aws_access_key_id'] = sqs_config['access_key_id']
+        client_kwargs['aws_secret_access_key'] = sqs_config['secret_access_key']
+    return boto3.client('sqs', **client_kwargs)
 
-    print(f"Processing file: {netcdf_file}")
-    logger.info(f"Processing file: {netcdf_file}")
+def parse_message_files(body):
+    """
+    Return the input files referenced by an SQS message body.
+    Accepts S3 event notifications (optionally wrapped in an SNS envelope) and
+    plain {"input_file": ...} or {"input_files": [...]} requests.
+    """
+    payload = json.loads(body)
+    if payload.get('Type') == 'Notification' and 'Message' in payload:
+        payload = json.loads(payload['Message'])
+    if 'input_files' in payload:
+        return list(payload['input_files'])
+    if 'input_file' in payload:
+        return [payload['input_file']]
+    files = []
+    for record in payload.get('Records', []):
+        if 's3' in record:
+            bucket = record['s3']['bucket']['name']
+            key = unquote_plus(record['s3']['object']['key'])
+            files.append(f"s3://{bucket}/{key}")
+    return files
 
+def parse_hash_request(body):
+    """Return the days of an {"attach_hashes": [...]} request (see finish_hashes), or an empty list."""
     try:
-        result = convert_netcdf_to_zarr(
+        payload = json.loads(body)
+    except ValueError:
+        return []
+    days = payload.get('attach_hashes', []) if isinstance(payload, dict) else []
+    return [days] if isinstance(days, str) else list(days)
+
+def finish_hashes(record, zarr_store, deployment_config, sqs=None):
+    """
+    Second phase of a deferred-hash conversion (conversion "hash_phase": "deferred"):
+    the day is already published, so its hashes are attached afterwards. With
+    HASH_QUEUE_URL (or conversion "hash_queue_url") the day is queued for any SQS
+    worker; otherwise they are attached here.
+    """
+    if not record.get('hash_pending'):
+        return
+    conversion_config = deployment_config.get("conversion", {})
+    queue_url = os.environ.get('HASH_QUEUE_URL') or conversion_config.get("hash_queue_url")
+    if queue_url:
+        (sqs or get_sqs_client()).send_message(QueueUrl=queue_url, MessageBody=json.dumps({'attach_hashes': [record['time']]}))
+        logger.info(f"Queued spatial hashes of {record['time']} on {queue_url}")
+    else:
+        attach_hashes(zarr_store, record['time'], conversion_config)
+
+class VisibilityExtender(threading.Thread):
+    """
+    Background thread that keeps in-flight messages invisible while they are processed,
+    by extending their visibility timeout every half timeout.
+    """
+
+    def __init__(self, sqs, queue_url, visibility_timeout):
+        super().__init__(daemon=True)
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.receipt_handles = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def track(self, receipt_handle):
+        with self.lock:
+            self.receipt_handles.add(receipt_handle)
+
+    def untrack(self, receipt_handle):
+        with self.lock:
+            self.receipt_handles.discard(receipt_handle)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.visibility_timeout / 2):
+            with self.lock:
+                handles = list(self.receipt_handles)
+            for receipt_handle in handles:
+                try:
+                    self.sqs.change_message_visibility(
+                        QueueUrl=self.queue_url,
+                        ReceiptHandle=receipt_handle,
+                        VisibilityTimeout=self.visibility_timeout
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to extend visibility timeout: {e}")
+
+def process_message(sqs, queue_url, message, zarr_store, deployment_config):
+    """
+    Convert every file referenced by a message (or attach the hashes of the days of a
+    hash request) and delete the message on success.
+    """
+    hash_days = parse_hash_request(message['Body'])
+    for day in hash_days:
+        attach_hashes(zarr_store, day, deployment_config.get("conversion", {}))
+    files = [] if hash_days else parse_message_files(message['Body'])
+    if not files and not hash_days:
+        logger.warning(f"Message {message.get('MessageId')} does not reference any input files; deleting it.")
+    for netcdf_file in files:
+        start = time.time()
+        logger.info(f"Processing file: {netcdf_file}")
+        record = convert_netcdf_to_zarr(
             netcdf_file=netcdf_file,
             zarr_store=zarr_store,
             suffix=deployment_config.get("defined_suffix", ""),
-            conversion_config=deployment_config.get("conversion", {})
+            conversion_config=deployment_config.get("conversion", {}),
+            write_mode=os.environ.get('WRITE_MODE', 'append')
         )
-        logger.info(f"Successfully processed {netcdf_file}")
+        finish_hashes(record, zarr_store, deployment_config, sqs)
+        logger.info(f"Successfully processed {netcdf_file} in {time.time() - start:.2f}s")
+    sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+
+def run_sqs_worker(queue_url, zarr_store, deployment_config, sqs=None,
+                   concurrency=None, visibility_timeout=None, idle_timeout=None, stop=None):
+    """
+    Long-poll an SQS queue and convert the referenced files, keeping up to `concurrency`
+    messages in flight. The process stays alive between messages so imports, the S3
+    filesystem, the opened store and its time index are reused.
+    If idle_timeout is positive, the worker exits after that many seconds without messages.
+    Once the optional `stop` event is set, it exits as soon as the queue is drained.
+    Failed messages are not deleted, so they are retried (or dead-lettered) by SQS.
+    """
+    sqs = sqs or get_sqs_client()
+    concurrency = concurrency or int(os.environ.get('WORKER_CONCURRENCY', '2'))
+    visibility_timeout = visibility_timeout or int(os.environ.get('VISIBILITY_TIMEOUT', '300'))
+    if idle_timeout is None:
+        idle_timeout = int(os.environ.get('WORKER_IDLE_TIMEOUT', '0'))
+    wait_seconds = int(os.environ.get('RECEIVE_WAIT_SECONDS', '20'))
+    logger.info(f"Starting SQS worker on {queue_url} with concurrency {concurrency}")
+    # Conversions in flight share the task's memory budget.
+    conversion_config = dict(deployment_config.get("conversion", {}), concurrent_conversions=concurrency)
+    deployment_config = dict(deployment_config, conversion=conversion_config)
+
+    extender = VisibilityExtender(sqs, queue_url, visibility_timeout)
+    extender.start()
+    in_flight = {}
+    processed = failed = 0
+    last_message_at = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        try:
+            while True:
+                free_slots = concurrency - len(in_flight)
+                if free_slots > 0:
+                    response = sqs.receive_message(
+                        QueueUrl=queue_url,
+                        MaxNumberOfMessages=min(10, free_slots),
+                        WaitTimeSeconds=0 if in_flight else wait_seconds,
+                        VisibilityTimeout=visibility_timeout
+                    )
+                    for message in response.get('Messages', []):
+                        last_message_at = time.time()
+                        extender.track(message['ReceiptHandle'])
+                        future = pool.submit(process_message, sqs, queue_url, message, zarr_store, deployment_config)
+                        in_flight[future] = message
+                if not in_flight:
+                    if stop is not None and stop.is_set():
+                        logger.info("Stop requested and no message in flight; exiting.")
+                        break
+                    if idle_timeout > 0 and time.time() - last_message_at >= idle_timeout:
+                        logger.info(f"No messages for {idle_timeout}s; exiting.")
+                        break
+                    continue
+                done, _ = wait(list(in_flight), timeout=5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    message = in_flight.pop(future)
+                    extender.untrack(message['ReceiptHandle'])
+                    try:
+                        future.result()
+                        processed += 1
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"Failed to process message {message.get('MessageId')}: {str(e)}")
+        finally:
+            extender.stop()
+    logger.info(f"SQS worker stopped: {processed} message(s) processed, {failed} failed")
+    return processed, failed
+
+def write_completion_record(ledger_url, files, versions, s3=None):
+    """
+    Record converted source files (key and ETag) as one object under ledger_url
+    (s3://bucket/prefix/). The poller folds these records into its processed-key
+    ledger, so a file counts as processed only once its conversion succeeded.
+    A record that cannot be written only means the file is converted again.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    entries = {}
+    for url in files:
+        key = url.replace('s3://', '').partition('/')[2]
+        etag = (versions.get(url) or '').strip('"')
+        entries[f"{key}#{etag}"] = now
+    bucket, _, prefix = ledger_url.replace('s3://', '').partition('/')
+    record_key = f"{prefix.rstrip('/')}/{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+    try:
+        (s3 or boto3.client('s3')).put_object(Bucket=bucket, Key=record_key,
+                                              Body=json.dumps({'entries': entries}).encode('utf-8'))
+        logger.info(f"Recorded {len(entries)} converted file(s) in s3://{bucket}/{record_key}")
     except Exception as e:
-        logger.error(f"Failed to process {netcdf_file}: {str(e)}")
+        logger.error(f"Failed to record converted files in {ledger_url}: {str(e)}")
+
+def completion_recorder(environment):
+    """
+    Callable recording the converted files of a task launched with COMPLETED_LEDGER
+    (and INPUT_VERSIONS), or None when the launcher asked for no record.
+    """
+    ledger_url = environment.get('COMPLETED_LEDGER')
+    if not ledger_url:
+        return None
+    versions = json.loads(environment.get('INPUT_VERSIONS') or '{}')
+    return lambda files: write_completion_record(ledger_url, files, versions)
+
+def convert_input_files(input_files, zarr_store, deployment_config, write_mode='append', on_converted=None):
+    """
+    Convert the files of a task in order and return the number that failed.
+    On a distributed cluster a multi-day append batch is converted as one graph first.
+    on_converted, if given, is called once with the files converted successfully.
+    """
+    suffix = deployment_config.get("defined_suffix", "")
+    conversion_config = deployment_config.get("conversion", {})
+
+    if len(input_files) > 1 and write_mode == 'append' and get_dask_client(conversion_config.get("dask")) is not None:
+        try:
+            convert_files_to_zarr(input_files, zarr_store, suffix, conversion_config)
+            logger.info(f"Successfully processed {len(input_files)} file(s)")
+            if on_converted:
+                on_converted(input_files)
+            return 0
+        except Exception as e:
+            logger.error(f"Batch conversion failed, converting files one at a time: {str(e)}")
+
+    converted = []
+    for netcdf_file in input_files:
+        print(f"Processing file: {netcdf_file}")
+        logger.info(f"Processing file: {netcdf_file}")
+
+        try:
+            record = convert_netcdf_to_zarr(
+                netcdf_file=netcdf_file,
+                zarr_store=zarr_store,
+                suffix=suffix,
+                conversion_config=conversion_config,
+                write_mode=write_mode
+            )
+            logger.info(f"Successfully processed {netcdf_file} in {record['total.wall_seconds']:.2f}s")
+            finish_hashes(record, zarr_store, deployment_config)
+            converted.append(netcdf_file)
+        except Exception as e:
+            logger.error(f"Failed to process {netcdf_file}: {str(e)}")
+    if on_converted and converted:
+        on_converted(converted)
+    return len(input_files) - len(converted)
+
+def main():
+    # If command-line arguments are provided, use them.
+    # Expected usage: python worker_app.py <INPUT_FILE> <DEST_BUCKET> <CONFIG_PATH>
+    if len(sys.argv) >= 4:
+        netcdf_file = sys.argv[1]
+        dest_bucket = sys.argv[2]
+        config_path = sys.argv[3]
+        logger.info("Using command-line arguments for configuration.")
+    else:
+        netcdf_file = os.environ.get('INPUT_FILE')
+        dest_bucket = os.environ.get('DEST_BUCKET')
+        config_path = os.environ.get('DATASET_CONFIG', '/app/config/app_config.json')
+
+    deployment_config = load_deployment_config(config_path)
+    zarr_store = build_zarr_store(dest_bucket, deployment_config)
+
+    # Without an input file, a queue URL switches the worker to long-lived SQS mode.
+    queue_url = os.environ.get('SQS_QUEUE_URL')
+    has_input = netcdf_file or os.environ.get('INPUT_FILES')
+    worker_mode = os.environ.get('WORKER_MODE', 'sqs' if queue_url and not has_input else 'single')
+    if worker_mode == 'sqs':
+        if not queue_url:
+            print("SQS_QUEUE_URL is not set")
+            sys.exit(1)
+        run_sqs_worker(queue_url, zarr_store, deployment_config)
+        return
+
+    # A batched task receives a JSON list of files in INPUT_FILES.
+    input_files = json.loads(os.environ['INPUT_FILES']) if os.environ.get('INPUT_FILES') else [netcdf_file]
+    input_files = [f for f in input_files if f]
+    if not input_files:
+        print("INPUT_FILE is not set or provided")
+        sys.exit(1)
+
+    failures = convert_input_files(input_files, zarr_store, deployment_config,
+                                   write_mode=os.environ.get('WRITE_MODE', 'append'),
+                                   on_converted=completion_recorder(os.environ))
+    if failures:
+        logger.error(f"{failures} of {len(input_files)} file(s) failed")
         sys.exit(1)
 
 if __name__ == "__main__":
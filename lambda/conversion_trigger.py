@@ -2,138 +2,119 @@ import os
 import json
 import boto3
 import logging
-import time
-from datetime import datetime, date
+from urllib.parse import unquote_plus
+from ecs_launcher import EcsLauncher
+from processed_ledger import ProcessedLedger
+from supersession import schedule_conversions, object_exists
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Clients and configuration are created once per container and reused across invocations.
+ecs_client = boto3.client('ecs')
+s3_client = boto3.client('s3')
+DATASET_CONFIGS = json.loads(os.environ.get('DATASET_CONFIGS', '{}'))
+_launchers = {}
+
 def get_dataset_config(bucket_name):
     """Get dataset configuration based on bucket name"""
-    # Load from environment variable or parameter store
-    dataset_configs = json.loads(os.environ['DATASET_CONFIGS'])
-    return dataset_configs.get(bucket_name)
+    # Loaded once from the DATASET_CONFIGS environment variable
+    return DATASET_CONFIGS.get(bucket_name)
+
+def get_destination_bucket(source_bucket):
+    """Return the destination bucket for files from a source bucket."""
+    dataset_config = get_dataset_config(source_bucket) or {}
+    return dataset_config.get('destination_bucket') or os.environ.get('DEST_BUCKET')
+
+def get_launcher(dest_bucket, context):
+    """Return the cached launcher for a destination bucket, sharing one launch checkpoint."""
+    if dest_bucket not in _launchers:
+        launcher = EcsLauncher.from_environment(ecs_client)
+        launcher.environment['DEST_BUCKET'] = dest_bucket
+        _launchers[dest_bucket] = launcher
+    launcher = _launchers[dest_bucket]
+    launcher.checkpoint = ProcessedLedger(
+        s3_client,
+        os.environ.get('DEST_BUCKET'),
+        os.environ.get('LAUNCH_CHECKPOINT_KEY', '_ledger/trigger_launches.json'),
+        ttl_days=int(os.environ.get('LAUNCH_CHECKPOINT_TTL_DAYS', '1'))
+    ).load()
+    launcher.remaining_time = (lambda: context.get_remaining_time_in_millis() / 1000) if context else None
+    return launcher
 
-def trigger_ecs_task(event, dataset_config):
-    """Trigger ECS task for conversion"""
-    ecs = boto3.client('ecs')
-    
-    # Prepare container overrides
-    container_overrides = {
-        'containerOverrides': [{
-            'name': dataset_config['container_name'],
-            'environment': [
-                {
-                    'name': 'DATASET_CONFIG',
-                    'value': '/app/config/oisst.json'
-                },
-                {
-                    'name': 'SQS_QUEUE_URL',
-                    'value': dataset_config['queue_url']
-                }
-            ]
-        }]
-    }
-    
-    # Launch ECS task
-    response = ecs.run_task(
-        cluster=dataset_config['cluster'],
-        taskDefinition=dataset_config['task_definition'],
-        launchType='FARGATE',
-        networkConfiguration=dataset_config['network_config'],
-        overrides=container_overrides
-    )
-    
-    return response
+def extract_s3_records(event):
+    """
+    Return every S3 record in an invocation, unwrapping all SNS records
+    (each SNS message holds an S3 event with its own Records list).
+    """
+    records = []
+    for record in event.get('Records', []):
+        if 'Sns' in record:
+            try:
+                message = json.loads(record['Sns']['Message'])
+            except Exception as e:
+                print(f"Error parsing SNS message: {e}")
+                raise
+            records.extend(extract_s3_records(message))
+        elif 's3' in record:
+            records.append(record)
+    return records
 
-def json_serial(obj):
-    """JSON serializer for objects not serializable by default json code"""
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    raise TypeError(f"Type {type(obj)} not serializable")
+def group_files_by_destination(records):
+    """
+    Deduplicate S3 records by bucket and key and group the files by destination bucket.
+    Returns {dest_bucket: (files, versions)}; the last event for a key wins.
+    """
+    latest = {}
+    for record in records:
+        bucket = record['s3']['bucket']['name']
+        # Keys in S3 event notifications are URL-encoded.
+        key = unquote_plus(record['s3']['object']['key'])
+        latest[f"s3://{bucket}/{key}"] = (bucket, record['s3']['object'].get('eTag'))
+    groups = {}
+    for url, (bucket, etag) in latest.items():
+        files, versions = groups.setdefault(get_destination_bucket(bucket), ([], {}))
+        files.append(url)
+        versions[url] = etag
+    return groups
 
 def lambda_handler(event, context):
     print(f"Received event: {json.dumps(event)}")
-    
-    # Check if the event is from SNS (S3 notifications via SNS will be wrapped)
-    if "Records" in event and "Sns" in event["Records"][0]:
-        sns_message = event["Records"][0]["Sns"]["Message"]
-        print(f"Extracted SNS message: {sns_message}")
-        try:
-            # Assuming the SNS message payload is a JSON string containing an S3 event.
-            event = json.loads(sns_message)
-        except Exception as e:
-            print(f"Error parsing SNS message: {e}")
-            raise
-    
-    for record in event['Records']:
-        # Get the S3 bucket and key from the underlying S3 event.
-        bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
-        
-        print(f"Processing file: s3://{bucket}/{key}")
-        
-        # Start ECS task
-        try:
-            ecs = boto3.client('ecs')
-            
-            # Get VPC configuration from environment
-            subnet_ids_str = os.environ.get('SUBNET_IDS')
-            if not subnet_ids_str:
-                raise ValueError("SUBNET_IDS environment variable is not set")
-            subnet_ids = subnet_ids_str.split(',')
-            print(f"Using subnets: {subnet_ids}")
-            
-            security_group_id = os.environ.get('SECURITY_GROUP_IDS')
-            if not security_group_id:
-                raise ValueError("SECURITY_GROUP_IDS environment variable is not set")
-            security_group_ids = [security_group_id]
-            print(f"Using security groups: {security_group_ids}")
 
-            response = ecs.run_task(
-                cluster=os.environ['CLUSTER_NAME'],
-                taskDefinition=os.environ['TASK_DEFINITION'],
-                launchType='FARGATE',
-                networkConfiguration={
-                    'awsvpcConfiguration': {
-                        'subnets': subnet_ids,
-                        'securityGroups': security_group_ids,
-                        'assignPublicIp': 'ENABLED'
-                    }
-                },
-                overrides={
-                    'containerOverrides': [{
-                        'name': 'converter',
-                        'environment': [
-                            {
-                                'name': 'INPUT_FILE',
-                                'value': f"s3://{bucket}/{key}"
-                            },
-                            {
-                                'name': 'SOURCE_BUCKET',
-                                'value': bucket
-                            },
-                            {
-                                'name': 'DEST_BUCKET',
-                                'value': os.environ.get('DEST_BUCKET')
-                            },
-                            {
-                                'name': 'AWS_DEFAULT_REGION',
-                                'value': os.environ['AWS_DEFAULT_REGION']
-                            }
-                        ]
-                    }]
-                }
-            )
-            print(f"Started ECS task: {json.dumps(response, default=json_serial)}")
+    # Unwrap every record (S3 notifications via SNS are wrapped), deduplicate and group them.
+    records = extract_s3_records(event)
+    groups = group_files_by_destination(records)
+    print(f"Received {len(records)} S3 record(s) for {sum(len(f) for f, _ in groups.values())} unique file(s)")
+
+    # Start batched ECS tasks, one batched request per destination store
+    pending = []
+    for dest_bucket, (files, versions) in groups.items():
+        # Convert each date once: skip preliminary files whose final file already exists.
+        files, superseded = schedule_conversions(files, final_known=lambda final: object_exists(s3_client, final))
+        for url in superseded:
+            print(f"Skipping superseded file: {url}")
+        if not files:
+            continue
+        for url in files:
+            print(f"Processing file: {url} -> {dest_bucket}")
+        try:
+            launched, not_launched = get_launcher(dest_bucket, context).launch(files, versions=versions)
+            pending.extend(not_launched)
+            print(f"Launched conversion tasks for {len(launched)} file(s) into {dest_bucket}")
         except Exception as e:
-            print(f"Error starting ECS task: {str(e)}")
-            print(f"Environment variables:")
-            print(f"SUBNET_IDS: {os.environ.get('SUBNET_IDS', 'Not set')}")
-            print(f"SECURITY_GROUP_IDS: {os.environ.get('SECURITY_GROUP_IDS', 'Not set')}")
-            print(f"CLUSTER_NAME: {os.environ.get('CLUSTER_NAME', 'Not set')}")
-            print(f"TASK_DEFINITION: {os.environ.get('TASK_DEFINITION', 'Not set')}")
+            logger.error(json.dumps({
+                "message": "Error starting ECS task",
+                "error": str(e),
+                "dest_bucket": dest_bucket,
+                "files": len(files),
+                **{name: os.environ.get(name, 'Not set')
+                   for name in ('SUBNET_IDS', 'SECURITY_GROUP_IDS', 'CLUSTER_NAME', 'TASK_DEFINITION')},
+            }))
             raise
+    if pending:
+        # Fail the invocation so the event is retried for the files that were not launched;
+        # once Lambda's asynchronous retries are used up it goes to the dead-letter queue.
+        raise Exception(f"{len(pending)} file(s) could not be launched: {pending}")
 
     return {
         'statusCode': 200,
@@ -0,0 +1,192 @@
+import os
+import json
+import random
+import time
+import hashlib
+import logging
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded')
+
+class EcsLauncher:
+    """
+    Launches converter tasks for pending files in batches.
+    Files are grouped into batches of batch_size (one Fargate task per batch, passed as
+    INPUT_FILES), at most max_concurrent_tasks converter tasks run at once, throttled
+    API calls are retried with full-jitter exponential backoff, and launched batches are
+    recorded in an optional checkpoint ledger so a re-invocation never launches them twice.
+    """
+
+    def __init__(self, ecs_client, cluster, task_definition, network_configuration,
+                 environment=None, container_name='converter', batch_size=20,
+                 max_concurrent_tasks=10, max_attempts=6, base_delay=0.5, max_delay=20.0,
+                 checkpoint=None, remaining_time=None, min_remaining_seconds=10):
+        self.ecs_client = ecs_client
+        self.cluster = cluster
+        self.task_definition = task_definition
+        self.network_configuration = network_configuration
+        self.environment = environment or {}
+        self.container_name = container_name
+        self.batch_size = batch_size
+        self.max_concurrent_tasks = max_concurrent_tasks
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.checkpoint = checkpoint
+        self.remaining_time = remaining_time
+        self.min_remaining_seconds = min_remaining_seconds
+
+    @classmethod
+    def from_environment(cls, ecs_client, checkpoint=None, remaining_time=None):
+        """Build a launcher from the Lambda environment variables shared by both handlers."""
+        subnet_ids_str = os.environ.get('SUBNET_IDS')
+        if not subnet_ids_str:
+            raise Exception("SUBNET_IDS environment variable is not set")
+        security_group_id = os.environ.get('SECURITY_GROUP_IDS')
+        if not security_group_id:
+            raise Exception("SECURITY_GROUP_IDS environment variable is not set")
+        cluster_name = os.environ.get('CLUSTER_NAME')
+        if not cluster_name:
+            raise Exception("CLUSTER_NAME environment variable is not set")
+        task_definition = os.environ.get('TASK_DEFINITION')
+        if not task_definition:
+            raise Exception("TASK_DEFINITION environment variable is not set")
+        dest_bucket = os.environ.get('DEST_BUCKET')
+        if not dest_bucket:
+            raise Exception("DEST_BUCKET environment variable is not set")
+        region = os.environ.get('AWS_DEFAULT_REGION')
+        if not region:
+            raise Exception("AWS_DEFAULT_REGION environment variable is not set")
+
+        return cls(
+            ecs_client,
+            cluster_name,
+            task_definition,
+            {
+                'awsvpcConfiguration': {
+                    'subnets': subnet_ids_str.split(','),
+                    'securityGroups': [security_group_id],
+                    'assignPublicIp': 'ENABLED'
+                }
+            },
+            environment={'DEST_BUCKET': dest_bucket, 'AWS_DEFAULT_REGION': region},
+            batch_size=int(os.environ.get('FILES_PER_TASK', '20')),
+            max_concurrent_tasks=int(os.environ.get('MAX_CONCURRENT_TASKS', '10')),
+            checkpoint=checkpoint,
+            remaining_time=remaining_time
+        )
+
+    def make_batches(self, files):
+        """Split files (s3:// URLs) into ordered batches of at most batch_size."""
+        files = list(dict.fromkeys(files))
+        return [files[i:i + self.batch_size] for i in range(0, len(files), self.batch_size)]
+
+    @staticmethod
+    def batch_id(files, versions=None):
+        """Identify a batch by its files and, if known, their versions (e.g. ETags)."""
+        versions = versions or {}
+        members = sorted(f"{f}#{versions.get(f) or ''}" for f in files)
+        return hashlib.sha1('\n'.join(members).encode('utf-8')).hexdigest()
+
+    def _call_with_backoff(self, func, **kwargs):
+        """Call an ECS API, retrying throttling errors with full-jitter exponential backoff."""
+        for attempt in range(self.max_attempts):
+            try:
+                return func(**kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code not in THROTTLING_ERROR_CODES or attempt == self.max_attempts - 1:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                logger.warning(f"ECS call throttled ({code}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def running_task_count(self):
+        """Return the number of converter tasks currently running or starting in the cluster."""
+        family = self.task_definition.split('/')[-1].split(':')[0]
+        count = 0
+        for status in ('RUNNING', 'PENDING'):
+            kwargs = {'cluster': self.cluster, 'family': family, 'desiredStatus': status}
+            while True:
+                response = self._call_with_backoff(self.ecs_client.list_tasks, **kwargs)
+                count += len(response.get('taskArns', []))
+                if not response.get('nextToken'):
+                    break
+                kwargs['nextToken'] = response['nextToken']
+        return count
+
+    def _out_of_time(self):
+        return self.remaining_time is not None and self.remaining_time() < self.min_remaining_seconds
+
+    def run_batch(self, files, versions=None):
+        """
+        Launch one converter task for a batch of files. Known versions are passed as
+        INPUT_VERSIONS, so the task can record which versions it converted.
+        """
+        bucket = files[0].replace('s3://', '').split('/')[0]
+        environment = dict(self.environment)
+        environment.update({
+            'INPUT_FILES': json.dumps(files),
+            'SOURCE_BUCKET': bucket
+        })
+        if versions:
+            environment['INPUT_VERSIONS'] = json.dumps({f: versions.get(f) for f in files})
+        if len(files) == 1:
+            environment['INPUT_FILE'] = files[0]
+        overrides = {
+            'containerOverrides': [{
+                'name': self.container_name,
+                'environment': [{'name': k, 'value': v} for k, v in environment.items()]
+            }]
+        }
+        response = self._call_with_backoff(
+            self.ecs_client.run_task,
+            cluster=self.cluster,
+            taskDefinition=self.task_definition,
+            launchType='FARGATE',
+            networkConfiguration=self.network_configuration,
+            overrides=overrides
+        )
+        if response.get('failures'):
+            raise Exception(f"ECS run_task failures: {response['failures']}")
+        return response
+
+    def launch(self, files, versions=None):
+        """
+        Launch tasks for the given files (versions optionally maps files to ETags).
+        Returns (launched, pending): files whose batch was launched (or already
+        checkpointed) and files left for a later invocation because the concurrency
+        limit or the time budget was reached, or the launch failed.
+        """
+        batches = self.make_batches(files)
+        launched, pending = [], []
+        available = self.max_concurrent_tasks - self.running_task_count() if batches else 0
+        logger.info(f"Launching {len(batches)} batch(es) for {len(files)} file(s); {available} task slot(s) available")
+        for index, batch in enumerate(batches):
+            batch_id = self.batch_id(batch, versions)
+            if self.checkpoint is not None and self.checkpoint.contains(batch_id, None):
+                logger.info(f"Batch {batch_id} was already launched; skipping")
+                launched.extend(batch)
+                continue
+            if available <= 0 or self._out_of_time():
+                logger.info(f"Stopping launches with {len(batches) - index} batch(es) pending")
+                for remaining in batches[index:]:
+                    pending.extend(remaining)
+                break
+            try:
+                response = self.run_batch(batch, versions)
+                task_arns = [task['taskArn'] for task in response.get('tasks', [])]
+                logger.info(f"Launched batch {batch_id} ({len(batch)} file(s)): {task_arns}")
+            except Exception as e:
+                logger.error(f"Error launching batch {batch_id}: {e}")
+                pending.extend(batch)
+                continue
+            available -= 1
+            launched.extend(batch)
+            if self.checkpoint is not None:
+                self.checkpoint.add(batch_id, None)
+                self.checkpoint.save()
+        return launched, pending
@@ -4,7 +4,10 @@ import boto3
 from botocore import UNSIGNED
 from botocore.client import Config
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from processed_ledger import ProcessedLedger
+from ecs_launcher import EcsLauncher
+from supersession import DATE_PATTERN, schedule_conversions, is_preliminary, final_version
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -13,12 +16,24 @@ logger.setLevel(logging.INFO)
 s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
 ecs_client = boto3.client('ecs')
 ssm_client = boto3.client('ssm')
+# Signed client for the processed-key ledger, which lives in our own bucket.
+ledger_s3_client = boto3.client('s3')
 
 def lambda_handler(event, context):
     """
-    Polls the external public S3 bucket for new files, triggers an ECS conversion task for each,
-    and updates the last processed timestamp in SSM Parameter Store.
+    Polls the external public S3 bucket for new files, launches batched ECS conversion tasks
+    for them, and updates the last processed timestamp in SSM Parameter Store.
+    Only the recent YYYYMM prefixes are listed, starting RELIST_DAYS before a per-prefix
+    cursor, so a file replaced in place behind the cursor (new ETag) is listed again.
+    Files already recorded in the processed-key ledger (same key and ETag) are skipped.
+    The ledger records a file once its conversion succeeded (the converter tasks write
+    completion records that are merged here); a launched file that is not converted yet
+    is skipped until the launch checkpoint expires, after which it is launched again.
+    Each date is converted at most once per poll: a preliminary file is skipped when its
+    final file is listed or already recorded, and duplicates for a date are collapsed.
     Files are processed if their LastModified date is on or after the stored parameter date.
+    Files that could not be launched in this invocation (task limit or time budget reached)
+    hold back the cursor and timestamp so the next poll picks them up again.
     """
     source_bucket = os.environ.get("SOURCE_BUCKET")
     if not source_bucket:
@@ -30,47 +45,195 @@ def lambda_handler(event, context):
     logger.info(f"Last processed date: {last_processed_date.isoformat()}")
 
     new_files = []
-    max_timestamp = last_processed
+    listed_keys = {}
 
-    # List objects in the bucket
-    logger.info("Starting to paginate S3 objects from bucket: %s", source_bucket)
+    # Only list the month prefixes that can hold new files, starting after the persisted cursor.
+    prefixes = get_month_prefixes(datetime.now(timezone.utc))
+    cursor = get_listing_cursor()
+    relist_days = int(os.environ.get('RELIST_DAYS', '7'))
+    logger.info("Listing prefixes %s in bucket: %s", prefixes, source_bucket)
     paginator = s3_client.get_paginator('list_objects_v2')
     page_count = 0
-    for page in paginator.paginate(Bucket=source_bucket):
-        page_count += 1
-        contents = page.get('Contents', [])
-        logger.info("Page %d retrieved, object count: %d", page_count, len(contents))
-        for obj in contents:
-            key = obj['Key']
-            last_modified = obj['LastModified']
-            logger.debug("Processing object: %s, last_modified: %s", key, last_modified.isoformat())
-            # Compare the date portion so that files on the same day are included.
-            if last_modified.date() >= last_processed_date:
-                logger.debug("New object found: %s", key)
-                new_files.append((key, last_modified))
-                if last_modified > max_timestamp:
-                    max_timestamp = last_modified
-    logger.info("Finished pagination. Total pages: %d, new files: %d", page_count, len(new_files))
+    for prefix in prefixes:
+        list_kwargs = {'Bucket': source_bucket, 'Prefix': prefix}
+        if cursor.get(prefix):
+            list_kwargs['StartAfter'] = relist_start(cursor[prefix], relist_days)
+        listed_keys[prefix] = []
+        for page in paginator.paginate(**list_kwargs):
+            page_count += 1
+            contents = page.get('Contents', [])
+            logger.info("Prefix %s page retrieved, object count: %d", prefix, len(contents))
+            for obj in contents:
+                key = obj['Key']
+                last_modified = obj['LastModified']
+                logger.debug("Processing object: %s, last_modified: %s", key, last_modified.isoformat())
+                listed_keys[prefix].append(key)
+                # Compare the date portion so that files on the same day are included.
+                if last_modified.date() >= last_processed_date:
+                    logger.debug("New object found: %s", key)
+                    new_files.append((key, last_modified, obj.get('ETag')))
+    logger.info("Finished listing. Total pages: %d, new files: %d", page_count, len(new_files))
 
     logger.info(f"Found {len(new_files)} new file(s) in bucket {source_bucket}")
 
-    # Trigger ECS conversion tasks for new files
-    for key, _ in new_files:
-        try:
-            response = trigger_ecs_task(source_bucket, key)
-            logger.info(f"Triggered ECS task for s3://{source_bucket}/{key}: {json.dumps(response, default=str)}")
-        except Exception as e:
-            logger.error(f"Error triggering ECS task for {key}: {e}")
+    # Launch batched ECS conversion tasks for new files that are neither converted
+    # (in the ledger) nor launched recently (in the launch checkpoint).
+    ledger = ProcessedLedger.from_environment(ledger_s3_client).load()
+    completed_prefix = os.environ.get('COMPLETED_PREFIX', '_ledger/completed/')
+    merged_records = ledger.merge_records(completed_prefix)
+    checkpoint = get_launch_checkpoint()
+    to_launch = [(key, etag) for key, _, etag in new_files
+                 if not ledger.contains(key, etag) and not checkpoint.contains(key, etag)]
+    skipped = len(new_files) - len(to_launch)
+    logger.info(f"Skipping {skipped} file(s) already converted or in flight")
+    all_listed = {key for keys in listed_keys.values() for key in keys}
+    scheduled, superseded = schedule_conversions(
+        [key for key, _ in to_launch],
+        final_known=lambda final: final in all_listed or ledger.contains_key(final)
+    )
+    etags = dict(to_launch)
+    for key in superseded:
+        ledger.add(key, etags[key])
+    urls = {f"s3://{source_bucket}/{key}": (key, etags[key]) for key in scheduled}
+    launcher = EcsLauncher.from_environment(
+        ecs_client,
+        checkpoint=checkpoint,
+        remaining_time=(lambda: context.get_remaining_time_in_millis() / 1000) if context else None
+    )
+    # The tasks record the files they converted where the next poll merges them.
+    launcher.environment['COMPLETED_LEDGER'] = f"s3://{ledger.bucket}/{completed_prefix}"
+    launched, pending = launcher.launch(list(urls), versions={url: etag for url, (_, etag) in urls.items()})
+    for url in launched:
+        checkpoint.add(*urls[url])
+    checkpoint.save()
+    ledger.save()
+    if merged_records:
+        ledger.delete_records(merged_records)
+    pending_keys = {urls[url][0] for url in pending}
+    if pending_keys:
+        logger.info(f"{len(pending_keys)} file(s) left pending for the next poll")
+    # Files launched but not converted yet are listed again until they are, so a
+    # failed task is retried once its checkpoint entry expires.
+    in_flight_keys = {key for key, _, etag in new_files
+                      if not ledger.contains(key, etag) and checkpoint.contains(key, etag)}
+    held_keys = pending_keys | in_flight_keys
+
+    # Advance the timestamp only up to the oldest file not converted yet.
+    handled = [last_modified for key, last_modified, _ in new_files if key not in held_keys]
+    held_times = [last_modified for key, last_modified, _ in new_files if key in held_keys]
+    if handled:
+        max_timestamp = max(handled + [last_processed])
+        if held_times:
+            max_timestamp = min(max_timestamp, min(held_times))
+        if max_timestamp > last_processed:
+            update_last_processed_timestamp(max_timestamp)
 
-    # Update SSM parameter if any new files were processed.
-    if new_files:
-        update_last_processed_timestamp(max_timestamp)
+    superseded_keys = {
+        key for key in all_listed
+        if is_preliminary(key) and ledger.contains_key(final_version(key))
+    }
+    new_cursor = advance_listing_cursor(cursor, listed_keys, held_keys, superseded_keys)
+    if new_cursor != cursor:
+        update_listing_cursor(new_cursor)
 
     return {
         'statusCode': 200,
-        'body': json.dumps(f"Processed {len(new_files)} new file(s).")
+        'body': json.dumps(f"Processed {len(launched)} new file(s), {len(pending)} pending.")
     }
 
+def advance_listing_cursor(cursor, listed_keys, pending_keys, superseded_keys=()):
+    """
+    Move each prefix's cursor over the contiguous run of listed keys that are final and
+    converted. Preliminary, pending and in-flight files stop the cursor, so they are
+    listed again until their final version has been converted; superseded_keys holds
+    the preliminary files whose final version is already recorded, which the cursor may
+    pass. Keys re-listed behind the cursor never move it back.
+    """
+    new_cursor = {}
+    for prefix, keys in listed_keys.items():
+        position = cursor.get(prefix)
+        for key in keys:
+            if (is_preliminary(key) and key not in superseded_keys) or key in pending_keys:
+                break
+            if position is None or key > position:
+                position = key
+        if position:
+            new_cursor[prefix] = position
+    return new_cursor
+
+def relist_start(cursor_key, days):
+    """
+    StartAfter key `days` before a cursor key: the cursor with the date in its file name
+    moved back, so the files of those days are listed again. The cursor itself if it has
+    no date or days is not positive.
+    """
+    directory, _, name = cursor_key.rpartition('/')
+    match = DATE_PATTERN.search(name)
+    if days <= 0 or not match:
+        return cursor_key
+    day = datetime.strptime(match.group(1), '%Y%m%d') - timedelta(days=days)
+    return f"{directory}/{name[:match.start()]}{day:%Y%m%d}{name[match.end():]}"
+
+def get_launch_checkpoint():
+    """
+    Checkpoint of launched batches and files, stored next to the processed-key ledger.
+    A launched file not converted within LAUNCH_CHECKPOINT_TTL_DAYS is launched again.
+    """
+    return ProcessedLedger(
+        ledger_s3_client,
+        os.environ.get('LEDGER_BUCKET') or os.environ.get('DEST_BUCKET'),
+        os.environ.get('LAUNCH_CHECKPOINT_KEY', '_ledger/polling_launches.json'),
+        ttl_days=int(os.environ.get('LAUNCH_CHECKPOINT_TTL_DAYS', '1'))
+    ).load()
+
+def get_month_prefixes(now):
+    """
+    Return the YYYYMM prefixes to list: the current and previous month, plus
+    LOOKBACK_MONTHS further months, oldest first.
+    """
+    source_prefix = os.environ.get('SOURCE_PREFIX', 'data/v2.1/avhrr/')
+    lookback = int(os.environ.get('LOOKBACK_MONTHS', '0'))
+    prefixes = []
+    year, month = now.year, now.month
+    for _ in range(lookback + 2):
+        prefixes.append(f"{source_prefix}{year:04d}{month:02d}/")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return list(reversed(prefixes))
+
+def get_listing_cursor():
+    """
+    Retrieve the per-prefix StartAfter cursor from SSM Parameter Store.
+    Returns an empty mapping if the parameter does not exist.
+    """
+    param_name = os.environ.get('LISTING_CURSOR_PARAM', '/my-app/listing_cursor')
+    try:
+        response = ssm_client.get_parameter(Name=param_name)
+        return json.loads(response['Parameter']['Value'])
+    except ssm_client.exceptions.ParameterNotFound:
+        return {}
+    except Exception as e:
+        logger.error(f"Error retrieving SSM parameter {param_name}: {e}")
+        raise
+
+def update_listing_cursor(cursor):
+    """
+    Update the SSM parameter with the per-prefix StartAfter cursor.
+    Only prefixes that were listed in this poll are kept, so the value stays small.
+    """
+    param_name = os.environ.get('LISTING_CURSOR_PARAM', '/my-app/listing_cursor')
+    value = json.dumps(cursor)
+    try:
+        ssm_client.put_parameter(
+            Name=param_name,
+            Value=value,
+            Type='String',
+            Overwrite=True
+        )
+        logger.info(f"Updated listing cursor to {value} in SSM")
+    except Exception as e:
+        logger.error(f"Error updating SSM parameter {param_name}: {e}")
+        raise
+
 def get_last_processed_timestamp():
     """
     Retrieve the last processed timestamp from SSM Parameter Store.
@@ -115,62 +278,3 @@ def update_last_processed_timestamp(timestamp):
     except Exception as e:
         logger.error(f"Error updating SSM parameter {param_name}: {e}")
         raise
-
-def trigger_ecs_task(bucket, key):
-    """
-    Trigger an ECS Fargate task for file conversion.
-    Passes required environment variables such as INPUT_FILE, SOURCE_BUCKET, DEST_BUCKET, and AWS_DEFAULT_REGION.
-    """
-    subnet_ids_str = os.environ.get('SUBNET_IDS')
-    if not subnet_ids_str:
-        raise Exception("SUBNET_IDS environment variable is not set")
-    subnet_ids = subnet_ids_str.split(',')
-
-    security_group_id = os.environ.get('SECURITY_GROUP_IDS')
-    if not security_group_id:
-        raise Exception("SECURITY_GROUP_IDS environment variable is not set")
-    security_group_ids = [security_group_id]
-
-    cluster_name = os.environ.get('CLUSTER_NAME')
-    if not cluster_name:
-        raise Exception("CLUSTER_NAME environment variable is not set")
-
-    task_definition = os.environ.get('TASK_DEFINITION')
-    if not task_definition:
-        raise Exception("TASK_DEFINITION environment variable is not set")
-
-    dest_bucket = os.environ.get('DEST_BUCKET')
-    if not dest_bucket:
-        raise Exception("DEST_BUCKET environment variable is not set")
-
-    region = os.environ.get('AWS_DEFAULT_REGION')
-    if not region:
-        raise Exception("AWS_DEFAULT_REGION environment variable is not set")
-
-    # Build container overrides.
-    overrides = {
-        'containerOverrides': [{
-            'name': 'converter',
-            'environment': [
-                {'name': 'INPUT_FILE', 'value': f"s3://{bucket}/{key}"},
-                {'name': 'SOURCE_BUCKET', 'value': bucket},
-                {'name': 'DEST_BUCKET', 'value': dest_bucket},
-                {'name': 'AWS_DEFAULT_REGION', 'value': region}
-            ]
-        }]
-    }
-
-    response = ecs_client.run_task(
-        cluster=cluster_name,
-        taskDefinition=task_definition,
-        launchType='FARGATE',
-        networkConfiguration={
-            'awsvpcConfiguration': {
-                'subnets': subnet_ids,
-                'securityGroups': security_group_ids,
-                'assignPublicIp': 'ENABLED'
-            }
-        },
-        overrides=overrides
-    )
-    return response
@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+class ProcessedLedger:
+    """
+    Compact record of source objects that already had a conversion triggered.
+    Entries are keyed by S3 key plus ETag, so a replaced object is converted again.
+    The ledger is stored as a single JSON object in S3 (works against LocalStack/moto),
+    entries older than ttl_days are expired and the ledger never exceeds max_entries.
+    """
+
+    def __init__(self, s3_client, bucket, key, max_entries=5000, ttl_days=45):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.max_entries = max_entries
+        self.ttl_days = ttl_days
+        self.entries = {}
+        self.dirty = False
+
+    @classmethod
+    def from_environment(cls, s3_client):
+        """Build a ledger from LEDGER_* environment variables (defaults to the destination bucket)."""
+        bucket = os.environ.get('LEDGER_BUCKET') or os.environ.get('DEST_BUCKET')
+        if not bucket:
+            raise Exception("LEDGER_BUCKET or DEST_BUCKET environment variable must be set")
+        return cls(
+            s3_client,
+            bucket,
+            os.environ.get('LEDGER_KEY', '_ledger/processed_keys.json'),
+            max_entries=int(os.environ.get('LEDGER_MAX_ENTRIES', '5000')),
+            ttl_days=int(os.environ.get('LEDGER_TTL_DAYS', '45'))
+        )
+
+    @staticmethod
+    def entry_id(key, etag):
+        etag = (etag or '').strip('"')
+        return f"{key}#{etag}"
+
+    def load(self):
+        """
+        Load the ledger from S3. A missing ledger object is treated as empty. Expired
+        entries are dropped right away, so they no longer count as processed.
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+            self.entries = json.loads(response['Body'].read()).get('entries', {})
+        except self.s3_client.exceptions.NoSuchKey:
+            logger.info(f"No ledger found at s3://{self.bucket}/{self.key}; starting empty")
+            self.entries = {}
+        self.dirty = False
+        self.prune()
+        return self
+
+    def contains(self, key, etag):
+        return self.entry_id(key, etag) in self.entries
+
+    def contains_key(self, key):
+        """Return True if any version of the key is recorded."""
+        prefix = f"{key}#"
+        return any(entry.startswith(prefix) for entry in self.entries)
+
+    def add(self, key, etag, when=None):
+        when = when or datetime.now(timezone.utc)
+        self.entries[self.entry_id(key, etag)] = when.isoformat()
+        self.dirty = True
+
+    def merge_records(self, prefix):
+        """
+        Fold the completion records under prefix into the ledger. Converter tasks write
+        one record per task (an object holding {'entries': {key#etag: time}}), so
+        concurrent tasks never overwrite each other. Returns the keys of the records
+        merged, to delete once the ledger is saved.
+        """
+        merged = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=obj['Key'])
+                entries = json.loads(response['Body'].read()).get('entries', {})
+                self.entries.update(entries)
+                self.dirty = self.dirty or bool(entries)
+                merged.append(obj['Key'])
+        if merged:
+            logger.info(f"Merged {len(merged)} completion record(s) from s3://{self.bucket}/{prefix}")
+        return merged
+
+    def delete_records(self, keys):
+        """Delete merged completion records, 1000 per request."""
+        for start in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
+            )
+
+    def prune(self, now=None):
+        """Drop expired entries, then the oldest ones beyond max_entries."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=self.ttl_days)).isoformat()
+        kept = {k: v for k, v in self.entries.items() if v >= cutoff}
+        if len(kept) > self.max_entries:
+            newest = sorted(kept.items(), key=lambda item: item[1])[-self.max_entries:]
+            kept = dict(newest)
+        if len(kept) != len(self.entries):
+            logger.info(f"Pruned {len(self.entries) - len(kept)} ledger entries")
+            self.entries = kept
+            self.dirty = True
+
+    def save(self):
+        """Prune and write the ledger back to S3 if it changed."""
+        self.prune()
+        if not self.dirty:
+            return
+        body = json.dumps({'entries': self.entries}, separators=(',', ':'))
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=body.encode('utf-8'),
+            ContentType='application/json'
+        )
+        self.dirty = False
+        logger.info(f"Saved {len(self.entries)} ledger entries to s3://{self.bucket}/{self.key}")
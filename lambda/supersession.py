@@ -0,0 +1,74 @@
+import os
+import re
+import logging
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DATE_PATTERN = re.compile(r'(\d{8})')
+
+def get_defined_suffix():
+    return os.environ.get('DEFINED_SUFFIX', '_preliminary')
+
+def is_preliminary(key, suffix=None):
+    """Return True if the key is a preliminary file that will later be replaced by a final one."""
+    suffix = get_defined_suffix() if suffix is None else suffix
+    return bool(suffix) and suffix in key.split('/')[-1]
+
+def final_version(key, suffix=None):
+    """
+    Return the key (or URL) of the final file for a source file. The converter strips
+    the suffix to derive the date, so both versions of a date share this key.
+    """
+    suffix = get_defined_suffix() if suffix is None else suffix
+    directory, _, name = key.rpartition('/')
+    if suffix:
+        name = name.replace(suffix, '')
+    return f"{directory}/{name}" if directory else name
+
+def object_exists(s3_client, url):
+    """
+    Return True if an s3:// URL exists. Without s3:ListBucket a missing key answers
+    403, so a forbidden HEAD is treated as absent.
+    """
+    bucket, _, key = url.replace('s3://', '').partition('/')
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound', '403', 'Forbidden'):
+            return False
+        raise
+
+def schedule_conversions(files, final_known=None, suffix=None):
+    """
+    Plan conversions so every date is written at most once.
+    Files for the same date (a preliminary file and its final file, or repeated
+    requests) are collapsed to one: the final file if it is among `files`, else the
+    last preliminary one. A preliminary file is dropped altogether if final_known
+    (called with the final file's key or URL) reports the final version as already
+    present, queued or converted. Scheduled files are ordered by date so appends
+    and overwrites reach the store in time order.
+    Returns (scheduled, superseded).
+    """
+    by_date = {}
+    for f in dict.fromkeys(files):
+        current = by_date.get(final_version(f, suffix))
+        if current is None or is_preliminary(current, suffix):
+            by_date[final_version(f, suffix)] = f
+    scheduled = []
+    for final, f in by_date.items():
+        if is_preliminary(f, suffix) and final_known is not None and final_known(final):
+            logger.info(f"Skipping {f}: its final version {final} is already available")
+            continue
+        scheduled.append(f)
+    scheduled.sort(key=_date_sort_key)
+    superseded = [f for f in dict.fromkeys(files) if f not in scheduled]
+    if superseded:
+        logger.info(f"Scheduled {len(scheduled)} conversion(s); {len(superseded)} superseded file(s) skipped")
+    return scheduled, superseded
+
+def _date_sort_key(key):
+    match = DATE_PATTERN.search(key.split('/')[-1])
+    return (match.group(1) if match else '', key)
@@ -1,7 +1,34 @@
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
 import xarray as xr
 import numpy as np
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+import copy
 import json
+import logging
+import shutil
+import statistics
+import tempfile
+import time
+import fsspec
+from ecs.store_io import open_variables, split_store_url, get_filesystem, get_store
+from ecs.converter import convert_netcdf_to_zarr, quiet_conversion_logs
+from ecs.io_accounting import io_stats, summarize_io
+
+# Default weight of each measurement in a candidate's score (lower scores are better).
+DEFAULT_WEIGHTS = {
+    "write_seconds": 1.0,
+    "objects_per_day": 1.0,
+    "bytes_per_day": 1.0,
+    "map_seconds": 1.0,
+    "box_seconds": 1.0,
+    "point_seconds": 1.0,
+}
+# Each query is repeated and its median latency kept.
+QUERY_REPEATS = 3
 
 def analyze_netcdf(file_path: str) -> Dict[str, Any]:
     """
@@ -70,15 +97,209 @@ def analyze_netcdf(file_path: str) -> Dict[str, Any]:
         
         return config
 
+def parse_candidates(text: str) -> List[Tuple[int, int]]:
+    """Parse "90x180,180x360" into [(90, 180), (180, 360)] (lat x lon cells per chunk)."""
+    candidates = []
+    for item in text.split(","):
+        lat, lon = item.strip().lower().split("x")
+        candidates.append((int(lat), int(lon)))
+    return candidates
+
+def default_candidates(nlat: int, nlon: int) -> List[Tuple[int, int]]:
+    """Whole-grid chunks and halvings of the grid down to 1/16 of each side."""
+    return [(max(1, nlat // divisor), max(1, nlon // divisor)) for divisor in (16, 8, 4, 2, 1)]
+
+def parse_weights(text: str) -> Dict[str, float]:
+    """Parse "write_seconds=2,point_seconds=0.5" over the default weights."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, value = item.split("=")
+        if name not in weights:
+            raise ValueError(f"Unknown weight {name}; expected one of {', '.join(weights)}")
+        weights[name] = float(value)
+    return weights
+
+def candidate_config(conversion_config: Dict[str, Any], lat_chunk: int, lon_chunk: int) -> Dict[str, Any]:
+    """The conversion config with every variable (and the lat/lon dimensions) chunked lat_chunk x lon_chunk."""
+    config = copy.deepcopy(conversion_config)
+    for var_conf in config.get("variables", {}).values():
+        var_conf.setdefault("chunks", {"time": 1, "zlev": 1})
+        var_conf["chunks"].update({"lat": lat_chunk, "lon": lon_chunk})
+    dimensions = config.setdefault("dimensions", {})
+    dimensions.setdefault("lat", {})["chunks"] = lat_chunk
+    dimensions.setdefault("lon", {})["chunks"] = lon_chunk
+    return config
+
+def fetch_samples(files: List[str], work_dir: str) -> List[str]:
+    """Local copies of the sample files; s3:// URLs (the public NOAA bucket) are read anonymously."""
+    local = []
+    for url in files:
+        if not url.startswith("s3://"):
+            local.append(url)
+            continue
+        path = os.path.join(work_dir, os.path.basename(url))
+        with fsspec.open(url, "rb", anon=True) as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        local.append(path)
+    return local
+
+def time_query(read) -> Tuple[float, int]:
+    """Median latency of a read over QUERY_REPEATS runs and the store requests one run makes."""
+    seconds = []
+    for _ in range(QUERY_REPEATS):
+        before = io_stats.snapshot()
+        start = time.perf_counter()
+        read()
+        seconds.append(time.perf_counter() - start)
+        requests = summarize_io(io_stats.since(before))["requests"]
+    return statistics.median(seconds), requests
+
+def measure_queries(zarr_store: str, variable: str) -> Dict[str, Any]:
+    """
+    Read latency of the representative queries on a store: the full map of the last
+    day, a 10x10 degree box (a 1/18 x 1/36 slice of the grid) and the time series of
+    one point, each read through Zarr like the API reads them.
+    """
+    protocol, path = split_store_url(zarr_store)
+    ds = open_variables(get_store(path, protocol), [variable], chunks=None)
+    var = ds[variable]
+    nlat, nlon = var.sizes["lat"], var.sizes["lon"]
+    box_lat, box_lon = max(1, nlat // 18), max(1, nlon // 36)
+    queries = {
+        "map": lambda: var.isel(time=-1).values,
+        "box": lambda: var.isel(time=-1, lat=slice(nlat // 2, nlat // 2 + box_lat),
+                                lon=slice(nlon // 2, nlon // 2 + box_lon)).values,
+        "point": lambda: var.isel(lat=nlat // 3, lon=nlon // 3).values,
+    }
+    results = {}
+    for name, read in queries.items():
+        seconds, requests = time_query(read)
+        results[f"{name}_seconds"] = seconds
+        results[f"{name}_requests"] = requests
+    return results
+
+def measure_candidate(files: List[str], zarr_store: str, suffix: str, conversion_config: Dict[str, Any],
+                      variable: str) -> Dict[str, Any]:
+    """Convert the sample files into a fresh store with one chunk shape and measure it."""
+    records = [convert_netcdf_to_zarr(netcdf_file, zarr_store, suffix, conversion_config) for netcdf_file in files]
+    protocol, path = split_store_url(zarr_store)
+    # Listed through a plain filesystem, so the listing is not counted as query requests.
+    fs = fsspec.filesystem(protocol, skip_instance_cache=True) if protocol == "s3" else get_filesystem(protocol).sync_fs
+    objects = fs.find(path)
+    measurements = {
+        "write_seconds": statistics.mean(record["total.wall_seconds"] for record in records),
+        "objects_per_day": len(objects) / len(files),
+        "puts_per_day": statistics.mean(record["io.PutObject.requests"] for record in records),
+        "bytes_per_day": sum(fs.size(item) for item in objects) / len(files),
+    }
+    measurements.update(measure_queries(zarr_store, variable))
+    return measurements
+
+def score_candidates(results: List[Dict[str, Any]], weights: Dict[str, float]) -> None:
+    """
+    Score each candidate as the weighted mean of its measurements relative to the
+    best candidate's (1.0 is best on every measurement); adds "score" in place.
+    """
+    total_weight = sum(weights.values()) or 1.0
+    best = {name: min(result[name] for result in results) for name in weights}
+    for result in results:
+        result["score"] = sum(weight * (result[name] / best[name] if best[name] else 1.0)
+                              for name, weight in weights.items()) / total_weight
+
+def tune_chunks(files: List[str], candidates: List[Tuple[int, int]], deployment_config: Dict[str, Any],
+                weights: Dict[str, float], store_root: str, variable: str = "sst") -> Dict[str, Any]:
+    """
+    Convert the sample files once per candidate chunk shape and measure write time,
+    stored objects and compressed bytes per day, and the latency of a full-map, a
+    regional-box and a point time-series query. Returns the deployment config with
+    the best-scoring chunks and the measurements under "chunk_tuning".
+    """
+    suffix = deployment_config.get("defined_suffix", "")
+    # The candidate chunks are written as given: no memory budget and the local scheduler.
+    conversion_config = dict(deployment_config.get("conversion", {}), memory_budget_mib=None, diagnostics=None)
+    conversion_config.pop("dask", None)
+    os.environ.pop("MEMORY_BUDGET_MIB", None)
+    os.environ.setdefault("METRICS_SINK", "off")
+
+    # Pay the process's first-write cost (codecs, metadata) before anything is timed.
+    convert_netcdf_to_zarr(files[0], f"{store_root}/warm-up", suffix, candidate_config(conversion_config, *candidates[0]))
+    results = []
+    for lat_chunk, lon_chunk in candidates:
+        shape = f"{lat_chunk}x{lon_chunk}"
+        print(f"\nMeasuring {shape} chunks on {len(files)} file(s)...")
+        result = {"chunks": shape, "lat": lat_chunk, "lon": lon_chunk}
+        result.update(measure_candidate(files, f"{store_root}/chunks-{shape}", suffix,
+                                        candidate_config(conversion_config, lat_chunk, lon_chunk), variable))
+        results.append(result)
+    score_candidates(results, weights)
+    results.sort(key=lambda result: result["score"])
+
+    print("\nChunk shape  score  write s/day  objects/day  MiB/day  map ms  box ms  point ms")
+    for result in results:
+        print(f"{result['chunks']:>11}  {result['score']:5.2f}  {result['write_seconds']:11.2f}  "
+              f"{result['objects_per_day']:11.0f}  {result['bytes_per_day'] / 2**20:7.2f}  "
+              f"{result['map_seconds'] * 1000:6.1f}  {result['box_seconds'] * 1000:6.1f}  "
+              f"{result['point_seconds'] * 1000:8.1f}")
+
+    best = results[0]
+    config = copy.deepcopy(deployment_config)
+    config["conversion"] = candidate_config(deployment_config.get("conversion", {}), best["lat"], best["lon"])
+    config["chunk_tuning"] = {
+        "files": len(files),
+        "variable": variable,
+        "weights": weights,
+        "best": best["chunks"],
+        "candidates": results,
+    }
+    return config
+
 def main():
     """Command line interface"""
     import argparse
-    parser = argparse.ArgumentParser(description='Analyze NetCDF file and suggest Zarr configuration')
-    parser.add_argument('file', help='Path to NetCDF file')
+    parser = argparse.ArgumentParser(description='Analyze NetCDF files and suggest Zarr configuration')
+    parser.add_argument('files', nargs='+', help='Path to NetCDF file (with --tune: sample files, local or s3://, converted in order)')
     parser.add_argument('--output', '-o', help='Output JSON file for configuration')
+    parser.add_argument('--tune', action='store_true',
+                        help='Measure candidate chunk shapes on the sample files instead of using the size heuristic')
+    parser.add_argument('--candidates', default=None,
+                        help='Comma-separated lat x lon chunk shapes to try, e.g. 90x180,180x360 (default: grid halvings)')
+    parser.add_argument('--config', '-c', default=os.path.join(os.path.dirname(__file__), "..", "config", "app_config.json"),
+                        help='Deployment configuration the tuned chunks are applied to')
+    parser.add_argument('--weights', default=None,
+                        help=f'Score weights, e.g. write_seconds=2,point_seconds=0.5 (of {", ".join(DEFAULT_WEIGHTS)})')
+    parser.add_argument('--variable', default='sst', help='Variable the queries read')
+    parser.add_argument('--store', choices=['local', 's3'], default='local',
+                        help='Write the candidate stores locally or to an in-process S3 stand-in (moto)')
     args = parser.parse_args()
+    if not args.tune and len(args.files) > 1:
+        parser.error("analyze one file at a time; several files are only used as samples with --tune")
     
-    config = analyze_netcdf(args.file)
+    if args.tune:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        quiet_conversion_logs()
+        with open(args.config, 'r') as f:
+            deployment_config = json.load(f)
+        server = None
+        with tempfile.TemporaryDirectory(prefix="chunk-tuning-") as work_dir:
+            files = fetch_samples(args.files, work_dir)
+            with xr.open_dataset(files[0]) as ds:
+                nlat, nlon = ds.sizes["lat"], ds.sizes["lon"]
+            candidates = parse_candidates(args.candidates) if args.candidates else default_candidates(nlat, nlon)
+            if args.store == "s3":
+                from benchmark_conversion import start_s3_stand_in, S3_BUCKET
+                server = start_s3_stand_in()
+                store_root = S3_BUCKET
+            else:
+                store_root = f"file://{os.path.join(work_dir, 'stores')}"
+            try:
+                config = tune_chunks(files, candidates, deployment_config, parse_weights(args.weights),
+                                     store_root, args.variable)
+            finally:
+                if server:
+                    server.stop()
+        print(f"\nBest chunks: {config['chunk_tuning']['best']}")
+    else:
+        config = analyze_netcdf(args.files[0])
     
     if args.output:
         with open(args.output, 'w') as f:
@@ -90,4 +311,4 @@ def main():
         print(json.dumps(config, indent=2))
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root (for the ecs package) and the lambda directory (for the launcher) to sys.path.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.join(PROJECT_ROOT, "lambda"))
+
+import argparse
+import json
+import logging
+import queue
+import time
+import pandas as pd
+from zarr.core.sync import sync
+from ecs.aggregates import rebuild_aggregates, reset_aggregates
+from ecs.cell_layout import apply_cell_layout
+from ecs.conversion_options import conversion_options
+from ecs.converter import load_dataset, add_verifier_pubkeys, convert_netcdf_to_zarr, quiet_conversion_logs
+from ecs.deferred_hashes import add_hash_status
+from ecs.hashing import add_spatial_hashes
+from ecs.store_io import split_store_url, get_store, get_filesystem, time_chunk_days
+from ecs.store_writes import create_presized_store
+from ecs.sources import DEFAULT_SOURCE, enumerate_source_files, partition_days, spawn_pool, SPAWN_CONTEXT
+from ecs.worker_app import build_zarr_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+quiet_conversion_logs()
+logger = logging.getLogger(__name__)
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {"initialized": False, "completed": [], "launched": [], "failed": {}}
+
+def check_checkpoint(checkpoint, zarr_store, start, end):
+    """
+    Return the reasons a resumed checkpoint does not belong to this run: it was written
+    for another store or date range (whose presized time axis the days would miss).
+    """
+    expected = {"store": zarr_store, "start": f"{start:%Y-%m-%d}", "end": f"{end:%Y-%m-%d}"}
+    return [f"{key} {checkpoint[key]} (not {value})" for key, value in expected.items()
+            if checkpoint.get(key) is not None and checkpoint[key] != value]
+
+def store_exists(zarr_store):
+    """True if a Zarr store is already present at the location."""
+    protocol, path = split_store_url(zarr_store)
+    return sync(get_store(path, protocol).exists("zarr.json"))
+
+def save_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically so a crash never leaves a truncated file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+def convert_range(files, zarr_store, suffix, conversion_config, progress_queue):
+    """Worker entry point: convert a contiguous day range into the pre-sized store."""
+    for day, url in files:
+        try:
+            convert_netcdf_to_zarr(url, zarr_store, suffix, conversion_config, write_mode="region")
+            progress_queue.put((day, None))
+        except Exception as e:
+            progress_queue.put((day, str(e)))
+
+def run_local(ranges, files, zarr_store, suffix, conversion_config, workers, checkpoint, checkpoint_path):
+    """Run the day ranges on a local process pool, checkpointing every finished day."""
+    total = sum(len(r) for r in ranges)
+    done = 0
+    start_time = time.time()
+    manager = SPAWN_CONTEXT.Manager()
+    progress_queue = manager.Queue()
+    with spawn_pool(workers) as pool:
+        futures = [
+            pool.submit(convert_range, [(day, files[day]) for day in day_range],
+                        zarr_store, suffix, conversion_config, progress_queue)
+            for day_range in ranges
+        ]
+        while done < total:
+            try:
+                day, error = progress_queue.get(timeout=5)
+            except queue.Empty:
+                failed_futures = [f for f in futures if f.done() and f.exception()]
+                if failed_futures:
+                    raise failed_futures[0].exception()
+                continue
+            done += 1
+            if error:
+                logger.error(f"Failed to convert {day}: {error}")
+                checkpoint["failed"][day] = error
+            else:
+                checkpoint["completed"].append(day)
+                checkpoint["failed"].pop(day, None)
+            save_checkpoint(checkpoint_path, checkpoint)
+            elapsed = time.time() - start_time
+            logger.info(f"Progress: {done}/{total} days, {done / (elapsed / 60):.1f} days/minute")
+    elapsed = time.time() - start_time
+    return total, elapsed
+
+def run_ecs(ranges, files, dest_bucket, checkpoint, checkpoint_path):
+    """
+    Launch each day range as one batched converter task writing in region mode to the
+    store in dest_bucket (the tasks append the config sub_folder, as build_zarr_store does).
+    """
+    import boto3
+    from ecs_launcher import EcsLauncher
+    launcher = EcsLauncher.from_environment(boto3.client('ecs'))
+    launcher.batch_size = max(len(r) for r in ranges)
+    launcher.environment['WRITE_MODE'] = 'region'
+    launcher.environment['DEST_BUCKET'] = dest_bucket
+    launched_total = 0
+    for day_range in ranges:
+        launched, pending = launcher.launch([files[day] for day in day_range])
+        if pending:
+            logger.info("Task limit reached; re-run the backfill to launch the remaining ranges.")
+            break
+        checkpoint["launched"].extend(day_range)
+        save_checkpoint(checkpoint_path, checkpoint)
+        launched_total += len(day_range)
+    return launched_total
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Backfill a date range of source NetCDF files into a pre-sized Zarr store')
+    parser.add_argument('--start', required=True, help='First day (YYYY-MM-DD)')
+    parser.add_argument('--end', required=True, help='Last day (YYYY-MM-DD)')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='Source prefix holding YYYYMM/ directories')
+    parser.add_argument('--dest-bucket', required=True, help='Destination bucket (the config sub_folder is appended)')
+    parser.add_argument('--config', '-c', default='config/app_config.json', help='Deployment configuration')
+    parser.add_argument('--mode', choices=['local', 'ecs'], default='local',
+                        help='Run ranges on a local process pool or as batched ECS tasks')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(), help='Local worker processes')
+    parser.add_argument('--days-per-range', type=int, default=31, help='Days per contiguous range')
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json', help='Checkpoint file used to resume')
+    parser.add_argument('--force', action='store_true',
+                        help='Replace an existing store at the destination with the pre-sized one')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        deployment_config = json.load(f)
+    suffix = deployment_config.get("defined_suffix", "")
+    # Backfilled days are not published one at a time, so they are hashed inline.
+    conversion_config = dict(deployment_config.get("conversion", {}), hash_phase="inline")
+    zarr_store = build_zarr_store(args.dest_bucket, deployment_config)
+    protocol, zarr_store_path = split_store_url(zarr_store)
+    aggregates_config = conversion_config.get("aggregates")
+
+    start, end = pd.Timestamp(args.start), pd.Timestamp(args.end)
+    checkpoint = load_checkpoint(args.checkpoint)
+    mismatched = check_checkpoint(checkpoint, zarr_store, start, end)
+    if mismatched:
+        logger.error(f"Checkpoint {args.checkpoint} belongs to another backfill: {', '.join(mismatched)}. "
+                     f"Use another --checkpoint for this one.")
+        sys.exit(1)
+    checkpoint.update({"store": zarr_store, "start": f"{start:%Y-%m-%d}", "end": f"{end:%Y-%m-%d}"})
+
+    files = {day.strftime('%Y-%m-%d'): url for day, url in enumerate_source_files(args.source, start, end, suffix).items()}
+    all_days = pd.date_range(start, end, freq="D")
+    missing = [d.strftime('%Y-%m-%d') for d in all_days if d.strftime('%Y-%m-%d') not in files]
+    logger.info(f"Found {len(files)} source file(s) for {len(all_days)} day(s); {len(missing)} day(s) missing")
+
+    if not checkpoint["initialized"]:
+        if store_exists(zarr_store) and not args.force:
+            # Without its checkpoint (lost, or another working directory) a backfill would
+            # otherwise presize over a populated store and wipe it.
+            logger.error(f"{zarr_store} already holds a Zarr store. Resume with the checkpoint that created it, "
+                         f"or pass --force to replace it.")
+            sys.exit(1)
+        # The time axis covers every day in the range, so days can be written in any order.
+        first_file = next(iter(files.values()))
+        ds, _ = load_dataset(first_file, suffix, conversion_config)
+        ds = apply_cell_layout(add_spatial_hashes(ds), zarr_store, conversion_config, new_store=True)
+        ds = add_verifier_pubkeys(ds)
+        if conversion_options(deployment_config.get("conversion")).deferred_hashes:
+            # Later deferred conversions mark their days in the store's hash_pending.
+            ds = add_hash_status(ds, pending=False)
+        create_presized_store(ds, zarr_store, all_days + pd.Timedelta(hours=12),
+                              dedup=conversion_config.get("chunk_dedup", False))
+        if aggregates_config is not None:
+            # Region writes do not update the aggregates; they are rebuilt once the store is filled.
+            reset_aggregates(get_filesystem(protocol), zarr_store_path, aggregates_config)
+        checkpoint["initialized"] = True
+        save_checkpoint(args.checkpoint, checkpoint)
+
+    finished = set(checkpoint["completed"]) | set(checkpoint["launched"])
+    remaining = [day for day in files if day not in finished]
+    # Days sharing a multi-day time chunk are written by the same range, one after another.
+    time_chunk = time_chunk_days(get_store(zarr_store_path, protocol))
+    ranges = partition_days(remaining, args.days_per_range, time_chunk, start)
+    logger.info(f"{len(remaining)} day(s) remaining in {len(ranges)} range(s)")
+    if not ranges:
+        return
+
+    if args.mode == 'local':
+        total, elapsed = run_local(ranges, files, zarr_store, suffix, conversion_config,
+                                   args.workers, checkpoint, args.checkpoint)
+        logger.info(f"Converted {total} day(s) in {elapsed / 60:.1f} minutes "
+                    f"({total / max(elapsed / 60, 1e-9):.1f} days/minute); {len(checkpoint['failed'])} failed")
+        if aggregates_config is not None:
+            if checkpoint["failed"]:
+                logger.warning("The aggregates are stale until the failed days are converted; re-run the backfill.")
+            else:
+                logger.info("Rebuilding the aggregates of the backfilled store")
+                rebuild_aggregates(get_filesystem(protocol), zarr_store_path, aggregates_config)
+    else:
+        launched = run_ecs(ranges, files, args.dest_bucket, checkpoint, args.checkpoint)
+        logger.info(f"Launched {launched} day(s) as batched ECS tasks")
+        if aggregates_config is not None:
+            logger.warning(f"The aggregates of {zarr_store} are stale until rebuilt: run scripts/rebuild_aggregates.py "
+                           f"once the tasks have finished.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+import dask
+import fsspec
+import numpy as np
+import xarray as xr
+import zarr
+from ecs.converter import load_dataset, add_verifier_pubkeys, quiet_conversion_logs
+from ecs.hashing import add_spatial_hashes
+from ecs.store_io import split_store_url, get_filesystem
+from ecs.store_writes import write_to_zarr
+from ecs.io_accounting import io_stats, summarize_io
+from synthetic_oisst import write_days
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+quiet_conversion_logs()
+logger = logging.getLogger(__name__)
+
+STAGES = ("load_dataset", "add_spatial_hashes", "add_verifier_pubkeys", "write_to_zarr")
+S3_BUCKET = "benchmark"
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def start_s3_stand_in(port=5000):
+    """
+    Start an in-process moto S3 server (a development dependency) with an empty
+    benchmark bucket, and point the converter's S3 filesystem at it.
+    """
+    import boto3
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(port=port)
+    server.start()
+    os.environ["AWS_ENDPOINT_URL_S3"] = f"http://127.0.0.1:{port}"
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "test")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    boto3.client("s3").create_bucket(Bucket=S3_BUCKET)
+    return server
+
+def store_location(kind, work_dir):
+    """Return a fresh store URL for a store kind ("local", "memory" or "s3")."""
+    if kind == "local":
+        return f"file://{os.path.join(work_dir, 'store-' + uuid.uuid4().hex[:8])}"
+    if kind == "memory":
+        return f"memory://benchmark-{uuid.uuid4().hex[:8]}"
+    if kind == "s3":
+        return f"{S3_BUCKET}/store-{uuid.uuid4().hex[:8]}"
+    raise ValueError(f"Unknown store kind: {kind}")
+
+def convert_timed(netcdf_file, zarr_store, suffix, conversion_config):
+    """
+    Convert one file, timing each converter stage separately. The pipeline is lazy,
+    so each stage's output is persisted before the clock stops: load_dataset includes
+    reading and decoding the file, add_spatial_hashes the hashing, and write_to_zarr
+    only encoding and writing.
+    """
+    timings = {}
+    start = time.perf_counter()
+    ds, new_time = load_dataset(netcdf_file, suffix, conversion_config)
+    ds = ds.persist()
+    timings["load_dataset"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ds = add_spatial_hashes(ds)
+    ds["spatial_hash"] = ds["spatial_hash"].persist()
+    timings["add_spatial_hashes"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ds = add_verifier_pubkeys(ds)
+    timings["add_verifier_pubkeys"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_to_zarr(ds, zarr_store, new_time)
+    timings["write_to_zarr"] = time.perf_counter() - start
+    return timings
+
+def summarize(values):
+    return {
+        "mean": float(np.mean(values)),
+        "median": float(np.median(values)),
+        "min": float(np.min(values)),
+        "max": float(np.max(values)),
+        "per_day": [round(v, 4) for v in values],
+    }
+
+def summarize_requests(per_day):
+    """Highest and mean storage requests per day, in total, per operation and per object kind."""
+    counts = []
+    for summary in per_day:
+        day = {"total": summary["requests"], "class_a": summary["class_a_requests"],
+               "class_b": summary["class_b_requests"]}
+        day.update({operation: values["requests"] for operation, values in summary["operations"].items()})
+        day.update({kind: values["requests"] for kind, values in summary["by_kind"].items()})
+        counts.append(day)
+    names = sorted({name for day in counts for name in day})
+    return {
+        "max": {name: max(day.get(name, 0) for day in counts) for name in names},
+        "mean": {name: float(np.mean([day.get(name, 0) for day in counts])) for name in names},
+        "bytes_out_per_day": float(np.mean([summary["bytes_out"] for summary in per_day])),
+    }
+
+def run_benchmark(files, kind, work_dir, suffix, conversion_config):
+    """Convert the files into a fresh store of the given kind and return the timings and request counts."""
+    zarr_store = store_location(kind, work_dir)
+    protocol, path = split_store_url(zarr_store)
+    fs = get_filesystem(protocol)
+    logger.info(f"Benchmarking {len(files)} day(s) into {zarr_store}")
+    per_stage = {stage: [] for stage in STAGES}
+    per_day_io = []
+    start = time.perf_counter()
+    for netcdf_file in files:
+        before = io_stats.snapshot()
+        for stage, seconds in convert_timed(netcdf_file, zarr_store, suffix, conversion_config).items():
+            per_stage[stage].append(seconds)
+        per_day_io.append(summarize_io(io_stats.since(before)))
+    total = time.perf_counter() - start
+
+    # Check the store holds every day before trusting the numbers.
+    written = xr.open_zarr(zarr.storage.FsspecStore(fs=fs, read_only=True, path=path), consolidated=True)
+    if written.sizes["time"] != len(files):
+        raise RuntimeError(f"Expected {len(files)} time steps in {zarr_store}, found {written.sizes['time']}")
+    # Local filesystems are wrapped for zarr; size and clean up through the wrapped one.
+    # The S3 filesystem is driven from Zarr's event loop, so a separate client is used.
+    sync_fs = fsspec.filesystem("s3", skip_instance_cache=True) if protocol == "s3" else getattr(fs, "sync_fs", fs)
+    store_bytes = sync_fs.du(path)
+    sync_fs.rm(path, recursive=True)
+    return {
+        "store": kind,
+        "stages": {stage: summarize(values) for stage, values in per_stage.items()},
+        "total_seconds": total,
+        "days_per_minute": len(files) / (total / 60),
+        "store_bytes": int(store_bytes),
+        "requests_per_day": summarize_requests(per_day_io),
+    }
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return regressions: stages whose median time grew by more than `tolerance` (a fraction)."""
+    regressions = []
+    baseline_runs = {run["store"]: run for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        reference = baseline_runs.get(run["store"])
+        if reference is None:
+            continue
+        for stage, stats in run["stages"].items():
+            before = reference["stages"].get(stage, {}).get("median")
+            if before and stats["median"] > before * (1 + tolerance):
+                regressions.append({
+                    "store": run["store"],
+                    "stage": stage,
+                    "baseline_median": before,
+                    "median": stats["median"],
+                    "change": stats["median"] / before - 1,
+                })
+    return regressions
+
+def parse_request_budget(text):
+    """Parse "PutObject=150,total=300" into {"PutObject": 150, "total": 300}."""
+    budget = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, limit = item.partition("=")
+        budget[name.strip()] = int(limit)
+    return budget
+
+def check_request_budget(results, budget):
+    """Return budget violations: counts whose highest value on any day exceeds its limit."""
+    violations = []
+    for run in results["runs"]:
+        for name, limit in budget.items():
+            worst = run["requests_per_day"]["max"].get(name, 0)
+            if worst > limit:
+                violations.append({"store": run["store"], "requests": name, "limit": limit, "max_per_day": worst})
+    return violations
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Benchmark the NetCDF to Zarr conversion on synthetic OISST-shaped data')
+    parser.add_argument('--days', type=int, default=3, help='Number of synthetic days to convert')
+    parser.add_argument('--nlat', type=int, default=720, help='Latitude cells (OISST: 720)')
+    parser.add_argument('--nlon', type=int, default=1440, help='Longitude cells (OISST: 1440)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data')
+    parser.add_argument('--stores', default='local,memory',
+                        help='Comma-separated store kinds: local, memory, s3 (a local moto S3 server)')
+    parser.add_argument('--config', '-c', default=None,
+                        help='Deployment configuration whose conversion section is used (default chunking if omitted)')
+    parser.add_argument('--output', '-o', default='benchmark_results.json', help='Where to write the JSON results')
+    parser.add_argument('--baseline', default=None, help='Earlier results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown of a stage median before it counts as a regression')
+    parser.add_argument('--request-budget', default=None,
+                        help='Most storage requests allowed on any day, e.g. "total=300,PutObject=150,metadata=80" '
+                             '(operations, object kinds, class_a, class_b or total)')
+    args = parser.parse_args()
+
+    conversion_config = None
+    suffix = ""
+    if args.config:
+        with open(args.config, 'r') as f:
+            deployment_config = json.load(f)
+        conversion_config = deployment_config.get("conversion")
+        suffix = deployment_config.get("defined_suffix", "")
+
+    kinds = [kind.strip() for kind in args.stores.split(",") if kind.strip()]
+    s3_server = start_s3_stand_in() if "s3" in kinds else None
+    try:
+        with tempfile.TemporaryDirectory(prefix="conversion-benchmark-") as work_dir:
+            logger.info(f"Generating {args.days} synthetic day(s) on a {args.nlat}x{args.nlon} grid")
+            files = write_days(os.path.join(work_dir, "source"), "2025-01-01", args.days, args.nlat, args.nlon, args.seed)
+            runs = [run_benchmark(files, kind, work_dir, suffix, conversion_config) for kind in kinds]
+    finally:
+        if s3_server is not None:
+            s3_server.stop()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "xarray": xr.__version__,
+            "zarr": zarr.__version__,
+            "dask": dask.__version__,
+            "numpy": np.__version__,
+        },
+        "parameters": {
+            "days": args.days,
+            "grid": [args.nlat, args.nlon],
+            "seed": args.seed,
+            "config": args.config,
+        },
+        "runs": runs,
+    }
+
+    for run in runs:
+        stages = ", ".join(f"{stage} {stats['median']:.2f}s" for stage, stats in run["stages"].items())
+        logger.info(f"[{run['store']}] {run['days_per_minute']:.1f} days/minute; median per day: {stages}")
+        requests = run["requests_per_day"]["max"]
+        logger.info(f"[{run['store']}] at most {requests['total']} storage requests per day "
+                    f"({requests.get('PutObject', 0)} PUT, {requests.get('GetObject', 0)} GET, "
+                    f"{requests.get('metadata', 0)} metadata, {requests.get('chunk', 0)} chunk)")
+
+    exit_code = 0
+    budget = parse_request_budget(args.request_budget)
+    if budget:
+        results["request_budget"] = budget
+        results["budget_violations"] = check_request_budget(results, budget)
+        for violation in results["budget_violations"]:
+            logger.warning(f"Request budget exceeded in {violation['store']}: {violation['max_per_day']} "
+                           f"{violation['requests']} requests on a day (limit {violation['limit']})")
+        exit_code = 1 if results["budget_violations"] else 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        results["baseline"] = {"commit": baseline.get("commit"), "file": args.baseline}
+        results["regressions"] = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in results["regressions"]:
+            logger.warning(f"Regression in {regression['store']}/{regression['stage']}: "
+                           f"{regression['baseline_median']:.3f}s -> {regression['median']:.3f}s "
+                           f"({regression['change']:+.0%})")
+        exit_code = 1 if results["regressions"] or exit_code else 0
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
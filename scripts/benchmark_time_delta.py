@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import tempfile
+import time
+import numpy as np
+import xarray as xr
+import zarr
+from zarr.codecs import BloscCodec, ZstdCodec
+from ecs.time_delta import TimeDeltaCodec
+from synthetic_oisst import write_days
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Compressors compared, each with and without the time-delta filter. blosc/zstd with
+# shuffle is what the deployment config names; zstd alone is Zarr's default.
+COMPRESSORS = {
+    "blosc-zstd": lambda: BloscCodec(cname="zstd", clevel=5, shuffle="shuffle"),
+    "blosc-zstd-bitshuffle": lambda: BloscCodec(cname="zstd", clevel=5, shuffle="bitshuffle"),
+    "zstd": lambda: ZstdCodec(level=5),
+}
+
+def parse_chunks(text):
+    """'180x360' -> (180, 360)"""
+    lat, lon = text.lower().split("x")
+    return int(lat), int(lon)
+
+def load_stack(files, variable, packed):
+    """
+    One variable of the days as a (time, lat, lon) array: the stored int16 values
+    (with their fill value) when packed, otherwise decoded float32 with NaN.
+    """
+    days = []
+    for path in files:
+        with xr.open_dataset(path, engine="h5netcdf", mask_and_scale=not packed) as ds:
+            var = ds[variable]
+            days.append(var.isel({dim: 0 for dim in var.dims if dim not in ("lat", "lon")}).values)
+    stack = np.stack(days)
+    return stack if packed else stack.astype(np.float32)
+
+def measure(values, chunks, compressor, delta, repeats):
+    """Write values to an in-memory array and time reading it back; returns the stats and checks the round trip."""
+    store = zarr.storage.MemoryStore()
+    fill_value = np.nan if np.issubdtype(values.dtype, np.floating) else 0
+    array = zarr.create_array(store, shape=values.shape, dtype=values.dtype, chunks=chunks,
+                              filters=[TimeDeltaCodec()] if delta else None,
+                              compressors=[COMPRESSORS[compressor]()], fill_value=fill_value)
+    start = time.perf_counter()
+    array[...] = values
+    write_seconds = time.perf_counter() - start
+    stored = sum(len(value) for key, value in store._store_dict.items() if "/c/" in key or key.startswith("c/"))
+    read_seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        decoded = array[...]
+        read_seconds.append(time.perf_counter() - start)
+    if not np.array_equal(decoded.view(np.uint8), values.view(np.uint8)):
+        raise RuntimeError(f"{compressor} (delta={delta}) did not round-trip exactly")
+    return {
+        "compressor": compressor,
+        "time_delta": delta,
+        "stored_bytes": stored,
+        "ratio": values.nbytes / stored,
+        "encode_mib_per_second": values.nbytes / 2**20 / write_seconds,
+        "decode_mib_per_second": values.nbytes / 2**20 / min(read_seconds),
+    }
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Compare compression ratio and decode throughput of multi-day time '
+                                                 'chunks with and without the time-delta codec')
+    parser.add_argument('files', nargs='*', help='Consecutive daily NetCDF files (default: synthetic days)')
+    parser.add_argument('--days', type=int, default=30, help='Synthetic days when no files are given')
+    parser.add_argument('--nlat', type=int, default=720, help='Latitude cells of the synthetic days')
+    parser.add_argument('--nlon', type=int, default=1440, help='Longitude cells of the synthetic days')
+    parser.add_argument('--variables', default='sst,err', help='Comma-separated variables to measure')
+    parser.add_argument('--time-chunk', type=int, default=30, help='Days per chunk')
+    parser.add_argument('--chunks', default='180x360', help='Spatial chunk, LATxLON')
+    parser.add_argument('--float', action='store_true', help='Measure decoded float32 values instead of the packed int16')
+    parser.add_argument('--repeats', type=int, default=3, help='Reads per variant; the fastest counts')
+    parser.add_argument('--output', '-o', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = args.files
+        if not files:
+            # Synthetic days draw independent noise each day, so they understate the
+            # day-to-day redundancy of real fields; pass real files for representative numbers.
+            logger.info(f"Generating {args.days} synthetic day(s) at {args.nlat}x{args.nlon}")
+            files = write_days(tmp, "2025-01-01", args.days, args.nlat, args.nlon)
+        chunks = (args.time_chunk,) + parse_chunks(args.chunks)
+        results = []
+        for variable in [name.strip() for name in args.variables.split(",") if name.strip()]:
+            values = load_stack(sorted(files), variable, packed=not args.float)
+            logger.info(f"{variable}: {values.shape} {values.dtype}, {values.nbytes / 2**20:.1f} MiB, chunks {chunks}")
+            for compressor in COMPRESSORS:
+                for delta in (False, True):
+                    result = dict(measure(values, chunks, compressor, delta, args.repeats), variable=variable)
+                    results.append(result)
+                    logger.info(f"  {compressor:<22} {'delta' if delta else 'plain':<5} ratio {result['ratio']:6.2f}  "
+                                f"encode {result['encode_mib_per_second']:7.1f} MiB/s  "
+                                f"decode {result['decode_mib_per_second']:7.1f} MiB/s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"files": len(files), "chunks": chunks, "packed": not args.float, "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
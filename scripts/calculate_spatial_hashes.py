@@ -1,11 +1,20 @@
-import xarray as xr
-import numpy as np
-import blake3
-from pathlib import Path
-import struct
-from typing import List, Tuple
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
 import logging
 import time
+from concurrent.futures import as_completed
+import fsspec
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ecs.hashing import spatial_hash_batch
+from ecs.sources import DEFAULT_SOURCE, enumerate_source_files, open_source, spawn_pool
 
 # Set up logging
 logging.basicConfig(
@@ -14,6 +23,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Output file suffix by format. Binary files hold the raw 32-byte digests of every
+# (time, lat, lon) cell in row-major order, zeros where a cell has no hash.
+OUTPUT_SUFFIXES = {"netcdf": ".hashes.nc", "zarr": ".hashes.zarr", "binary": ".hashes.bin"}
+
 def setup_logging(file_path: str = None):
     """Configure logging to both file and console"""
     if file_path:
@@ -21,157 +34,147 @@ def setup_logging(file_path: str = None):
         file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
         logger.addHandler(file_handler)
 
-def calculate_spatial_hash(lat: float, lon: float, sst: float, err: float, 
-                         ice: float, anom: float) -> str:
-    """Calculate BLAKE3 hash for a specific lat/lon point and its associated values"""
-    try:
-        # Replace NaN values with a sentinel value (-999.0)
-        sst_val = -999.0 if np.isnan(sst) else sst
-        err_val = -999.0 if np.isnan(err) else err
-        ice_val = -999.0 if np.isnan(ice) else ice
-        anom_val = -999.0 if np.isnan(anom) else anom
-        
-        value_bytes = struct.pack('6f', lat, lon, sst_val, err_val, ice_val, anom_val)
-        return blake3.blake3(value_bytes).hexdigest()
-    except struct.error as e:
-        logger.error(f"Error packing values: lat={lat}, lon={lon}, sst={sst_val}, "
-                    f"err={err_val}, ice={ice_val}, anom={anom_val}")
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error while hashing: {str(e)}")
-        raise
+def expand_inputs(patterns):
+    """Local paths and s3:// URLs matching the given files or glob patterns, in order."""
+    files = []
+    for pattern in patterns:
+        if pattern.startswith("s3://"):
+            fs, _ = fsspec.core.url_to_fs(pattern, anon=True)
+            files.extend(f"s3://{path}" for path in sorted(fs.glob(pattern)))
+        else:
+            fs, _ = fsspec.core.url_to_fs(pattern)
+            files.extend(sorted(fs.glob(pattern)) or [pattern])
+    return list(dict.fromkeys(files))
 
-def process_netcdf_file(file_path: str) -> xr.DataArray:
-    """Process a single NetCDF file and calculate hashes for each lat/lon point"""
-    logger.info(f"Processing file: {file_path}")
-    
-    try:
-        # Open dataset
-        ds = xr.open_dataset(file_path)
-        
-        # Debug print array shapes
-        logger.info("\nArray shapes before squeeze:")
-        logger.info(f"sst shape: {ds.sst.shape}")
-        
-        # Select first time step and squeeze to remove single-dimension axes
-        ds = ds.isel(time=0, zlev=0)
-        
-        logger.info("\nArray shapes after selection:")
-        logger.info(f"sst shape: {ds.sst.shape}")
-        logger.info(f"Grid dimensions: {len(ds.lat)}x{len(ds.lon)}")
-        
-        # Initialize output array
-        hash_array = np.empty((len(ds.lat), len(ds.lon)), dtype='U64')
-        
-        # Get variables as 2D arrays
-        sst = ds.sst.values
-        err = ds.err.values
-        ice = ds.ice.values
-        anom = ds.anom.values
-        
-        # Process each point
-        total_points = len(ds.lat) * len(ds.lon)
-        processed = 0
-        
-        for i in range(len(ds.lat)):
-            for j in range(len(ds.lon)):
-                try:
-                    # Convert values to native Python floats
-                    lat_val = float(ds.lat.values[i])
-                    lon_val = float(ds.lon.values[j])
-                    sst_val = float(sst[i,j])
-                    err_val = float(err[i,j])
-                    ice_val = float(ice[i,j])
-                    anom_val = float(anom[i,j])
-                    
-                    # Calculate hash
-                    hash_value = calculate_spatial_hash(
-                        lat_val, lon_val, sst_val, err_val, ice_val, anom_val
-                    )
-                    hash_array[i,j] = hash_value
-                    
-                    processed += 1
-                    if processed % 100000 == 0:
-                        logger.info(f"Processed {processed}/{total_points} points "
-                                  f"({processed/total_points*100:.1f}%)")
-                    
-                except Exception as e:
-                    logger.error(f"Error at point ({i},{j}): {str(e)}")
-                    logger.error(f"Values: lat={lat_val}, lon={lon_val}, "
-                               f"sst={sst[i,j]}, err={err[i,j]}, "
-                               f"ice={ice[i,j]}, anom={anom[i,j]}")
-                    raise
+def hash_dataset(ds, land_mask=False, hexdigest=True):
+    """
+    Hashes of every (time, lat, lon) cell of a source dataset (first zlev), identical
+    to the spatial_hash the converter stores for it (with the same land_mask option).
+    """
+    if "zlev" in ds.dims:
+        ds = ds.isel(zlev=0)
+    ds = ds.transpose("time", "lat", "lon", ...)
+    lat = ds["lat"].values[None, :, None]
+    lon = ds["lon"].values[None, None, :]
+    return spatial_hash_batch(lat, lon, ds["sst"].values, ds["err"].values, ds["ice"].values,
+                              ds["anom"].values, land_mask=land_mask, hexdigest=hexdigest)
 
-        # Create DataArray with same coordinates as input
-        hash_da = xr.DataArray(
-            data=hash_array,
-            dims=['lat', 'lon'],
-            coords={
-                'lat': ds.lat,
-                'lon': ds.lon
-            },
-            name='spatial_hash'
-        )
-        
-        logger.info(f"Successfully processed {file_path}")
-        return hash_da
-    
-    except Exception as e:
-        logger.error(f"Failed to process {file_path}: {str(e)}")
-        raise
-    finally:
-        ds.close()
+def output_path(url, output_dir, fmt):
+    """Output file of one source file: its name with the format's suffix, in output_dir."""
+    name = url.rstrip("/").split("/")[-1]
+    if name.endswith(".nc"):
+        name = name[:-len(".nc")]
+    return os.path.join(output_dir, name + OUTPUT_SUFFIXES[fmt])
 
-def main():
-    """Process test files and calculate spatial hashes"""
-    setup_logging('spatial_hash_processing.log')
-    start_time = time.time()
-    
-    test_files = [
-        "oisst-avhrr-v02r01.20250101.nc",
-        "oisst-avhrr-v02r01.20250102.nc",
-        "oisst-avhrr-v02r01.20250103.nc"
-    ]
-    
-    sample_points = [
-        (0, 0, "Equator/Greenwich"),
-        (25, -80, "Miami"),
-        (35, 140, "Tokyo")
-    ]
-    
-    for test_file in test_files:
+def process_netcdf_file(url, output_dir, fmt, land_mask=False):
+    """Hash one NetCDF file, write the hashes in the given format and return its throughput."""
+    start = time.perf_counter()
+    with open_source(url) as ds:
+        ds = ds[["sst", "err", "ice", "anom"]].load()
+    read_seconds = time.perf_counter() - start
+    hashes = hash_dataset(ds, land_mask, hexdigest=fmt != "binary")
+    hash_seconds = time.perf_counter() - start - read_seconds
+    path = output_path(url, output_dir, fmt)
+    if fmt == "binary":
+        with open(path, "wb") as f:
+            f.write(hashes.tobytes())
+    else:
+        ds = ds.isel(zlev=0) if "zlev" in ds.dims else ds
+        hash_ds = xr.Dataset({"spatial_hash": (("time", "lat", "lon"), hashes)},
+                             coords={"time": ds["time"], "lat": ds["lat"], "lon": ds["lon"]})
+        hash_ds["spatial_hash"].attrs["description"] = "BLAKE3 hash of each cell's lat, lon, sst, err, ice and anom"
+        if fmt == "netcdf":
+            hash_ds.to_netcdf(path, engine="h5netcdf")
+        else:
+            hash_ds.to_zarr(path, mode="w", consolidated=True)
+    cells = int(np.prod(hashes.shape[:3]))
+    seconds = time.perf_counter() - start
+    return {
+        "file": url,
+        "output": path,
+        "cells": cells,
+        "read_seconds": read_seconds,
+        "hash_seconds": hash_seconds,
+        "seconds": seconds,
+        "cells_per_second": cells / hash_seconds if hash_seconds else None,
+    }
+
+def process_files(urls, output_dir, fmt, land_mask):
+    """Worker entry point: hash a batch of files; failures are reported, not raised."""
+    reports = []
+    for url in urls:
         try:
-            file_path = Path('tests/data') / test_file
-            if not file_path.exists():
-                logger.error(f"File not found: {file_path}")
-                continue
-            
-            logger.info(f"\nProcessing {test_file}...")
-            file_start_time = time.time()
-            hash_da = process_netcdf_file(str(file_path))
-            file_duration = time.time() - file_start_time
-            logger.info(f"File processing time: {file_duration:.2f} seconds")
-            
-            # Print sample hashes
-            logger.info("\nSample hashes:")
-            logger.info(f"{'Location':>20} | {'Hash':<64}")
-            logger.info("-" * 90)
-            
-            for lat_idx, lon_idx, name in sample_points:
-                try:
-                    lat = float(hash_da.lat[lat_idx])
-                    lon = float(hash_da.lon[lon_idx])
-                    hash_value = hash_da.isel(lat=lat_idx, lon=lon_idx).item()
-                    logger.info(f"{name:>20} | {hash_value}")
-                except Exception as e:
-                    logger.error(f"Error getting sample point {name}: {str(e)}")
-            
+            reports.append(dict(process_netcdf_file(url, output_dir, fmt, land_mask), status="ok"))
         except Exception as e:
-            logger.error(f"Error processing {test_file}: {str(e)}")
+            reports.append({"file": url, "status": "error", "error": str(e)})
+    return reports
+
+def run_hashing(files, output_dir, fmt, land_mask, workers):
+    """Hash the files on a process pool, logging each file's throughput; returns the reports in input order."""
+    reports = []
+    start = time.perf_counter()
+    with spawn_pool(workers) as pool:
+        futures = [pool.submit(process_files, [url], output_dir, fmt, land_mask) for url in files]
+        for future in as_completed(futures):
+            for report in future.result():
+                reports.append(report)
+                if report["status"] != "ok":
+                    logger.error(f"{report['file']}: {report['error']}")
+                    continue
+                logger.info(f"{report['file']}: {report['cells']} cells hashed in {report['hash_seconds']:.2f}s "
+                            f"({report['cells_per_second'] / 1e6:.2f}M cells/s), {report['seconds']:.2f}s in total")
+            elapsed = time.perf_counter() - start
+            logger.info(f"Hashed {len(reports)}/{len(files)} files, {len(reports) / (elapsed / 60):.0f} files/minute")
+    order = {url: index for index, url in enumerate(files)}
+    return sorted(reports, key=lambda report: order[report["file"]])
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Calculate the spatial hashes of OISST NetCDF files outside the '
+                                                 'conversion pipeline, one file per worker task')
+    parser.add_argument('files', nargs='*', help='NetCDF files or glob patterns (local or s3://)')
+    parser.add_argument('--start', default=None, help='First day (YYYY-MM-DD), instead of files')
+    parser.add_argument('--end', default=None, help='Last day (YYYY-MM-DD); defaults to --start')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='Source prefix holding YYYYMM/ directories (or a flat directory)')
+    parser.add_argument('--config', '-c', default='config/app_config.json', help='Deployment configuration (for the file suffix)')
+    parser.add_argument('--output-dir', '-o', default='spatial_hashes', help='Directory for the hash files')
+    parser.add_argument('--format', choices=sorted(OUTPUT_SUFFIXES), default='netcdf', help='Output format')
+    parser.add_argument('--land-mask', action='store_true',
+                        help='Empty hashes for cells with no value, as stores converted with land_mask hold')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--report', default=None, help='Write the per-file report as JSON to this file')
+    parser.add_argument('--log-file', default=None, help='Also log to this file')
+    args = parser.parse_args()
+    setup_logging(args.log_file)
 
+    if args.start:
+        with open(args.config, 'r') as f:
+            suffix = json.load(f).get("defined_suffix", "")
+        start, end = pd.Timestamp(args.start), pd.Timestamp(args.end or args.start)
+        files = [url for _, url in sorted(enumerate_source_files(args.source, start, end, suffix).items())]
+    elif args.files:
+        files = expand_inputs(args.files)
+    else:
+        parser.error("give files or --start")
+    if not files:
+        logger.error("No input files found")
+        sys.exit(1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    logger.info(f"Hashing {len(files)} file(s) into {args.output_dir} as {args.format} with {args.workers} worker(s)")
+    start_time = time.time()
+    reports = run_hashing(files, args.output_dir, args.format, args.land_mask, max(1, args.workers))
     total_duration = time.time() - start_time
-    logger.info(f"\nTotal processing time: {total_duration:.2f} seconds")
-    logger.info(f"Average time per file: {total_duration/len(test_files):.2f} seconds")
+
+    failed = [report for report in reports if report["status"] != "ok"]
+    logger.info(f"Total processing time: {total_duration:.2f} seconds")
+    logger.info(f"Average time per file: {total_duration / len(files):.2f} seconds"
+                + (f"; {len(failed)} file(s) failed" if failed else ""))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import as_completed
+import numpy as np
+import pandas as pd
+from ecs.store_io import open_variables, split_store_url, get_store
+from ecs.land_mask import read_presence
+from ecs.sources import DEFAULT_SOURCE, enumerate_source_files, partition_days, open_source, spawn_pool
+from ecs.worker_app import build_zarr_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Source variables the converter copies unchanged into the store.
+DEFAULT_VARIABLES = ("sst", "anom", "err", "ice")
+
+# Opened store per worker process: store URL -> (dataset, normalized time index, chunk presence).
+_stores = {}
+
+def open_store(zarr_store, variables):
+    """Open the store's variables and chunk-presence index once per process, as lazily indexed (not dask) arrays."""
+    if zarr_store not in _stores:
+        protocol, path = split_store_url(zarr_store)
+        store = get_store(path, protocol)
+        ds = open_variables(store, variables, chunks=None)
+        _stores[zarr_store] = (ds, pd.DatetimeIndex(ds["time"].values).normalize(), read_presence(store))
+    return _stores[zarr_store]
+
+def day_field(var):
+    """The 2-D (lat, lon) field of a one-day variable, with or without time and zlev."""
+    return var.isel({dim: 0 for dim in var.dims if dim not in ("lat", "lon")}).transpose("lat", "lon")
+
+def compare_blocks(expected, actual):
+    """
+    Compare two arrays exactly, treating NaN as equal to NaN. Returns a mask of the
+    differing cells, the cells where only one side is NaN and the largest absolute
+    difference between cells that are both numbers.
+    """
+    if np.issubdtype(expected.dtype, np.floating) or np.issubdtype(actual.dtype, np.floating):
+        expected_nan, actual_nan = np.isnan(expected), np.isnan(actual)
+        nan_mismatch = expected_nan != actual_nan
+        both = ~(expected_nan | actual_nan)
+        differ = nan_mismatch | (both & (expected != actual))
+    else:
+        nan_mismatch = np.zeros(expected.shape, dtype=bool)
+        both = np.ones(expected.shape, dtype=bool)
+        differ = expected != actual
+    delta = np.abs(expected.astype(np.float64) - actual.astype(np.float64), where=both & differ,
+                   out=np.zeros(expected.shape))
+    return differ, int(nan_mismatch.sum()), float(delta.max()) if delta.size else 0.0
+
+def read_band(stored, band, present_row, lon_chunk):
+    """
+    Read one band of chunk rows, fetching only the chunks present_row marks as holding
+    data; the others are never stored and read as NaN without a request.
+    """
+    if present_row is None or present_row.all():
+        return stored[band].values
+    actual = np.full((band.stop - band.start, stored.shape[1]), np.nan)
+    columns = np.concatenate([np.arange(index * lon_chunk, min((index + 1) * lon_chunk, stored.shape[1]))
+                              for index in np.flatnonzero(present_row)] or [np.array([], dtype=int)])
+    if columns.size:
+        actual[:, columns] = stored[band].isel(lon=columns).values
+    return actual
+
+def compare_variable(expected, stored, chunks, present=None):
+    """
+    Compare one day of a variable against its stored slice, one band of chunk rows at a
+    time: each band's chunks are fetched together and compared vectorized, and the
+    differing cells are counted per chunk. With a chunk-presence index (see
+    ecs.land_mask) land chunks are not fetched; the source must be all NaN there.
+    """
+    lat_chunk, lon_chunk = chunks
+    nlat, nlon = expected.shape
+    result = {"cells": int(expected.size), "mismatched": 0, "nan_mismatched": 0, "max_abs_diff": 0.0, "chunks": []}
+    lon_starts = np.arange(0, nlon, lon_chunk)
+    for lat_start in range(0, nlat, lat_chunk):
+        band = slice(lat_start, min(lat_start + lat_chunk, nlat))
+        actual = read_band(stored, band, None if present is None else present[lat_start // lat_chunk], lon_chunk)
+        if np.issubdtype(expected.dtype, np.floating) and actual.dtype != expected.dtype:
+            # Packed variables decode to float64; in the source's dtype they match it exactly.
+            actual = actual.astype(expected.dtype)
+        differ, nan_mismatched, max_abs_diff = compare_blocks(expected[band], actual)
+        if not differ.any():
+            continue
+        per_chunk = np.add.reduceat(differ.sum(axis=0), lon_starts)
+        result["mismatched"] += int(differ.sum())
+        result["nan_mismatched"] += nan_mismatched
+        result["max_abs_diff"] = max(result["max_abs_diff"], max_abs_diff)
+        result["chunks"].extend({"lat": lat_start // lat_chunk, "lon": int(index), "cells": int(count)}
+                                for index, count in enumerate(per_chunk) if count)
+    return result
+
+def check_day(day, url, zarr_store, variables):
+    """Compare every variable of one source day with its time slice in the store."""
+    ds, times, presence = open_store(zarr_store, variables)
+    position = times.get_indexer([pd.Timestamp(day)])[0]
+    if position < 0:
+        return {"date": day, "status": "missing"}
+    report = {"date": day, "status": "ok", "variables": {}}
+    with open_source(url) as source:
+        for name in variables:
+            if name not in source or name not in ds:
+                report["variables"][name] = {"status": "missing"}
+                report["status"] = "mismatch"
+                continue
+            stored = day_field(ds[name].isel(time=position))
+            chunks = tuple(ds[name].encoding.get("chunks") or stored.shape)[-2:]
+            present = presence[1] if presence and tuple(presence[0]) == chunks else None
+            result = compare_variable(day_field(source[name]).values, stored, chunks, present)
+            report["variables"][name] = result
+            if result["mismatched"]:
+                report["status"] = "mismatch"
+    return report
+
+def check_days(days, zarr_store, variables):
+    """Worker entry point: check a batch of (day, url) pairs; failures are reported, not raised."""
+    reports = []
+    for day, url in days:
+        try:
+            reports.append(check_day(day, url, zarr_store, variables))
+        except Exception as e:
+            reports.append({"date": day, "status": "error", "error": str(e)})
+    return reports
+
+def run_checks(files, zarr_store, variables, workers, days_per_task):
+    """Check the days on a process pool and return the reports in date order."""
+    batches = partition_days(sorted(files.items()), days_per_task)
+    reports = []
+    start = time.perf_counter()
+    with spawn_pool(workers) as pool:
+        futures = [pool.submit(check_days, batch, zarr_store, variables) for batch in batches]
+        for future in as_completed(futures):
+            reports.extend(future.result())
+            elapsed = time.perf_counter() - start
+            logger.info(f"Checked {len(reports)}/{len(files)} days, {len(reports) / (elapsed / 60):.0f} days/minute")
+    return sorted(reports, key=lambda report: report["date"])
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Check that the Zarr store matches the source NetCDF files, day by day')
+    parser.add_argument('--start', required=True, help='First day (YYYY-MM-DD)')
+    parser.add_argument('--end', required=True, help='Last day (YYYY-MM-DD)')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='Source prefix holding YYYYMM/ directories (or a flat directory)')
+    parser.add_argument('--store', default=None, help='Zarr store (bucket/path or file://)')
+    parser.add_argument('--dest-bucket', default=None, help='Destination bucket; the config sub_folder is appended')
+    parser.add_argument('--config', '-c', default='config/app_config.json', help='Deployment configuration')
+    parser.add_argument('--variables', default=",".join(DEFAULT_VARIABLES), help='Comma-separated variables to compare')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--days-per-task', type=int, default=31, help='Days checked per worker task')
+    parser.add_argument('--output', '-o', default=None, help='Write the full report as JSON to this file')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        deployment_config = json.load(f)
+    suffix = deployment_config.get("defined_suffix", "")
+    if args.store:
+        zarr_store = args.store
+    elif args.dest_bucket:
+        zarr_store = build_zarr_store(args.dest_bucket, deployment_config)
+    else:
+        parser.error("one of --store or --dest-bucket is required")
+    variables = [name.strip() for name in args.variables.split(",") if name.strip()]
+
+    start, end = pd.Timestamp(args.start), pd.Timestamp(args.end)
+    files = {day.strftime('%Y-%m-%d'): url for day, url in enumerate_source_files(args.source, start, end, suffix).items()}
+    logger.info(f"Checking {len(files)} day(s) of {', '.join(variables)} against {zarr_store}")
+    reports = run_checks(files, zarr_store, variables, args.workers, args.days_per_task)
+
+    counts = {}
+    for report in reports:
+        counts[report["status"]] = counts.get(report["status"], 0) + 1
+    for report in reports:
+        if report["status"] == "mismatch":
+            details = ", ".join(
+                f"{name} missing" if "status" in result else
+                f"{name} {result['mismatched']} cells in {len(result['chunks'])} chunk(s) "
+                f"({result['nan_mismatched']} NaN on one side only, max diff {result['max_abs_diff']:.4g})"
+                for name, result in report["variables"].items() if result.get("mismatched") or "status" in result)
+            logger.warning(f"{report['date']}: {details}")
+        elif report["status"] != "ok":
+            logger.warning(f"{report['date']}: {report['status']} {report.get('error', '')}")
+    logger.info(f"Result: {counts}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"store": zarr_store, "source": args.source, "variables": variables,
+                       "summary": counts, "days": reports}, f, indent=2)
+    sys.exit(0 if counts.get("ok", 0) == len(reports) else 1)
+
+if __name__ == '__main__':
+    main()
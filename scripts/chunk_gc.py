@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import fsspec
+from ecs.chunk_store import ContentAddressedStore, collect_garbage, compact
+from ecs.store_io import split_store_url, get_store, get_filesystem
+from ecs.worker_app import build_zarr_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def listing_filesystem(protocol):
+    """A synchronous filesystem to list and delete blobs with; the store's local ones are async-wrapped."""
+    return get_filesystem(protocol) if protocol == "s3" else fsspec.filesystem(protocol)
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Compact the chunk manifests of a content-addressed Zarr store '
+                                                 'and delete the blobs nothing references')
+    parser.add_argument('--store', default=None, help='Zarr store (bucket/path or file://)')
+    parser.add_argument('--dest-bucket', default=None, help='Destination bucket; the config sub_folder is appended')
+    parser.add_argument('--config', '-c', default='config/app_config.json', help='Deployment configuration')
+    parser.add_argument('--grace-minutes', type=float, default=60,
+                        help='Keep unreferenced blobs younger than this (writes not yet published)')
+    parser.add_argument('--compact-only', action='store_true', help='Only fold the journal into the manifests')
+    parser.add_argument('--dry-run', action='store_true', help='Report the blobs that would be deleted (the journal is still compacted)')
+    args = parser.parse_args()
+
+    if args.store:
+        zarr_store = args.store
+    elif args.dest_bucket:
+        with open(args.config, 'r') as f:
+            zarr_store = build_zarr_store(args.dest_bucket, json.load(f))
+    else:
+        parser.error("one of --store or --dest-bucket is required")
+    protocol, path = split_store_url(zarr_store)
+    store = get_store(path, protocol)
+    if not isinstance(store, ContentAddressedStore):
+        logger.error(f"{zarr_store} is not a content-addressed store (created with chunk_dedup)")
+        sys.exit(1)
+
+    # Stop conversions writing to the store first: a blob a writer decides to reuse
+    # must not be deleted before its journal entry is published.
+    if args.compact_only:
+        compact(store)
+        return
+    result = collect_garbage(store, listing_filesystem(protocol), args.grace_minutes * 60, args.dry_run)
+    action = "Would delete" if args.dry_run else "Deleted"
+    logger.info(f"{action} {result['deleted']} unreferenced blob(s), {result['deleted_bytes'] / 2**20:.1f} MiB; "
+                f"kept {result['kept']} ({result['kept_bytes'] / 2**20:.1f} MiB) and {result['recent']} recent")
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,14 @@ import numpy as np
 from datetime import datetime
 import random
 import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from fsspec.core import get_fs_token_paths
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import asyncio
+from ecs.cell_layout import unpack_variable
 
 def plot_sst_grid(sst_data, date):
     """
@@ -117,7 +121,8 @@ def display_zarr_data(zarr_path: str, storage_options: dict = None):
         for i, time in enumerate(ds.time.values):
             date = pd.Timestamp(time).strftime('%Y%m%d')
             daily_sst = ds.sst.sel(time=time)
-            spatial_hashes = ds.spatial_hash.sel(time=time)
+            # Packed stores hold the hashes of ocean cells only; they are put back on the grid.
+            spatial_hashes = unpack_variable(ds.sel(time=time), "spatial_hash")
             
             print(f"\n{'='*80}")
             print(f"Date: {date}")
@@ -172,14 +177,17 @@ def display_zarr_data(zarr_path: str, storage_options: dict = None):
             print(f"{'Latitude':>10} {'Longitude':>10} {'Verifier Pubkeys':>60}")
             print("-" * 80)
             # Compute verifier_pubkeys for the current time slice.
-            verifier_data = ds.verifier_pubkeys.sel(time=time).compute()
+            verifier_data = unpack_variable(ds.sel(time=time), "verifier_pubkeys").compute()
             for _ in range(num_samples):
                 lat_idx = random.randrange(ds.lat.size)
                 lon_idx = random.randrange(ds.lon.size)
                 lat = float(ds.lat[lat_idx].values.item())
                 lon = float(ds.lon[lon_idx].values.item())
                 # Assuming a singleton zlev dimension, use the first value.
-                verifiers = verifier_data.sel(lat=lat, lon=lon, zlev=verifier_data.zlev.values[0]).values
+                verifiers = verifier_data.sel(lat=lat, lon=lon)
+                if "zlev" in verifiers.dims:
+                    verifiers = verifiers.isel(zlev=0)
+                verifiers = verifiers.values
                 print(f"{lat:10.2f} {lon:10.2f} {str(verifiers):>60}")
             
             # Calculate running average.
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root (for the ecs package) and the lambda directory (for the handlers) to sys.path.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.join(PROJECT_ROOT, "lambda"))
+
+import argparse
+import json
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from synthetic_oisst import write_days
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger("werkzeug").setLevel(logging.WARNING)
+logger = logging.getLogger("e2e_harness")
+
+SOURCE_BUCKET = "noaa-oisst-local"
+DEST_BUCKET = "databreaker-local-zarr"
+SOURCE_PREFIX = "data/v2.1/avhrr/"
+QUEUE_NAME = "conversion-local"
+
+def start_aws_stand_in(port):
+    """
+    Start an in-process moto server for S3, SSM and SQS and point every boto3 and s3fs
+    client at it. Must run before the handlers and the converter are imported, since
+    they create their clients at import time.
+    """
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(port=port)
+    server.start()
+    os.environ["AWS_ENDPOINT_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["AWS_ACCESS_KEY_ID"] = "test"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "test"
+    os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+    return server
+
+def configure_environment(deployment_config, files_per_task, lookback_months):
+    """Set the environment the Lambda handlers read, as the CDK stack does."""
+    os.environ.update({
+        "SOURCE_BUCKET": SOURCE_BUCKET,
+        "SOURCE_PREFIX": SOURCE_PREFIX,
+        "DEST_BUCKET": DEST_BUCKET,
+        "SUBNET_IDS": "subnet-local",
+        "SECURITY_GROUP_IDS": "sg-local",
+        "CLUSTER_NAME": "local",
+        "TASK_DEFINITION": "converter:1",
+        "DEFINED_SUFFIX": deployment_config.get("defined_suffix", ""),
+        "FILES_PER_TASK": str(files_per_task),
+        # The local runner queues tasks on its own slots, so launches are never refused.
+        "MAX_CONCURRENT_TASKS": "1000",
+        "LOOKBACK_MONTHS": str(lookback_months),
+        "RECEIVE_WAIT_SECONDS": "1",
+    })
+    os.environ.setdefault("METRICS_SINK", "off")
+
+class LocalEcs:
+    """
+    Stands in for the ECS client: run_task runs the converter task in this process on
+    a pool of task slots (queued tasks are PENDING, as on a busy cluster), with the
+    container environment the launcher passed.
+    """
+
+    def __init__(self, deployment_config, slots):
+        self.deployment_config = deployment_config
+        self.pool = ThreadPoolExecutor(max_workers=slots)
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def run_task(self, cluster, taskDefinition, overrides, **kwargs):
+        environment = {item["name"]: item["value"] for item in overrides["containerOverrides"][0]["environment"]}
+        task_arn = f"arn:aws:ecs:us-east-1:000000000000:task/{cluster}/{uuid.uuid4().hex}"
+        with self.lock:
+            self.tasks[task_arn] = self.pool.submit(self._run, environment)
+        return {"tasks": [{"taskArn": task_arn}], "failures": []}
+
+    def _run(self, environment):
+        from ecs.worker_app import build_zarr_store, convert_input_files, completion_recorder
+        input_files = json.loads(environment["INPUT_FILES"])
+        zarr_store = build_zarr_store(environment["DEST_BUCKET"], self.deployment_config)
+        failures = convert_input_files(input_files, zarr_store, self.deployment_config,
+                                       write_mode=environment.get("WRITE_MODE", "append"),
+                                       on_converted=completion_recorder(environment))
+        if failures:
+            raise RuntimeError(f"{failures} of {len(input_files)} file(s) failed")
+
+    def list_tasks(self, cluster, family=None, desiredStatus="RUNNING", **kwargs):
+        with self.lock:
+            tasks = list(self.tasks.items())
+        if desiredStatus == "RUNNING":
+            arns = [arn for arn, future in tasks if future.running()]
+        elif desiredStatus == "PENDING":
+            arns = [arn for arn, future in tasks if not future.running() and not future.done()]
+        else:
+            arns = [arn for arn, future in tasks if future.done()]
+        return {"taskArns": arns}
+
+    def failures(self):
+        with self.lock:
+            return [future.exception() for future in self.tasks.values() if future.done() and future.exception()]
+
+    def shutdown(self):
+        """Wait for every task, including those launched by running tasks, then stop the pool."""
+        while True:
+            with self.lock:
+                running = [future for future in self.tasks.values() if not future.done()]
+            if not running:
+                break
+            wait(running)
+        self.pool.shutdown(wait=True)
+
+class SqsWorker(threading.Thread):
+    """Runs the SQS worker until stopped and keeps what failed."""
+
+    def __init__(self, **kwargs):
+        super().__init__(daemon=True)
+        self.kwargs = kwargs
+        self.stopped = threading.Event()
+        self.failed = 0
+        self.error = None
+
+    def run(self):
+        from ecs.worker_app import run_sqs_worker
+        try:
+            _, self.failed = run_sqs_worker(stop=self.stopped, **self.kwargs)
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        """Let the worker drain the queue and finish the messages in flight."""
+        self.stopped.set()
+        self.join()
+
+    def failures(self):
+        errors = [self.error] if self.error else []
+        if self.failed:
+            errors.append(RuntimeError(f"{self.failed} SQS message(s) failed"))
+        return errors
+
+class QueryableWatcher(threading.Thread):
+    """
+    Polls the store the way a reader would (consolidated metadata and the time
+    coordinate) and records when each day first becomes queryable.
+    """
+
+    def __init__(self, zarr_store, interval=0.25):
+        super().__init__(daemon=True)
+        self.zarr_store = zarr_store
+        self.interval = interval
+        self.seen = {}
+        self.stopped = threading.Event()
+        self.fs = None
+
+    def read_days(self):
+        import fsspec
+        from ecs.store_io import open_variables
+        from ecs.chunk_store import open_store
+        if self.fs is None:
+            # A plain client of its own, so the watcher's reads are not counted as the
+            # converter's; created once, so polls do not each leave a session open.
+            self.fs = fsspec.filesystem("s3", asynchronous=True, skip_instance_cache=True)
+        store = open_store(self.fs, self.zarr_store, read_only=True)
+        ds = open_variables(store, [], chunks=None)
+        return pd.DatetimeIndex(ds["time"].values).normalize()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                days = self.read_days()
+            except Exception:
+                # The store does not exist yet, or is between metadata writes.
+                continue
+            now = time.time()
+            for day in days:
+                self.seen.setdefault(day.strftime("%Y-%m-%d"), now)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if self.fs is not None and self.fs._s3 is not None:
+            from zarr.core.sync import sync
+            # The client was opened on Zarr's event loop.
+            sync(self.fs._s3.close())
+
+def source_key(path):
+    """Source key of a local file, under its month prefix like the NOAA bucket."""
+    name = os.path.basename(path)
+    day = pd.Timestamp(name.split(".")[-2][:8])
+    return f"{SOURCE_PREFIX}{day:%Y%m}/{name}"
+
+def s3_event(records):
+    """An S3 ObjectCreated notification for (bucket, key, etag) records."""
+    return {"Records": [{
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "s3": {"bucket": {"name": bucket}, "object": {"key": key, "eTag": etag}},
+    } for bucket, key, etag in records]}
+
+def arrival_groups(files, burst, group_size):
+    """Files in the order they arrive: all at once for a burst, else group_size at a time."""
+    if burst:
+        return [files]
+    return [files[i:i + group_size] for i in range(0, len(files), group_size)]
+
+def run_pipeline(files, args, deployment_config):
+    """
+    Upload the files group by group and hand each group to the selected ingress path.
+    Returns (arrival time per day, queryable time per day, store, errors of the tasks
+    and messages). Every task and message has finished when it returns, so nothing
+    still talks to the stand-in once it is stopped.
+    """
+    import boto3
+    s3 = boto3.client("s3")
+    s3.create_bucket(Bucket=SOURCE_BUCKET)
+    s3.create_bucket(Bucket=DEST_BUCKET)
+    ecs_runner = LocalEcs(deployment_config, args.task_slots)
+    from ecs.worker_app import build_zarr_store
+    zarr_store = build_zarr_store(DEST_BUCKET, deployment_config)
+
+    sqs_worker = None
+    if args.mode == "event":
+        import conversion_trigger
+        conversion_trigger.ecs_client = ecs_runner
+    elif args.mode == "poll":
+        import polling_handler
+        polling_handler.ecs_client = ecs_runner
+    else:
+        sqs = boto3.client("sqs")
+        queue_url = sqs.create_queue(QueueName=QUEUE_NAME)["QueueUrl"]
+        sqs_worker = SqsWorker(queue_url=queue_url, zarr_store=zarr_store, deployment_config=deployment_config,
+                               sqs=sqs, concurrency=args.task_slots, idle_timeout=args.timeout)
+        sqs_worker.start()
+
+    watcher = QueryableWatcher(zarr_store)
+    watcher.start()
+    arrivals = {}
+    try:
+        for index, group in enumerate(arrival_groups(files, args.burst, args.files_per_arrival)):
+            if index:
+                time.sleep(args.interval)
+            records = []
+            for path in group:
+                key = source_key(path)
+                s3.upload_file(path, SOURCE_BUCKET, key)
+                etag = s3.head_object(Bucket=SOURCE_BUCKET, Key=key)["ETag"]
+                arrivals[pd.Timestamp(os.path.basename(path).split(".")[-2][:8]).strftime("%Y-%m-%d")] = time.time()
+                records.append((SOURCE_BUCKET, key, etag))
+            logger.info(f"{len(group)} file(s) arrived; handing them to the {args.mode} path")
+            if args.mode == "event":
+                conversion_trigger.lambda_handler(s3_event(records), None)
+            elif args.mode == "poll":
+                polling_handler.lambda_handler({}, None)
+            else:
+                sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(s3_event(records)))
+
+        deadline = time.time() + args.timeout
+        while time.time() < deadline and not set(arrivals) <= set(watcher.seen):
+            if ecs_runner.failures() or (sqs_worker and not sqs_worker.is_alive()):
+                break
+            time.sleep(0.5)
+    finally:
+        watcher.stop()
+        # Work still running after the days are queryable (aggregates, deferred hashes)
+        # must finish against the stand-in, and its failures count.
+        if sqs_worker:
+            sqs_worker.stop()
+        ecs_runner.shutdown()
+    failures = ecs_runner.failures() + (sqs_worker.failures() if sqs_worker else [])
+    return arrivals, watcher.seen, zarr_store, len(ecs_runner.tasks), failures
+
+def summarize(arrivals, seen):
+    """Latency from arrival to queryable per day and overall throughput."""
+    latencies = {day: seen[day] - arrivals[day] for day in arrivals if day in seen}
+    values = np.array(list(latencies.values())) if latencies else np.array([np.nan])
+    span = (max(seen[day] for day in latencies) - min(arrivals.values())) if latencies else float("nan")
+    return {
+        "days": len(arrivals),
+        "queryable": len(latencies),
+        "missing": sorted(set(arrivals) - set(latencies)),
+        "latency_seconds": {
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+            "max": float(np.max(values)),
+            "per_day": {day: round(value, 3) for day, value in sorted(latencies.items())},
+        },
+        "span_seconds": span,
+        "days_per_minute": len(latencies) / (span / 60) if latencies and span > 0 else 0.0,
+    }
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(
+        description='Run the whole pipeline offline (S3 event or poll -> handler -> local ECS runner -> worker) '
+                    'against an in-process moto stand-in and measure latency and throughput')
+    parser.add_argument('--mode', choices=['event', 'poll', 'sqs'], default='event',
+                        help='Ingress: S3 event to conversion_trigger, a polling_handler run, or an SQS worker')
+    parser.add_argument('--days', type=int, default=5, help='Synthetic days to deliver')
+    parser.add_argument('--nlat', type=int, default=720, help='Latitude cells of the synthetic days')
+    parser.add_argument('--nlon', type=int, default=1440, help='Longitude cells of the synthetic days')
+    parser.add_argument('--burst', action='store_true', help='Deliver every day at once instead of one group at a time')
+    parser.add_argument('--files-per-arrival', type=int, default=1, help='Files per arrival group without --burst')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between arrival groups')
+    parser.add_argument('--files-per-task', type=int, default=20, help='Files per converter task (FILES_PER_TASK)')
+    parser.add_argument('--task-slots', type=int, default=1, help='Converter tasks (or SQS messages) run at once')
+    parser.add_argument('--timeout', type=float, default=900, help='Seconds to wait for every day to be queryable')
+    parser.add_argument('--config', '-c', default=os.path.join(PROJECT_ROOT, "config", "app_config.json"),
+                        help='Deployment configuration')
+    parser.add_argument('--port', type=int, default=5123, help='Port of the local moto server')
+    parser.add_argument('--output', '-o', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        deployment_config = json.load(f)
+    # Days end yesterday, so they fall under the month prefixes the poller lists.
+    start = pd.Timestamp(datetime.now(timezone.utc).date()) - pd.Timedelta(days=args.days)
+    lookback_months = max(0, (pd.Timestamp.now().to_period("M") - start.to_period("M")).n - 1)
+
+    server = start_aws_stand_in(args.port)
+    try:
+        configure_environment(deployment_config, args.files_per_task, lookback_months)
+        with tempfile.TemporaryDirectory(prefix="e2e-harness-") as work_dir:
+            logger.info(f"Generating {args.days} synthetic day(s) on a {args.nlat}x{args.nlon} grid")
+            files = write_days(os.path.join(work_dir, "source"), start, args.days, args.nlat, args.nlon)
+            arrivals, seen, zarr_store, tasks_launched, failures = run_pipeline(files, args, deployment_config)
+    finally:
+        server.stop()
+
+    results = {
+        "mode": args.mode,
+        "burst": args.burst,
+        "grid": [args.nlat, args.nlon],
+        "files_per_task": args.files_per_task,
+        "task_slots": args.task_slots,
+        "store": zarr_store,
+        "tasks_launched": tasks_launched,
+        "task_failures": [str(error) for error in failures],
+        **summarize(arrivals, seen),
+    }
+    latency = results["latency_seconds"]
+    logger.info(f"{results['queryable']}/{results['days']} day(s) queryable; latency p50 {latency['p50']:.1f}s, "
+                f"p95 {latency['p95']:.1f}s, max {latency['max']:.1f}s; {results['days_per_minute']:.1f} days/minute "
+                f"over {results['tasks_launched']} task(s)")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if not results["missing"] and not results["task_failures"] else 1)
+
+if __name__ == '__main__':
+    main()
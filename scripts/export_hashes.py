@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import binascii
+import json
+import logging
+import time
+from concurrent.futures import as_completed
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zarr
+from ecs.store_io import open_variables, split_store_url, get_store
+from ecs.cell_layout import CELL_DIM
+from ecs.deferred_hashes import HASH_PENDING
+from ecs.land_mask import read_presence
+from ecs.sources import spawn_pool
+from ecs.store_writes import HASH_VERSION
+from ecs.worker_app import build_zarr_store
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# BLAKE3 digests are stored as 64 hex characters; they are exported as the 32 raw bytes.
+DIGEST_BYTES = 32
+# Each file carries its date column as well as the date=YYYY-MM-DD directory, so it loads
+# on its own. Read the whole export as a dataset without partitioning, or with a hive
+# partitioning whose schema types date as date32 (the inferred string type conflicts).
+SCHEMA = pa.schema([
+    ("date", pa.date32()),
+    ("lat", pa.float32()),
+    ("lon", pa.float32()),
+    ("spatial_hash", pa.binary(DIGEST_BYTES)),
+])
+# File name of each day's partition, by format.
+PART_FILES = {"parquet": "part-0.parquet", "arrow": "part-0.arrow"}
+# Store version of each exported day (date -> version), at the root of the output.
+# Dataset readers skip files whose names start with an underscore.
+VERSIONS_FILE = "_versions.json"
+
+# Opened store per worker process: store URL -> HashSource.
+_sources = {}
+
+class HashSource:
+    """The spatial_hash array of a store with what is needed to export it one chunk at a time."""
+
+    def __init__(self, zarr_store):
+        protocol, path = split_store_url(zarr_store)
+        store = get_store(path, protocol)
+        # Only the small variables go through xarray; the hashes are read chunk by chunk with zarr.
+        ds = open_variables(store, [HASH_PENDING, HASH_VERSION, CELL_DIM], chunks=None)
+        self.times = pd.DatetimeIndex(ds["time"].values).normalize()
+        self.pending = ds[HASH_PENDING].values if HASH_PENDING in ds else None
+        self.lat = ds["lat"].values.astype(np.float32)
+        self.lon = ds["lon"].values.astype(np.float32)
+        self.versions = ds[HASH_VERSION].values if HASH_VERSION in ds else None
+        self.cells = ds[CELL_DIM].values if CELL_DIM in ds else None
+        self.array = zarr.open_group(store=store, mode="r", use_consolidated=True)["spatial_hash"]
+        self.presence = read_presence(store)
+        self.store = store
+
+    def day_versions(self):
+        """
+        Version of each day's hashes (time index -> string): the time the day's hashes
+        were last written, recorded by the store writes (see ecs.store_writes.HASH_VERSION).
+        A store written before versions were recorded has none.
+        """
+        if self.versions is None:
+            return {}
+        return {index: f"{version:.6f}" for index, version in enumerate(self.versions) if not np.isnan(version)}
+
+    def blocks(self, index):
+        """
+        Yield (lat, lon, hashes) numpy arrays for one stored chunk of day `index` at a
+        time: the packed cells of the ocean layout, or the (lat, lon) chunks of the grid
+        layout, skipping those the chunk-presence index marks as never holding data.
+        """
+        if self.cells is not None:
+            step = self.array.chunks[-1]
+            for start in range(0, len(self.cells), step):
+                cells = self.cells[start:start + step]
+                yield self.lat[cells // len(self.lon)], self.lon[cells % len(self.lon)], \
+                    self.array[index, start:start + step]
+            return
+        lat_chunk, lon_chunk = self.array.chunks[-2:]
+        present = self.presence[1] if self.presence and tuple(self.presence[0]) == (lat_chunk, lon_chunk) else None
+        lead = (index,) + (0,) * (self.array.ndim - 3)
+        for row, lat_start in enumerate(range(0, len(self.lat), lat_chunk)):
+            for column, lon_start in enumerate(range(0, len(self.lon), lon_chunk)):
+                if present is not None and not present[row, column]:
+                    continue
+                rows = slice(lat_start, lat_start + lat_chunk)
+                columns = slice(lon_start, lon_start + lon_chunk)
+                lat, lon = np.meshgrid(self.lat[rows], self.lon[columns], indexing="ij")
+                yield lat.ravel(), lon.ravel(), self.array[lead + (rows, columns)].ravel()
+
+def open_source(zarr_store):
+    """Open the store once per process."""
+    if zarr_store not in _sources:
+        _sources[zarr_store] = HashSource(zarr_store)
+    return _sources[zarr_store]
+
+def digest_array(hashes):
+    """
+    The raw digests of an array of hex hashes as an Arrow fixed-size binary array
+    built over the decoded bytes without copying them.
+    """
+    hexes = np.asarray(hashes).astype(f"S{2 * DIGEST_BYTES}")
+    try:
+        digests = binascii.unhexlify(hexes.tobytes())
+    except binascii.Error as e:
+        raise ValueError(f"spatial_hash holds a value that is not a {DIGEST_BYTES}-byte hex digest: {e}")
+    return pa.Array.from_buffers(pa.binary(DIGEST_BYTES), len(hexes), [None, pa.py_buffer(digests)])
+
+def block_batch(day, lat, lon, hashes):
+    """A record batch of the cells of one chunk that have a hash (land cells may have none)."""
+    hashes = np.asarray(hashes)
+    keep = hashes != ""
+    days_since_epoch = (day - pd.Timestamp("1970-01-01")).days
+    return pa.record_batch([
+        pa.array(np.full(int(keep.sum()), days_since_epoch, dtype=np.int32), pa.date32()),
+        pa.array(lat[keep]),
+        pa.array(lon[keep]),
+        digest_array(hashes[keep]),
+    ], schema=SCHEMA)
+
+def partition_path(output, day, fmt):
+    """Hive-style partition file of one day."""
+    return f"{output.rstrip('/')}/date={day:%Y-%m-%d}/{PART_FILES[fmt]}"
+
+def exported_days(fs, output, fmt):
+    """Days that already have a complete partition under output."""
+    days = set()
+    for path in fs.glob(f"{output.rstrip('/')}/date=*/{PART_FILES[fmt]}"):
+        days.add(pd.Timestamp(path.split("date=")[-1].split("/")[0]))
+    return days
+
+def read_versions(fs, output):
+    """Store version of each exported day (YYYY-MM-DD -> version); empty before the first export."""
+    try:
+        with fs.open(f"{output.rstrip('/')}/{VERSIONS_FILE}", "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_versions(fs, output, versions):
+    """Replace the versions file, through a temporary file so readers never see half of it."""
+    path = f"{output.rstrip('/')}/{VERSIONS_FILE}"
+    fs.makedirs(output.rstrip('/'), exist_ok=True)
+    with fs.open(path + ".tmp", "w") as f:
+        json.dump(dict(sorted(versions.items())), f, indent=1)
+    fs.mv(path + ".tmp", path)
+
+def export_day(zarr_store, output, day, fmt, compression):
+    """
+    Write one day's hashes to its partition, a row group (or record batch) per stored
+    chunk, so memory stays bounded by one chunk. The file is written under a
+    temporary name and then moved into place, so an interrupted export is redone.
+    """
+    source = open_source(zarr_store)
+    day = pd.Timestamp(day)
+    index = source.times.get_loc(day)
+    fs, path = fsspec.core.url_to_fs(partition_path(output, day, fmt))
+    staging = path + ".tmp"
+    fs.makedirs(path.rsplit("/", 1)[0], exist_ok=True)
+    rows = 0
+    start = time.perf_counter()
+    with fs.open(staging, "wb") as f:
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(f, SCHEMA, compression=compression,
+                                      use_dictionary=["date", "lat", "lon"])
+        else:
+            writer = pa.ipc.new_file(f, SCHEMA, options=pa.ipc.IpcWriteOptions(
+                compression=None if compression == "none" else compression))
+        with writer:
+            for lat, lon, hashes in source.blocks(index):
+                batch = block_batch(day, lat, lon, hashes)
+                rows += batch.num_rows
+                if fmt == "parquet":
+                    writer.write_batch(batch)
+                else:
+                    writer.write(batch)
+    fs.mv(staging, path)
+    return {"date": f"{day:%Y-%m-%d}", "rows": rows, "seconds": time.perf_counter() - start}
+
+def export_days(days, zarr_store, output, fmt, compression):
+    """Worker entry point: export a batch of days; failures are reported, not raised."""
+    reports = []
+    for day in days:
+        try:
+            reports.append(dict(export_day(zarr_store, output, day, fmt, compression), status="ok"))
+        except Exception as e:
+            reports.append({"date": f"{pd.Timestamp(day):%Y-%m-%d}", "status": "error", "error": str(e)})
+    return reports
+
+def plan_export(zarr_store, output, fmt, start=None, end=None, overwrite=False):
+    """
+    Days of the store to export, with the store version of each (date -> version):
+    those in [start, end] whose hashes are attached (see the deferred hash phase) and,
+    unless overwrite, that have no partition yet or were rewritten since their export
+    (a preliminary day replaced by its final version, hashes attached later).
+    """
+    source = open_source(zarr_store)
+    fs, path = fsspec.core.url_to_fs(output)
+    done = set() if overwrite else exported_days(fs, path, fmt)
+    exported = read_versions(fs, path)
+    versions = source.day_versions()
+    if source.versions is None and not overwrite:
+        logger.warning(f"{zarr_store} records no {HASH_VERSION}; days rewritten since their export are only "
+                       "exported again with --overwrite")
+    days, pending, changed = {}, 0, 0
+    for index, day in enumerate(source.times):
+        if (start is not None and day < start) or (end is not None and day > end):
+            continue
+        if source.pending is not None and source.pending[index]:
+            pending += 1
+            continue
+        version = versions.get(index, "")
+        if day in done:
+            if exported.get(f"{day:%Y-%m-%d}") == version:
+                continue
+            changed += 1
+        days[day] = version
+    if pending:
+        logger.info(f"Skipping {pending} day(s) whose hashes are still pending")
+    if changed:
+        logger.info(f"Re-exporting {changed} day(s) rewritten since they were exported")
+    return days
+
+def record_versions(output, days, reports):
+    """
+    Record the version of each day exported successfully. A day rewritten while it was
+    exported keeps the older version, so the next run exports it again.
+    """
+    fs, path = fsspec.core.url_to_fs(output)
+    versions = read_versions(fs, path)
+    for report in reports:
+        if report["status"] == "ok":
+            versions[report["date"]] = days[pd.Timestamp(report["date"])]
+    write_versions(fs, path, versions)
+
+def run_export(days, zarr_store, output, fmt, compression, workers):
+    """Export the days, on a process pool with more than one worker, and return the reports in date order."""
+    if workers <= 1:
+        return export_days(days, zarr_store, output, fmt, compression)
+    batches = [days[i::workers] for i in range(workers) if days[i::workers]]
+    reports = []
+    with spawn_pool(workers) as pool:
+        futures = [pool.submit(export_days, batch, zarr_store, output, fmt, compression) for batch in batches]
+        for future in as_completed(futures):
+            reports.extend(future.result())
+    return sorted(reports, key=lambda report: report["date"])
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Export the spatial hashes of a Zarr store as (date, lat, lon, hash) '
+                                                 'rows, one Parquet or Arrow IPC partition per day')
+    parser.add_argument('output', help='Output directory (local path or s3://bucket/prefix)')
+    parser.add_argument('--store', default=None, help='Zarr store (bucket/path or file://)')
+    parser.add_argument('--dest-bucket', default=None, help='Destination bucket; the config sub_folder is appended')
+    parser.add_argument('--config', '-c', default='config/app_config.json', help='Deployment configuration')
+    parser.add_argument('--format', choices=sorted(PART_FILES), default='parquet', help='Partition file format')
+    parser.add_argument('--compression', default='zstd', help='Parquet codec, or zstd/lz4/none for Arrow IPC')
+    parser.add_argument('--start', default=None, help='First day to export (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, help='Last day to export (YYYY-MM-DD)')
+    parser.add_argument('--overwrite', action='store_true', help='Rewrite days that were already exported, even unchanged')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Worker processes')
+    parser.add_argument('--report', default=None, help='Write the per-day report as JSON to this file')
+    args = parser.parse_args()
+
+    if args.store:
+        zarr_store = args.store
+    elif args.dest_bucket:
+        with open(args.config, 'r') as f:
+            zarr_store = build_zarr_store(args.dest_bucket, json.load(f))
+    else:
+        parser.error("one of --store or --dest-bucket is required")
+
+    start = pd.Timestamp(args.start) if args.start else None
+    end = pd.Timestamp(args.end) if args.end else None
+    days = plan_export(zarr_store, args.output, args.format, start, end, args.overwrite)
+    logger.info(f"Exporting {len(days)} day(s) of spatial hashes from {zarr_store} to {args.output}")
+    began = time.perf_counter()
+    reports = run_export(list(days), zarr_store, args.output, args.format, args.compression, args.workers)
+    elapsed = time.perf_counter() - began
+    if reports:
+        record_versions(args.output, days, reports)
+
+    failed = [report for report in reports if report["status"] != "ok"]
+    for report in failed:
+        logger.error(f"{report['date']}: {report['error']}")
+    rows = sum(report.get("rows", 0) for report in reports)
+    logger.info(f"Exported {len(reports) - len(failed)} day(s), {rows} row(s) in {elapsed:.1f}s"
+                + (f" ({elapsed / len(reports):.2f}s per day)" if reports else ""))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,9 @@ echo "Using temporary directory: $TEMP_DIR"
 
 # Copy Lambda function code
 cp lambda/conversion_trigger.py "$TEMP_DIR/"
+cp lambda/ecs_launcher.py "$TEMP_DIR/"
+cp lambda/processed_ledger.py "$TEMP_DIR/"
+cp lambda/supersession.py "$TEMP_DIR/"
 cp lambda/requirements.txt "$TEMP_DIR/"
 
 # Install dependencies
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+from zarr.core.sync import sync
+from ecs.aggregates import rebuild_aggregates
+from ecs.store_io import split_store_url, get_filesystem, get_store
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Rebuild climatology and rolling-window aggregates from a Zarr store')
+    parser.add_argument('zarr_store', help='Zarr store (bucket/path, s3://, file:// or memory://)')
+    parser.add_argument('--config', '-c', default='config/app_config.json',
+                        help='Deployment configuration with a conversion.aggregates section')
+    parser.add_argument('--workers', '-w', type=int, default=None, help='Number of dask workers')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        deployment_config = json.load(f)
+    aggregates_config = deployment_config.get("conversion", {}).get("aggregates", {})
+
+    protocol, zarr_store_path = split_store_url(args.zarr_store)
+    store = get_store(zarr_store_path, protocol)
+    if not sync(store.exists("zarr.json")):
+        parser.error(f"no Zarr store at {args.zarr_store}")
+    logger.info(f"Rebuilding aggregates for {args.zarr_store}")
+    rebuild_aggregates(get_filesystem(protocol), zarr_store_path, aggregates_config, num_workers=args.workers,
+                       store=store)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import sys
+import os
+# Add the project root to sys.path so that the ecs package can be found.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import fsspec
+import pandas as pd
+from ecs.converter import convert_netcdf_to_zarr, quiet_conversion_logs
+from ecs.memory_planner import store_chunk_cells, TASK_BYTES_PER_CHUNK_CELL
+from synthetic_oisst import write_days, FULL_GRID
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+quiet_conversion_logs()
+logger = logging.getLogger(__name__)
+
+# Valid Fargate memory sizes (MiB) for each CPU size (CPU units).
+FARGATE_SIZES = {
+    256: [512, 1024, 2048],
+    512: list(range(1024, 4096 + 1, 1024)),
+    1024: list(range(2048, 8192 + 1, 1024)),
+    2048: list(range(4096, 16384 + 1, 1024)),
+    4096: list(range(8192, 30720 + 1, 1024)),
+    8192: list(range(16384, 61440 + 1, 4096)),
+    16384: list(range(32768, 122880 + 1, 8192)),
+}
+
+def smallest_task_size(required_mib, min_cpu):
+    """Return the smallest (cpu, memory) Fargate size with at least min_cpu and required_mib."""
+    for cpu in sorted(FARGATE_SIZES):
+        if cpu < min_cpu:
+            continue
+        for memory in FARGATE_SIZES[cpu]:
+            if memory >= required_mib:
+                return cpu, memory
+    raise ValueError(f"No Fargate task size has {required_mib:.0f} MiB of memory")
+
+def prepare_days(work_dir, sample_file, days, nlat, nlon):
+    """
+    Return `days` consecutive input files: copies of sample_file under consecutive
+    dates, or synthetic full-grid days if no sample is given.
+    """
+    if not sample_file:
+        return write_days(os.path.join(work_dir, "source"), "2025-01-01", days, nlat, nlon)
+    storage_options = {"anon": True} if sample_file.startswith("s3://") else {}
+    local_sample = os.path.join(work_dir, "sample.nc")
+    with fsspec.open(sample_file, "rb", **storage_options) as src, open(local_sample, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    files = []
+    for date in pd.date_range("2025-01-01", periods=days, freq="D"):
+        path = os.path.join(work_dir, f"oisst-avhrr-v02r01.{date:%Y%m%d}.nc")
+        shutil.copyfile(local_sample, path)
+        files.append(path)
+    return files
+
+def measure_conversions(files, zarr_store, conversion_config):
+    """Convert the files in order and return their metrics records."""
+    records = []
+    for netcdf_file in files:
+        record = convert_netcdf_to_zarr(netcdf_file, zarr_store, "", conversion_config)
+        logger.info(f"{os.path.basename(netcdf_file)}: peak {record['total.peak_rss_bytes'] / 2**20:.0f} MiB "
+                    f"in {record['total.wall_seconds']:.1f}s")
+        records.append(record)
+    return records
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Measure the peak memory of a conversion and recommend a Fargate task size')
+    parser.add_argument('--file', '-f', default=None,
+                        help='Sample NetCDF file (local path or s3:// URL); synthetic OISST-shaped days if omitted')
+    parser.add_argument('--days', type=int, default=3,
+                        help='Days to convert into a fresh store (the first creates it, the rest append)')
+    parser.add_argument('--nlat', type=int, default=FULL_GRID[0], help='Latitude cells of synthetic days')
+    parser.add_argument('--nlon', type=int, default=FULL_GRID[1], help='Longitude cells of synthetic days')
+    parser.add_argument('--config', '-c', default=os.path.join(os.path.dirname(__file__), "..", "config", "app_config.json"),
+                        help='Deployment configuration whose conversion section is used')
+    parser.add_argument('--cpu', type=int, default=2048, help='Minimum task CPU units')
+    parser.add_argument('--headroom', type=float, default=0.2, help='Fraction added to the measured peak')
+    parser.add_argument('--output', '-o', default=None, help='Also write the recommendation as JSON to this file')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        conversion_config = json.load(f).get("conversion", {})
+    # Measure the unconstrained conversion, on the local scheduler.
+    conversion_config = dict(conversion_config, memory_budget_mib=None)
+    conversion_config.pop("dask", None)
+    os.environ.pop("MEMORY_BUDGET_MIB", None)
+    os.environ.setdefault("METRICS_SINK", "off")
+
+    with tempfile.TemporaryDirectory(prefix="task-size-") as work_dir:
+        files = prepare_days(work_dir, args.file, args.days, args.nlat, args.nlon)
+        zarr_store = f"file://{os.path.join(work_dir, 'store')}"
+        records = measure_conversions(files, zarr_store, conversion_config)
+        chunk_cells = store_chunk_cells(zarr_store) or 0
+
+    measured_peak = max(record["total.peak_rss_bytes"] for record in records)
+    stage_peaks = {}
+    for record in records:
+        for key, value in record.items():
+            if key.endswith(".peak_rss_bytes") and not key.startswith("total."):
+                stage = key.rsplit(".", 1)[0]
+                stage_peaks[stage] = max(stage_peaks.get(stage, 0), value)
+
+    # Each vCPU of the task can run one more write task than were measured here.
+    local_threads = os.cpu_count() or 1
+    vcpus = args.cpu // 1024 or 1
+    extra_tasks = max(0, vcpus - local_threads) * chunk_cells * TASK_BYTES_PER_CHUNK_CELL
+    required_mib = (measured_peak + extra_tasks) * (1 + args.headroom) / 2**20
+    cpu, memory = smallest_task_size(required_mib, args.cpu)
+
+    result = {
+        "days": len(records),
+        "measured_peak_mib": round(measured_peak / 2**20, 1),
+        "stage_peak_mib": {stage: round(peak / 2**20, 1) for stage, peak in stage_peaks.items()},
+        "extra_task_mib": round(extra_tasks / 2**20, 1),
+        "headroom": args.headroom,
+        "required_mib": round(required_mib, 1),
+        "ecsTask": {"cpu": str(cpu), "memory": str(memory)},
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Full OISST v2.1 grid: 0.25 degree, 720 x 1440.
+FULL_GRID = (720, 1440)
+
+def land_mask(nlat, nlon, seed=0, land_fraction=0.29):
+    """
+    Deterministic land mask shaped like continents: a smooth random field built
+    from low-frequency waves, thresholded so `land_fraction` of the cells are land.
+    The poles beyond +-80 degrees are land, like Antarctica and the masked Arctic cells.
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-np.pi / 2, np.pi / 2, nlat)[:, None]
+    lon = np.linspace(0, 2 * np.pi, nlon, endpoint=False)[None, :]
+    field = np.zeros((nlat, nlon))
+    for _ in range(12):
+        k_lat, k_lon = rng.integers(1, 5), rng.integers(1, 6)
+        phase_lat, phase_lon = rng.uniform(0, 2 * np.pi, 2)
+        field += rng.uniform(0.5, 1.0) * np.sin(k_lat * lat + phase_lat) * np.cos(k_lon * lon + phase_lon)
+    threshold = np.quantile(field, 1 - land_fraction)
+    mask = field > threshold
+    mask[np.abs(np.degrees(lat[:, 0])) > 80, :] = True
+    return mask
+
+def make_day(date, nlat=FULL_GRID[0], nlon=FULL_GRID[1], seed=0, mask=None):
+    """Return a one-day dataset shaped like an OISST file (time, zlev, lat, lon; sst/anom/err/ice)."""
+    rng = np.random.default_rng([seed, pd.Timestamp(date).dayofyear])
+    mask = land_mask(nlat, nlon, seed) if mask is None else mask
+    lat = np.linspace(-90 + 90 / nlat, 90 - 90 / nlat, nlat, dtype=np.float32)
+    lon = np.linspace(180 / nlon, 360 - 180 / nlon, nlon, dtype=np.float32)
+    season = np.cos(2 * np.pi * (pd.Timestamp(date).dayofyear - 15) / 365.25)
+    lat_grid = np.broadcast_to(lat[:, None], (nlat, nlon))
+
+    sst = 28 * np.cos(np.radians(lat_grid)) - 1.8 + 2 * season * np.sin(np.radians(lat_grid))
+    sst = sst + rng.normal(0, 0.5, (nlat, nlon))
+    anom = rng.normal(0, 0.8, (nlat, nlon))
+    err = rng.uniform(0.1, 0.6, (nlat, nlon))
+    ice = np.where(np.abs(lat_grid) > 60, 100 * np.clip((np.abs(lat_grid) - 60) / 20 + rng.normal(0, 0.1, (nlat, nlon)), 0, 1), np.nan)
+
+    def field(values):
+        values = np.where(mask, np.nan, values).astype(np.float32)
+        return (("time", "zlev", "lat", "lon"), values[None, None])
+
+    ds = xr.Dataset(
+        {"sst": field(sst), "anom": field(anom), "err": field(err), "ice": field(ice)},
+        coords={
+            "time": [pd.Timestamp(date) + pd.Timedelta(hours=12)],
+            "zlev": np.array([0.0], dtype=np.float32),
+            "lat": lat,
+            "lon": lon,
+        },
+        attrs={"title": "Synthetic OISST-shaped data for benchmarks"},
+    )
+    ds["sst"].attrs.update(long_name="Daily sea surface temperature", units="Celsius")
+    ds["anom"].attrs.update(long_name="Daily sea surface temperature anomalies", units="Celsius")
+    ds["err"].attrs.update(long_name="Estimated error standard deviation of analysed_sst", units="Celsius")
+    ds["ice"].attrs.update(long_name="Sea ice concentration", units="%")
+    return ds
+
+def write_days(output_dir, start, days, nlat=FULL_GRID[0], nlon=FULL_GRID[1], seed=0, suffix=""):
+    """
+    Write `days` synthetic files named like the NOAA files
+    (oisst-avhrr-v02r01.YYYYMMDD{suffix}.nc). Variables are packed as int16 with a
+    scale factor and fill value like the source files. Returns the file paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    mask = land_mask(nlat, nlon, seed)
+    encoding = {
+        name: {"dtype": "int16", "scale_factor": np.float32(0.01), "add_offset": np.float32(0.0), "_FillValue": np.int16(-999)}
+        for name in ("sst", "anom", "err", "ice")
+    }
+    paths = []
+    for date in pd.date_range(start, periods=days, freq="D"):
+        path = os.path.join(output_dir, f"oisst-avhrr-v02r01.{date:%Y%m%d}{suffix}.nc")
+        make_day(date, nlat, nlon, seed, mask).to_netcdf(path, engine="h5netcdf", encoding=encoding)
+        paths.append(path)
+    return paths
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description='Generate synthetic OISST-shaped NetCDF files')
+    parser.add_argument('output_dir', help='Directory for the generated files')
+    parser.add_argument('--start', default='2025-01-01', help='First day (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=3, help='Number of daily files')
+    parser.add_argument('--nlat', type=int, default=FULL_GRID[0], help='Latitude cells')
+    parser.add_argument('--nlon', type=int, default=FULL_GRID[1], help='Longitude cells')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (fixes the land mask and values)')
+    parser.add_argument('--suffix', default='', help='Filename suffix, e.g. _preliminary')
+    args = parser.parse_args()
+
+    for path in write_days(args.output_dir, args.start, args.days, args.nlat, args.nlon, args.seed, args.suffix):
+        print(path)
+
+if __name__ == '__main__':
+    main()
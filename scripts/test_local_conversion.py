@@ -1,8 +1,8 @@
 import json
-import time
 import os
 import boto3
 from ecs.converter import convert_netcdf_to_zarr
+from scripts.synthetic_oisst import write_days
 
 def test_conversion():
     """Test local conversion of NetCDF to Zarr"""
@@ -14,29 +14,34 @@ def test_conversion():
         "oisst-avhrr-v02r01.20250103.nc"
     ]
     
-    # Load dataset config from file
-    with open('config/oisst.json', 'r') as f:
-        dataset_config = json.load(f)
+    # Load the deployment config; the conversion section drives rechunking
+    with open('config/app_config.json', 'r') as f:
+        deployment_config = json.load(f)
+    conversion_config = deployment_config.get("conversion", {})
+    suffix = deployment_config.get("defined_suffix", "")
     
-    # Create config with environment settings and dataset config
-    config = {
-        "s3": {
-            "endpoint_url": "http://localstack:4566",
-            "access_key_id": "test",
-            "secret_access_key": "test",
-            "region": "us-east-1"
-        },
-        "conversion": dataset_config["conversion"]
-    }
+    # boto3 and s3fs both pick the endpoint up from AWS_ENDPOINT_URL (set by docker-compose)
+    endpoint_url = os.environ.get("AWS_ENDPOINT_URL", "http://localstack:4566")
+    os.environ["AWS_ENDPOINT_URL"] = endpoint_url
+    s3 = boto3.client('s3', endpoint_url=endpoint_url)
     
-    # Initialize S3 client
-    s3 = boto3.client('s3', endpoint_url='http://localstack:4566')
+    # Fall back to small synthetic days when the sample files are not checked out
+    if not all(os.path.exists(f'tests/data/{test_file}') for test_file in test_files):
+        print("Sample files not found in tests/data; generating synthetic days")
+        write_days('tests/data', "2025-01-01", len(test_files), 180, 360)
+    
+    print("\nChecking destination bucket...")
+    try:
+        s3.head_bucket(Bucket='noaa-oisst-zarr')
+    except Exception:
+        print("Creating destination bucket")
+        s3.create_bucket(Bucket='noaa-oisst-zarr')
     
     # Create source bucket structure
     print("\nChecking source bucket...")
     try:
         s3.head_bucket(Bucket='noaa-oisst-nc')
-    except:
+    except Exception:
         print("Creating source bucket")
         s3.create_bucket(Bucket='noaa-oisst-nc')
     
@@ -59,9 +64,10 @@ def test_conversion():
         
         # Convert file
         result = convert_netcdf_to_zarr(
-            source_path=f's3://noaa-oisst-nc/{source_key}',
-            base_dest_path='s3://noaa-oisst-zarr',
-            config=config
+            netcdf_file=f's3://noaa-oisst-nc/{source_key}',
+            zarr_store='noaa-oisst-zarr/oisst',
+            suffix=suffix,
+            conversion_config=conversion_config
         )
         print(f"Conversion completed: {result}")
     
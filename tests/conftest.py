@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import xarray as xr
+
+# The ecs package, the scripts (synthetic_oisst) and the Lambda handlers, which are
+# deployed as top-level modules.
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (ROOT, os.path.join(ROOT, "scripts"), os.path.join(ROOT, "lambda")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ["METRICS_SINK"] = "off"
+# The Lambda modules create their boto3 clients on import; tests never reach AWS.
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.pop("OVERWRITE_ZARR_STORE", None)
+
+from synthetic_oisst import write_days  # noqa: E402
+from ecs.store_io import get_store, split_store_url  # noqa: E402
+from ecs.store_writes import HASH_VERSION  # noqa: E402
+
+# A small grid split into several chunks, so writes and layouts span chunk boundaries.
+NLAT, NLON = 36, 72
+CHUNKS = {"time": 1, "zlev": 1, "lat": 18, "lon": 36}
+
+
+@pytest.fixture(scope="session")
+def source_files(tmp_path_factory):
+    """Four consecutive synthetic OISST days, 2025-01-01 to 2025-01-04."""
+    return write_days(str(tmp_path_factory.mktemp("source")), "2025-01-01", 4, NLAT, NLON)
+
+
+@pytest.fixture(scope="session")
+def revised_files(tmp_path_factory):
+    """The same four days with different values, as a revised (final) release would have."""
+    return write_days(str(tmp_path_factory.mktemp("revised")), "2025-01-01", 4, NLAT, NLON, seed=1)
+
+
+@pytest.fixture
+def conversion_config():
+    """A conversion section chunking every variable of the small grid."""
+    return {
+        "variables": {name: {"chunks": CHUNKS} for name in ("sst", "anom", "err", "ice")},
+        "land_mask": False,
+        "cell_layout": "grid",
+        "chunk_dedup": False,
+        "hash_phase": "inline",
+    }
+
+
+@pytest.fixture
+def store_url(tmp_path):
+    """A file:// location for a new Zarr store."""
+    return f"file://{tmp_path}/store"
+
+
+def open_store(store_url):
+    """A converted store opened with xarray."""
+    protocol, path = split_store_url(store_url)
+    return xr.open_zarr(get_store(path, protocol), consolidated=True)
+
+
+def assert_same_contents(actual_url, expected_url, ignore=()):
+    """
+    Both stores hold the same days with the same values in every variable but `ignore`
+    and the hash versions, which are the times the days were written.
+    """
+    ignore = [HASH_VERSION, *ignore]
+    actual, expected = open_store(actual_url), open_store(expected_url)
+    actual, expected = actual.drop_vars(ignore, errors="ignore"), expected.drop_vars(ignore, errors="ignore")
+    assert sorted(actual.data_vars) == sorted(expected.data_vars)
+    np.testing.assert_array_equal(actual["time"].values, expected["time"].values)
+    for name in expected.data_vars:
+        a, e = actual[name].values, expected[name].values
+        if a.dtype == object:
+            np.testing.assert_array_equal(a, e, err_msg=name)
+        else:
+            np.testing.assert_array_equal(a, e, err_msg=name, strict=True)
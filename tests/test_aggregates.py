@@ -0,0 +1,131 @@
+import json
+import os
+import subprocess
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ecs.aggregates import (
+    _accumulate,
+    _deaccumulate,
+    _mean_and_variance,
+    climatology,
+    rebuild_aggregates,
+    rolling_statistics,
+)
+from conftest import ROOT
+from ecs.batch_conversion import convert_files_to_zarr
+from ecs.converter import convert_netcdf_to_zarr
+from ecs.store_io import get_filesystem, get_store, open_variables, split_store_url
+
+AGGREGATES = {"variables": ["sst"], "rolling_windows": [2, 3]}
+
+
+def brute_force(days):
+    """Mean and sample variance of a stack of days, NaN where there are too few values."""
+    stack = np.stack(days).astype(np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(stack, axis=0), np.nanvar(stack, axis=0, ddof=1)
+
+
+def stored_days(store_url):
+    """The sst of every stored day, by time."""
+    protocol, path = split_store_url(store_url)
+    ds = open_variables(get_store(path, protocol), ["sst"])
+    return {pd.Timestamp(t): ds["sst"].sel(time=t).values for t in ds["time"].values}
+
+
+def assert_statistics_equal(actual, expected):
+    for a, e in zip(actual, expected):
+        np.testing.assert_allclose(a, e, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def assert_aggregates_match_store(store_url, aggregates_config):
+    fs = get_filesystem("file")
+    _, path = split_store_url(store_url)
+    days = stored_days(store_url)
+    times = sorted(days)
+    for window in aggregates_config["rolling_windows"]:
+        expected = brute_force([days[t] for t in times[-window:]])
+        assert_statistics_equal(rolling_statistics(fs, path, "sst", window, aggregates_config), expected)
+    for t in times:
+        assert_statistics_equal(climatology(fs, path, "sst", t, aggregates_config), brute_force([days[t]]))
+
+
+def test_welford_accumulators_match_brute_force():
+    rng = np.random.default_rng(0)
+    days = rng.normal(20, 5, size=(10, 4, 5))
+    days[rng.random(days.shape) < 0.2] = np.nan
+    days[:, 0, 0] = np.nan  # a cell that never has a value
+    stats = (np.zeros((4, 5)), np.zeros((4, 5), dtype=np.int32), np.zeros((4, 5)))
+    for day in days:
+        stats = _accumulate(*stats, day)
+    assert_statistics_equal(_mean_and_variance(*stats), brute_force(days))
+
+    # Removing days leaves the statistics of the remaining ones.
+    for day in days[:7]:
+        stats = _deaccumulate(*stats, day)
+    assert_statistics_equal(_mean_and_variance(*stats), brute_force(days[7:]))
+
+
+def test_aggregates_follow_appends_and_overwrites(source_files, revised_files, conversion_config, store_url):
+    conversion_config["aggregates"] = AGGREGATES
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    # Overwrite a day inside the windows; its old values are removed from the aggregates.
+    convert_netcdf_to_zarr(revised_files[2], store_url, "", conversion_config)
+    assert_aggregates_match_store(store_url, AGGREGATES)
+
+
+def test_rebuild_matches_incremental(source_files, conversion_config, store_url):
+    conversion_config["aggregates"] = AGGREGATES
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    fs = get_filesystem("file")
+    _, path = split_store_url(store_url)
+    incremental = {window: rolling_statistics(fs, path, "sst", window, AGGREGATES)
+                   for window in AGGREGATES["rolling_windows"]}
+
+    rebuild_aggregates(fs, path, AGGREGATES)
+    for window, expected in incremental.items():
+        assert_statistics_equal(rolling_statistics(fs, path, "sst", window, AGGREGATES), expected)
+
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_rolling_window_edges(source_files, conversion_config, store_url, window):
+    conversion_config["aggregates"] = {"variables": ["sst"], "rolling_windows": [window]}
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    fs = get_filesystem("file")
+    _, path = split_store_url(store_url)
+    days = stored_days(store_url)
+    expected = brute_force([days[t] for t in sorted(days)[-window:]])
+    assert_statistics_equal(rolling_statistics(fs, path, "sst", window, conversion_config["aggregates"]), expected)
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_enabling_aggregates_on_a_store_with_data(source_files, conversion_config, store_url, batch):
+    for netcdf_file in source_files[:2]:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    # The first write with aggregates on rebuilds them over the days already stored.
+    conversion_config["aggregates"] = AGGREGATES
+    if batch:
+        convert_files_to_zarr(source_files[2:], store_url, "", conversion_config)
+    else:
+        for netcdf_file in source_files[2:]:
+            convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    assert_aggregates_match_store(store_url, AGGREGATES)
+
+
+def test_rebuild_cli_on_a_local_store(source_files, conversion_config, store_url, tmp_path):
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    config_path = tmp_path / "app_config.json"
+    config_path.write_text(json.dumps({"conversion": {"aggregates": AGGREGATES}}))
+    subprocess.run([sys.executable, os.path.join(ROOT, "scripts", "rebuild_aggregates.py"), store_url,
+                    "--config", str(config_path)], check=True, capture_output=True)
+    assert_aggregates_match_store(store_url, AGGREGATES)
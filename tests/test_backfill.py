@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from conftest import ROOT, assert_same_contents
+from ecs.cell_layout import apply_cell_layout
+from ecs.converter import convert_netcdf_to_zarr, load_dataset, add_verifier_pubkeys
+from ecs.hashing import add_spatial_hashes
+from ecs.store_writes import create_presized_store
+
+
+def append_store(source_files, store_url, conversion_config):
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    return store_url
+
+
+@pytest.mark.parametrize("cell_layout", ["grid", "ocean"])
+def test_region_writes_match_appends(source_files, conversion_config, tmp_path, cell_layout):
+    conversion_config.update(cell_layout=cell_layout, land_mask=cell_layout == "ocean")
+    appended = append_store(source_files, f"file://{tmp_path}/appended", conversion_config)
+
+    # Pre-size the store from the first day, as the backfill does, then fill it out of order.
+    presized = f"file://{tmp_path}/presized"
+    ds, _ = load_dataset(source_files[0], "", conversion_config)
+    ds = apply_cell_layout(add_spatial_hashes(ds, conversion_config["land_mask"]), presized, conversion_config,
+                           new_store=True)
+    times = pd.date_range("2025-01-01T12:00", periods=len(source_files), freq="D")
+    create_presized_store(add_verifier_pubkeys(ds), presized, times)
+    for netcdf_file in reversed(source_files):
+        convert_netcdf_to_zarr(netcdf_file, presized, "", conversion_config, write_mode="region")
+    assert_same_contents(presized, appended)
+
+
+def test_region_write_outside_the_time_axis_fails(source_files, conversion_config, tmp_path):
+    presized = f"file://{tmp_path}/presized"
+    ds, _ = load_dataset(source_files[0], "", conversion_config)
+    create_presized_store(add_verifier_pubkeys(add_spatial_hashes(ds)), presized,
+                          pd.date_range("2025-01-01T12:00", periods=2, freq="D"))
+    with pytest.raises(ValueError):
+        convert_netcdf_to_zarr(source_files[3], presized, "", conversion_config, write_mode="region")
+
+
+def test_backfill_cli_matches_appends_and_resumes(source_files, conversion_config, tmp_path):
+    config_path = tmp_path / "app_config.json"
+    config_path.write_text(json.dumps({"defined_suffix": "", "sub_folder": "oisst-data",
+                                       "conversion": conversion_config}))
+    command = [sys.executable, os.path.join(ROOT, "scripts", "backfill.py"),
+               "--start", "2025-01-01", "--end", "2025-01-04", "--source", os.path.dirname(source_files[0]),
+               "--dest-bucket", f"file://{tmp_path}/bucket", "--config", str(config_path),
+               "--workers", "2", "--days-per-range", "2", "--checkpoint", str(tmp_path / "checkpoint.json")]
+    subprocess.run(command, check=True, capture_output=True, cwd=tmp_path)
+    checkpoint = json.loads((tmp_path / "checkpoint.json").read_text())
+    assert sorted(checkpoint["completed"]) == [f"2025-01-0{day}" for day in range(1, 5)]
+    assert_same_contents(f"file://{tmp_path}/bucket/oisst-data",
+                         append_store(source_files, f"file://{tmp_path}/appended", conversion_config))
+
+    # A rerun with the same checkpoint finds nothing left to do and leaves the store as it is.
+    result = subprocess.run(command, check=True, capture_output=True, text=True, cwd=tmp_path)
+    assert "0 day(s) remaining" in result.stderr
@@ -0,0 +1,108 @@
+import dask.array as da
+import numpy as np
+import pytest
+import xarray as xr
+
+from ecs.cell_layout import (
+    CELL_DIM,
+    build_cells,
+    check_cells,
+    gather_cells,
+    grid_to_cell,
+    pack_dataset,
+    scatter_cells,
+    unpack_variable,
+)
+from conftest import NLAT, NLON, open_store
+from ecs.batch_conversion import convert_files_to_zarr
+from ecs.converter import convert_netcdf_to_zarr
+from synthetic_oisst import land_mask, make_day
+
+
+@pytest.fixture
+def ocean():
+    rng = np.random.default_rng(0)
+    return rng.random((6, 8)) > 0.3
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_gather_and_scatter_round_trip(ocean, lazy):
+    cells = build_cells(ocean)
+    values = np.arange(2 * 6 * 8 * 3).reshape(2, 6, 8, 3)
+    data = da.from_array(values, chunks=(1, 3, 4, 3)) if lazy else values
+    packed = np.asarray(gather_cells(data, cells, axis=1))
+    assert packed.shape == (2, len(cells), 3)
+    unpacked = scatter_cells(packed, cells, ocean.shape, -1, axis=1)
+    np.testing.assert_array_equal(unpacked, np.where(ocean[None, :, :, None], values, -1))
+
+
+def test_cell_positions(ocean):
+    cells = build_cells(ocean)
+    positions = grid_to_cell(cells, ocean.shape)
+    assert (positions[~ocean] == -1).all()
+    np.testing.assert_array_equal(positions[ocean], np.arange(len(cells)))
+    assert check_cells(ocean, cells) == 0
+    assert check_cells(np.ones_like(ocean), cells) == (~ocean).sum()
+
+
+def test_pack_dataset_round_trip(ocean):
+    hashes = np.array([f"h{i}" for i in range(2 * ocean.size)], dtype=object).reshape(2, 1, *ocean.shape)
+    ds = xr.Dataset(
+        {"spatial_hash": (("time", "zlev", "lat", "lon"), da.from_array(hashes, chunks=(1, 1, 3, 4))),
+         "sst": (("time", "zlev", "lat", "lon"), np.zeros(hashes.shape))},
+        coords={"lat": np.arange(6.0), "lon": np.arange(8.0)},
+    )
+    packed = pack_dataset(ds, build_cells(ocean))
+    assert packed["spatial_hash"].dims == ("time", CELL_DIM)
+    assert packed["sst"].dims == ds["sst"].dims
+    unpacked = unpack_variable(packed, "spatial_hash").values
+    np.testing.assert_array_equal(unpacked, np.where(ocean, hashes[:, 0], ""))
+
+
+def test_ocean_store_holds_the_grid_hashes_of_ocean_cells(source_files, conversion_config, tmp_path):
+    conversion_config["land_mask"] = True
+    grid = f"file://{tmp_path}/grid"
+    packed = f"file://{tmp_path}/packed"
+    for netcdf_file in source_files[:2]:
+        convert_netcdf_to_zarr(netcdf_file, grid, "", conversion_config)
+        convert_netcdf_to_zarr(netcdf_file, packed, "", dict(conversion_config, cell_layout="ocean"))
+    # An existing store keeps its layout whatever the configuration says.
+    convert_netcdf_to_zarr(source_files[2], grid, "", conversion_config)
+    convert_netcdf_to_zarr(source_files[2], packed, "", conversion_config)
+
+    grid_ds, packed_ds = open_store(grid), open_store(packed)
+    assert CELL_DIM not in grid_ds.dims
+    assert packed_ds["spatial_hash"].dims == ("time", CELL_DIM)
+    assert packed_ds["verifier_pubkeys"].dims == ("time", CELL_DIM, "verifier")
+    expected = grid_ds["spatial_hash"].isel(zlev=0).values
+    np.testing.assert_array_equal(unpack_variable(packed_ds, "spatial_hash").values, expected)
+    # Land has empty hashes, so only ocean cells are packed.
+    land = np.ones(expected[0].size, dtype=bool)
+    land[packed_ds[CELL_DIM].values] = False
+    assert (expected.reshape(len(expected), -1)[:, land] == "").all()
+
+
+@pytest.mark.parametrize("mode", ["single", "batch"])
+def test_later_day_outside_the_ocean_cells_fails(conversion_config, tmp_path, mode):
+    # The first day has one more land cell (sea ice, say) than the second.
+    mask = land_mask(NLAT, NLON)
+    first_mask = mask.copy()
+    first_mask[NLAT // 2, np.flatnonzero(~mask[NLAT // 2])[0]] = True
+    encoding = {name: {"dtype": "int16", "scale_factor": np.float32(0.01), "_FillValue": np.int16(-999)}
+                for name in ("sst", "anom", "err", "ice")}
+    files = []
+    for date, day_mask in (("2025-01-01", first_mask), ("2025-01-02", mask)):
+        path = str(tmp_path / f"oisst-avhrr-v02r01.{date.replace('-', '')}.nc")
+        make_day(date, NLAT, NLON, mask=day_mask).to_netcdf(path, engine="h5netcdf", encoding=encoding)
+        files.append(path)
+    store_url = f"file://{tmp_path}/store"
+    config = dict(conversion_config, land_mask=True, cell_layout="ocean")
+    with pytest.raises(ValueError, match="1 cell"):
+        if mode == "single":
+            convert_netcdf_to_zarr(files[0], store_url, "", config)
+            convert_netcdf_to_zarr(files[1], store_url, "", config)
+        else:
+            convert_files_to_zarr(files, store_url, "", config)
+    # Nothing is written for the day whose hashes would have been dropped.
+    if mode == "single":
+        assert len(open_store(store_url)["time"]) == 1
@@ -0,0 +1,115 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from conftest import assert_same_contents, open_store
+from ecs.chunk_store import (
+    BLOB_PREFIX,
+    JOURNAL_PREFIX,
+    ContentAddressedStore,
+    collect_garbage,
+    compact,
+    is_internal,
+    open_store as open_zarr_store,
+    split_chunk_key,
+)
+from ecs.converter import convert_netcdf_to_zarr
+from ecs.store_io import get_filesystem, get_store, split_store_url
+
+
+def convert(files, store_url, conversion_config):
+    for netcdf_file in files:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    return store_url
+
+
+def blob_count(store_url):
+    _, path = split_store_url(store_url)
+    directory = os.path.join(path, BLOB_PREFIX)
+    return len(os.listdir(directory)) if os.path.isdir(directory) else 0
+
+
+def chunk_count(store):
+    return sum(len(chunks) for chunks in compact(store).values())
+
+
+def test_chunk_keys():
+    assert split_chunk_key("sst/c/0/0/1/2") == ("sst", "c/0/0/1/2")
+    assert split_chunk_key("group/sst/c/3") == ("group/sst", "c/3")
+    assert split_chunk_key("sst/zarr.json") is None
+    assert split_chunk_key("c/zarr.json") is None
+    assert is_internal("chunk_manifest.json") and is_internal(BLOB_PREFIX + "ab") and is_internal("sst/manifest.json")
+    assert not is_internal("sst/c/0") and not is_internal("zarr.json")
+
+
+@pytest.fixture
+def stores(source_files, conversion_config, tmp_path):
+    """A plain and a content-addressed store holding the same three days."""
+    plain = convert(source_files[:3], f"file://{tmp_path}/plain", conversion_config)
+    deduped = convert(source_files[:3], f"file://{tmp_path}/deduped", dict(conversion_config, chunk_dedup=True))
+    return plain, deduped
+
+
+def test_content_addressed_store_reads_like_a_plain_one(stores):
+    plain, deduped = stores
+    protocol, path = split_store_url(deduped)
+    assert isinstance(get_store(path, protocol), ContentAddressedStore)
+    assert_same_contents(deduped, plain)
+
+
+def test_identical_chunks_are_stored_once(stores, source_files, conversion_config, tmp_path):
+    _, deduped = stores
+    protocol, path = split_store_url(deduped)
+    store = get_store(path, protocol)
+    chunks, blobs = chunk_count(store), blob_count(deduped)
+    # A day with the same values as a stored one only adds its time coordinate and hash version.
+    repeated = tmp_path / "oisst-avhrr-v02r01.20250104.nc"
+    shutil.copy(source_files[2], repeated)
+    convert([str(repeated)], deduped, dict(conversion_config, chunk_dedup=True))
+    assert chunk_count(store) - chunks > 10
+    assert blob_count(deduped) - blobs <= 2
+    sst = open_store(deduped)["sst"].values
+    np.testing.assert_array_equal(sst[3], sst[2])
+
+    # Rewriting a day with the same values only adds its new hash version.
+    blobs = blob_count(deduped)
+    convert(source_files[1:2], deduped, dict(conversion_config, chunk_dedup=True))
+    assert blob_count(deduped) == blobs + 1
+
+
+def test_other_processes_see_journaled_and_compacted_chunks(stores):
+    plain, deduped = stores
+    _, path = split_store_url(deduped)
+    fs = get_filesystem("file")
+    # A fresh store object reads the journal written by the conversions...
+    fresh = open_zarr_store(fs, path, read_only=True)
+    assert isinstance(fresh, ContentAddressedStore)
+    expected = open_store(plain)["sst"].values
+    np.testing.assert_array_equal(xr.open_zarr(fresh, consolidated=True)["sst"].values, expected)
+    # ...and, once compacted, the manifests instead.
+    compact(get_store(path, "file"))
+    assert not os.listdir(os.path.join(path, JOURNAL_PREFIX))
+    fresh = open_zarr_store(fs, path, read_only=True)
+    np.testing.assert_array_equal(xr.open_zarr(fresh, consolidated=True)["sst"].values, expected)
+
+
+def test_garbage_collection_deletes_only_unreferenced_blobs(stores, revised_files, conversion_config):
+    _, deduped = stores
+    protocol, path = split_store_url(deduped)
+    store = get_store(path, protocol)
+    # Overwriting a day with other values leaves its old chunks unreferenced.
+    convert(revised_files[1:2], deduped, dict(conversion_config, chunk_dedup=True))
+    expected = open_store(deduped)["sst"].values
+    before = blob_count(deduped)
+
+    dry_run = collect_garbage(store, get_filesystem(protocol), grace_seconds=0, dry_run=True)
+    assert dry_run["deleted"] > 0 and blob_count(deduped) == before
+    assert collect_garbage(store, get_filesystem(protocol), grace_seconds=3600)["deleted"] == 0
+
+    result = collect_garbage(store, get_filesystem(protocol), grace_seconds=0)
+    assert result["deleted"] == dry_run["deleted"]
+    assert blob_count(deduped) == before - result["deleted"] == result["kept"]
+    np.testing.assert_array_equal(open_store(deduped)["sst"].values, expected)
@@ -0,0 +1,93 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import conversion_trigger
+from conversion_trigger import extract_s3_records, group_files_by_destination
+
+SOURCE = "source"
+
+
+def s3_record(key, bucket=SOURCE, etag="e1"):
+    return {"eventSource": "aws:s3", "s3": {"bucket": {"name": bucket}, "object": {"key": key, "eTag": etag}}}
+
+
+def sns_record(*records):
+    return {"EventSource": "aws:sns", "Sns": {"Message": json.dumps({"Records": list(records)})}}
+
+
+def name(day, month="202501", preliminary=False):
+    return f"data/{month}/oisst-avhrr-v02r01.{month}{day:02d}{'_preliminary' if preliminary else ''}.nc"
+
+
+def url(key, bucket=SOURCE):
+    return f"s3://{bucket}/{key}"
+
+
+@pytest.fixture
+def destinations(monkeypatch):
+    """Files of the "other" source bucket go to their own destination; the rest to DEST_BUCKET."""
+    monkeypatch.setenv("DEST_BUCKET", "dest")
+    monkeypatch.setattr(conversion_trigger, "DATASET_CONFIGS", {"other": {"destination_bucket": "other-dest"}})
+
+
+def test_records_are_unwrapped_from_every_sns_message():
+    direct = s3_record(name(1))
+    wrapped = [s3_record(name(2)), s3_record(name(3))]
+    event = {"Records": [direct, sns_record(*wrapped), sns_record(s3_record(name(4))), {"EventSource": "aws:sqs"}]}
+    assert extract_s3_records(event) == [direct] + wrapped + [s3_record(name(4))]
+
+
+def test_unreadable_sns_message_fails():
+    with pytest.raises(ValueError):
+        extract_s3_records({"Records": [{"Sns": {"Message": "not json"}}]})
+
+
+def test_duplicate_records_are_collapsed_and_the_last_wins(destinations):
+    records = [s3_record(name(1), etag="e1"), s3_record(name(2)), s3_record(name(1), etag="e2")]
+    assert group_files_by_destination(records) == {
+        "dest": ([url(name(1)), url(name(2))], {url(name(1)): "e2", url(name(2)): "e1"})}
+
+
+def test_encoded_keys_are_decoded(destinations):
+    records = [s3_record("data/202501/oisst+avhrr.20250101.nc"), s3_record("data/202501/oisst%20avhrr.20250101.nc")]
+    files, _ = group_files_by_destination(records)["dest"]
+    # Both notifications name the same object.
+    assert files == [url("data/202501/oisst avhrr.20250101.nc")]
+
+
+def test_files_are_grouped_by_destination(destinations):
+    records = [s3_record(name(1, preliminary=True)), s3_record(name(1)),
+               s3_record(name(31, "202412")), s3_record(name(2), bucket="other")]
+    groups = group_files_by_destination(records)
+    # Preliminary and final versions, and days of other months, stay in their group;
+    # scheduling collapses them (see supersession.schedule_conversions).
+    assert groups["dest"][0] == [url(name(1, preliminary=True)), url(name(1)), url(name(31, "202412"))]
+    assert groups["other-dest"][0] == [url(name(2), "other")]
+
+
+class FakeLauncher:
+    def __init__(self):
+        self.launches = []
+
+    def launch(self, files, versions=None):
+        self.launches.append(files)
+        return files, []
+
+
+def test_handler_launches_each_date_once_in_date_order(destinations, monkeypatch):
+    launcher = FakeLauncher()
+    monkeypatch.setattr(conversion_trigger, "get_launcher", lambda dest_bucket, context: launcher)
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=SOURCE)
+        # The final file of 2025-01-03 is already in the source bucket.
+        s3.put_object(Bucket=SOURCE, Key=name(3), Body=b"final")
+        monkeypatch.setattr(conversion_trigger, "s3_client", s3)
+        event = {"Records": [sns_record(s3_record(name(2)), s3_record(name(2, preliminary=True)),
+                                        s3_record(name(3, preliminary=True))),
+                             s3_record(name(31, "202412", preliminary=True)), s3_record(name(2))]}
+        conversion_trigger.lambda_handler(event, None)
+    assert launcher.launches == [[url(name(31, "202412", preliminary=True)), url(name(2))]]
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import dask
+import pytest
+
+from conftest import assert_same_contents
+from ecs.converter import convert_netcdf_to_zarr
+
+
+def test_concurrent_conversions_keep_their_own_threads(source_files, conversion_config, tmp_path, monkeypatch):
+    conversion_config.update(memory_budget_mib=2048, concurrent_conversions=2)
+    sequential = [f"file://{tmp_path}/sequential-{index}" for index in range(2)]
+    for store_url, netcdf_file in zip(sequential, source_files):
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+
+    # Each conversion passes its planned threads to its own computes; the dask
+    # configuration is shared by every thread of the worker.
+    def shared_config(*args, **kwargs):
+        pytest.fail("a conversion changed dask's configuration")
+    monkeypatch.setattr(dask.config, "set", shared_config)
+    concurrent = [f"file://{tmp_path}/concurrent-{index}" for index in range(2)]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        records = list(pool.map(lambda args: convert_netcdf_to_zarr(args[1], args[0], "", conversion_config),
+                                zip(concurrent, source_files)))
+    assert all(record["memory_plan"]["num_workers"] >= 1 for record in records)
+    for actual, expected in zip(concurrent, sequential):
+        assert_same_contents(actual, expected)
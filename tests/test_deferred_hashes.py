@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import assert_same_contents, open_store
+from ecs.batch_conversion import convert_files_to_zarr
+from ecs.converter import convert_netcdf_to_zarr
+from ecs.deferred_hashes import HASH_PENDING, attach_hashes
+
+TIMES = pd.date_range("2025-01-01T12:00", periods=4, freq="D")
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"packing": "source"},
+    {"land_mask": True, "cell_layout": "ocean"},
+    {"chunk_dedup": True},
+])
+def test_attached_hashes_match_inline_hashes(source_files, conversion_config, tmp_path, options):
+    conversion_config.update(options)
+    inline = f"file://{tmp_path}/inline"
+    deferred = f"file://{tmp_path}/deferred"
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, inline, "", conversion_config)
+        record = convert_netcdf_to_zarr(netcdf_file, deferred, "", dict(conversion_config, hash_phase="deferred"))
+        assert record["hash_pending"]
+
+    # Published days have their science variables but no hashes yet.
+    published = open_store(deferred)
+    np.testing.assert_array_equal(published[HASH_PENDING].values, 1)
+    assert (published["spatial_hash"].values == "").all()
+    assert_same_contents(deferred, inline, ignore=[HASH_PENDING, "spatial_hash"])
+
+    for time in reversed(TIMES):
+        attach_hashes(deferred, time, conversion_config)
+    np.testing.assert_array_equal(open_store(deferred)[HASH_PENDING].values, 0)
+    assert_same_contents(deferred, inline, ignore=[HASH_PENDING])
+
+
+def test_stores_created_deferred_keep_tracking_hash_status(source_files, conversion_config, tmp_path):
+    deferred = f"file://{tmp_path}/deferred"
+    convert_netcdf_to_zarr(source_files[0], deferred, "", dict(conversion_config, hash_phase="deferred"))
+    # Inline and batched days of the store are marked as hashed.
+    convert_netcdf_to_zarr(source_files[1], deferred, "", conversion_config)
+    convert_files_to_zarr(source_files[2:], deferred, "", conversion_config)
+    np.testing.assert_array_equal(open_store(deferred)[HASH_PENDING].values, [1, 0, 0, 0])
+
+    inline = f"file://{tmp_path}/inline"
+    convert_netcdf_to_zarr(source_files[0], inline, "", conversion_config)
+    assert HASH_PENDING not in open_store(inline)
+
+
+def test_attaching_a_day_not_in_the_store_fails(source_files, conversion_config, tmp_path):
+    deferred = f"file://{tmp_path}/deferred"
+    convert_netcdf_to_zarr(source_files[0], deferred, "", dict(conversion_config, hash_phase="deferred"))
+    with pytest.raises(ValueError):
+        attach_hashes(deferred, TIMES[1], conversion_config)
@@ -0,0 +1,151 @@
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+import ecs_launcher
+from ecs_launcher import EcsLauncher
+from processed_ledger import ProcessedLedger
+
+BUCKET = "dest"
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "RunTask")
+
+
+class FakeEcs:
+    """
+    ECS stand-in: `running` tasks listed a page at a time, run_task throttled
+    `throttles` times before it succeeds, and batches holding a file in `failing`
+    returned as failures.
+    """
+
+    def __init__(self, running=0, page_size=2, throttles=0, failing=(), error="ThrottlingException"):
+        self.running = running
+        self.page_size = page_size
+        self.throttles = throttles
+        self.failing = set(failing)
+        self.error = error
+        self.calls = 0
+        self.launched = []
+
+    def list_tasks(self, desiredStatus, nextToken=None, **kwargs):
+        # All listed tasks are RUNNING; the next page starts at nextToken.
+        total = self.running if desiredStatus == "RUNNING" else 0
+        start = int(nextToken or 0)
+        end = min(total, start + self.page_size)
+        response = {"taskArns": [f"arn:aws:ecs:task/{i}" for i in range(start, end)]}
+        if end < total:
+            response["nextToken"] = str(end)
+        return response
+
+    def run_task(self, **kwargs):
+        self.calls += 1
+        if self.throttles:
+            self.throttles -= 1
+            raise client_error(self.error)
+        environment = kwargs["overrides"]["containerOverrides"][0]["environment"]
+        files = json.loads({item["name"]: item["value"] for item in environment}["INPUT_FILES"])
+        if self.failing & set(files):
+            return {"tasks": [], "failures": [{"arn": files[0], "reason": "RESOURCE:MEMORY"}]}
+        self.launched.append(files)
+        return {"tasks": [{"taskArn": f"arn:aws:ecs:task/new-{len(self.launched)}"}], "failures": []}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """The backoff delays, recorded instead of slept."""
+    delays = []
+    monkeypatch.setattr(ecs_launcher.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def checkpoint():
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        yield ProcessedLedger(s3, BUCKET, "_ledger/launched.json").load()
+
+
+def launcher(ecs, **kwargs):
+    return EcsLauncher(ecs, "cluster", "converter:1", {}, batch_size=2, **kwargs)
+
+
+def files(count):
+    return [f"s3://source/{day:02d}.nc" for day in range(1, count + 1)]
+
+
+def test_throttled_launches_back_off_with_jitter(sleeps, monkeypatch):
+    # Full jitter: each delay is drawn from [0, min(max_delay, base_delay * 2 ** attempt)].
+    draws = []
+    monkeypatch.setattr(ecs_launcher.random, "uniform", lambda low, high: draws.append((low, high)) or high / 2)
+    ecs = FakeEcs(throttles=3)
+    launched, pending = launcher(ecs, base_delay=1.0, max_delay=3.0).launch(files(2))
+    assert launched == files(2) and pending == []
+    assert ecs.calls == 4
+    assert draws == [(0, 1.0), (0, 2.0), (0, 3.0)]
+    assert sleeps == [0.5, 1.0, 1.5]
+
+
+def test_persistent_throttling_leaves_the_batch_pending(sleeps):
+    ecs = FakeEcs(throttles=100)
+    launched, pending = launcher(ecs, max_attempts=4).launch(files(2))
+    assert launched == [] and pending == files(2)
+    assert ecs.calls == 4 and len(sleeps) == 3
+
+
+def test_other_errors_are_not_retried(sleeps):
+    ecs = FakeEcs(throttles=1, error="AccessDeniedException")
+    launched, pending = launcher(ecs).launch(files(2))
+    assert launched == [] and pending == files(2)
+    assert ecs.calls == 1 and sleeps == []
+
+
+def test_launches_stop_at_the_concurrent_task_limit():
+    # Five running tasks, listed over three pages, leave two of seven slots.
+    ecs = FakeEcs(running=5)
+    launched, pending = launcher(ecs, max_concurrent_tasks=7).launch(files(7))
+    assert ecs.launched == [files(4)[:2], files(4)[2:]]
+    assert launched == files(4) and pending == files(7)[4:]
+
+    ecs = FakeEcs(running=7)
+    assert launcher(ecs, max_concurrent_tasks=7).launch(files(3)) == ([], files(3))
+
+
+def test_launches_stop_when_the_invocation_runs_out_of_time():
+    ecs = FakeEcs()
+    assert launcher(ecs, remaining_time=lambda: 5).launch(files(3)) == ([], files(3))
+    assert ecs.calls == 0
+
+
+def test_failed_batches_stay_pending_and_are_not_checkpointed(checkpoint):
+    ecs = FakeEcs(failing=[files(3)[2]])
+    launched, pending = launcher(ecs, checkpoint=checkpoint).launch(files(4))
+    assert launched == files(2) and pending == files(4)[2:]
+
+    # The next invocation skips the checkpointed batch and launches the failed one again.
+    ecs.failing = set()
+    launched, pending = launcher(ecs, checkpoint=checkpoint).launch(files(4))
+    assert launched == files(4) and pending == []
+    assert ecs.launched == [files(2), files(4)[2:]]
+
+
+def test_checkpointed_batches_are_not_launched_again(checkpoint):
+    ecs = FakeEcs()
+    versions = {f: '"v1"' for f in files(4)}
+    launcher(ecs, checkpoint=checkpoint).launch(files(4), versions)
+    assert len(ecs.launched) == 2
+
+    # The checkpoint survives the invocation.
+    reloaded = ProcessedLedger(checkpoint.s3_client, BUCKET, checkpoint.key).load()
+    assert launcher(ecs, checkpoint=reloaded).launch(files(4), versions) == (files(4), [])
+    assert len(ecs.launched) == 2
+
+    # A replaced file (new version) makes its batch new.
+    versions[files(1)[0]] = '"v2"'
+    launcher(ecs, checkpoint=reloaded).launch(files(4), versions)
+    assert ecs.launched[2:] == [files(2)]
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as pads
+import pytest
+
+from conftest import NLAT, NLON, ROOT, open_store
+from ecs.converter import convert_netcdf_to_zarr
+from ecs.deferred_hashes import attach_hashes
+from ecs.store_writes import HASH_VERSION
+from export_hashes import VERSIONS_FILE
+
+
+def export(store_url, output, *args):
+    """Run the export script and return its per-day report."""
+    report = f"{output}.report.json"
+    subprocess.run([sys.executable, os.path.join(ROOT, "scripts", "export_hashes.py"), str(output),
+                    "--store", store_url, "--report", report, *args], check=True, capture_output=True)
+    with open(report) as f:
+        return json.load(f)
+
+
+def exported_hashes(output):
+    """Exported hashes as a (date, lat, lon) -> hex digest mapping."""
+    table = pads.dataset(str(output), format="parquet").to_table().to_pydict()
+    return {(str(day), lat, lon): digest.hex()
+            for day, lat, lon, digest in zip(table["date"], table["lat"], table["lon"], table["spatial_hash"])}
+
+
+def stored_hashes(store_url):
+    """The store's hashes in the same form."""
+    ds = open_store(store_url)
+    hashes = ds["spatial_hash"].isel(zlev=0).values
+    lat, lon = ds["lat"].values.astype(np.float32), ds["lon"].values.astype(np.float32)
+    return {(f"{pd.Timestamp(day):%Y-%m-%d}", float(lat[i]), float(lon[j])): hashes[t, i, j]
+            for t, day in enumerate(ds["time"].values) for i in range(len(lat)) for j in range(len(lon))
+            if hashes[t, i, j]}
+
+
+def stored_versions(store_url):
+    """The hash version the store writes recorded for each day."""
+    ds = open_store(store_url)
+    return {f"{pd.Timestamp(day):%Y-%m-%d}": f"{version:.6f}"
+            for day, version in zip(ds["time"].values, ds[HASH_VERSION].values)}
+
+
+@pytest.mark.parametrize("chunk_dedup", [False, True])
+def test_only_new_and_rewritten_days_are_exported(source_files, revised_files, conversion_config, tmp_path,
+                                                  chunk_dedup):
+    conversion_config["chunk_dedup"] = chunk_dedup
+    store_url = f"file://{tmp_path}/store"
+    output = tmp_path / "export"
+    for netcdf_file in source_files[:3]:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", conversion_config)
+    report = export(store_url, output)
+    assert [day["date"] for day in report] == ["2025-01-01", "2025-01-02", "2025-01-03"]
+    assert sum(day["rows"] for day in report) == 3 * NLAT * NLON
+    assert exported_hashes(output) == stored_hashes(store_url)
+    assert sorted(json.loads((output / VERSIONS_FILE).read_text())) == [day["date"] for day in report]
+    assert json.loads((output / VERSIONS_FILE).read_text()) == stored_versions(store_url)
+
+    # Nothing changed: nothing to export.
+    assert export(store_url, output) == []
+
+    # A new day and a rewritten one are exported; the others are left as they are.
+    convert_netcdf_to_zarr(source_files[3], store_url, "", conversion_config)
+    convert_netcdf_to_zarr(revised_files[1], store_url, "", conversion_config)
+    assert [day["date"] for day in export(store_url, output)] == ["2025-01-02", "2025-01-04"]
+    assert exported_hashes(output) == stored_hashes(store_url)
+    assert json.loads((output / VERSIONS_FILE).read_text()) == stored_versions(store_url)
+    assert export(store_url, output) == []
+    assert len(export(store_url, output, "--overwrite", "--start", "2025-01-03")) == 2
+
+
+def test_pending_days_wait_for_their_hashes(source_files, conversion_config, tmp_path):
+    store_url = f"file://{tmp_path}/store"
+    output = tmp_path / "export"
+    deferred = dict(conversion_config, hash_phase="deferred")
+    for netcdf_file in source_files[:2]:
+        convert_netcdf_to_zarr(netcdf_file, store_url, "", deferred)
+    attach_hashes(store_url, pd.Timestamp("2025-01-01T12:00"), conversion_config)
+    assert [day["date"] for day in export(store_url, output)] == ["2025-01-01"]
+
+    attach_hashes(store_url, pd.Timestamp("2025-01-02T12:00"), conversion_config)
+    assert [day["date"] for day in export(store_url, output)] == ["2025-01-02"]
+    assert exported_hashes(output) == stored_hashes(store_url)
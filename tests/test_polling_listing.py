@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+
+from polling_handler import advance_listing_cursor, get_month_prefixes, relist_start
+
+PREFIX = "data/v2.1/avhrr/202501/"
+
+
+def key(day, preliminary=False):
+    return f"{PREFIX}oisst-avhrr-v02r01.202501{day:02d}{'_preliminary' if preliminary else ''}.nc"
+
+
+def test_cursor_moves_over_converted_final_keys():
+    listed = {PREFIX: [key(1), key(2), key(3)]}
+    assert advance_listing_cursor({}, listed, set()) == {PREFIX: key(3)}
+
+
+def test_cursor_stops_at_pending_and_preliminary_keys():
+    listed = {PREFIX: [key(1), key(2), key(3, preliminary=True), key(4)]}
+    assert advance_listing_cursor({}, listed, {key(2)}) == {PREFIX: key(1)}
+    assert advance_listing_cursor({}, listed, set()) == {PREFIX: key(2)}
+    # A preliminary file whose final version is recorded no longer holds the cursor.
+    assert advance_listing_cursor({}, listed, set(), {key(3, preliminary=True)}) == {PREFIX: key(4)}
+
+
+def test_cursor_never_moves_back():
+    cursor = {PREFIX: key(10)}
+    # Keys re-listed behind the cursor (see relist_start) leave it where it is...
+    assert advance_listing_cursor(cursor, {PREFIX: [key(4), key(5)]}, set()) == cursor
+    # ...and so does a held key among them, or a prefix with nothing listed.
+    assert advance_listing_cursor(cursor, {PREFIX: [key(4), key(11)]}, {key(4)}) == cursor
+    assert advance_listing_cursor(cursor, {PREFIX: []}, set()) == cursor
+    assert advance_listing_cursor(cursor, {PREFIX: [key(11)]}, set()) == {PREFIX: key(11)}
+
+
+def test_cursor_of_first_held_key_stays_unset():
+    assert advance_listing_cursor({}, {PREFIX: [key(1)]}, {key(1)}) == {}
+
+
+def test_relist_start_moves_the_date_back():
+    assert relist_start(key(10), 7) == key(3)
+    # Across the start of the month the StartAfter key sorts before the whole prefix.
+    assert relist_start(key(3), 7) == f"{PREFIX}oisst-avhrr-v02r01.20241227.nc"
+    assert relist_start(key(3, preliminary=True), 1) == key(2, preliminary=True)
+
+
+def test_relist_start_keeps_cursor_without_date_or_days():
+    assert relist_start(key(10), 0) == key(10)
+    assert relist_start(f"{PREFIX}README.txt", 7) == f"{PREFIX}README.txt"
+
+
+def test_month_prefixes_span_the_year_boundary(monkeypatch):
+    monkeypatch.setenv("SOURCE_PREFIX", "data/")
+    monkeypatch.setenv("LOOKBACK_MONTHS", "1")
+    now = datetime(2025, 1, 15, tzinfo=timezone.utc)
+    assert get_month_prefixes(now) == ["data/202411/", "data/202412/", "data/202501/"]
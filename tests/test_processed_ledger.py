@@ -0,0 +1,160 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from botocore import UNSIGNED
+from botocore.client import Config
+from moto import mock_aws
+
+import polling_handler
+from ecs.worker_app import write_completion_record
+from processed_ledger import ProcessedLedger
+
+SOURCE_BUCKET = "source"
+DEST_BUCKET = "dest"
+COMPLETED_PREFIX = "_ledger/completed/"
+
+
+class FakeEcs:
+    """ECS stand-in recording the environment of every task launched."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def list_tasks(self, **kwargs):
+        return {"taskArns": []}
+
+    def run_task(self, **kwargs):
+        environment = kwargs["overrides"]["containerOverrides"][0]["environment"]
+        self.tasks.append({item["name"]: item["value"] for item in environment})
+        return {"tasks": [{"taskArn": f"arn:aws:ecs:task/{len(self.tasks)}"}], "failures": []}
+
+    def launched(self):
+        """Files of the tasks launched so far, then forgets them."""
+        files = [f for task in self.tasks for f in json.loads(task["INPUT_FILES"])]
+        self.tasks = []
+        return files
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=SOURCE_BUCKET)
+        client.create_bucket(Bucket=DEST_BUCKET)
+        yield client
+
+
+@pytest.fixture
+def poller(s3, monkeypatch):
+    """The polling handler against moto S3/SSM and a fake ECS; returns the fake ECS."""
+    for name, value in {"SOURCE_BUCKET": SOURCE_BUCKET, "DEST_BUCKET": DEST_BUCKET, "SUBNET_IDS": "subnet-1",
+                        "SECURITY_GROUP_IDS": "sg-1", "CLUSTER_NAME": "cluster", "TASK_DEFINITION": "converter:1",
+                        "COMPLETED_PREFIX": COMPLETED_PREFIX}.items():
+        monkeypatch.setenv(name, value)
+    ecs = FakeEcs()
+    monkeypatch.setattr(polling_handler, "s3_client", boto3.client("s3", config=Config(signature_version=UNSIGNED)))
+    monkeypatch.setattr(polling_handler, "ledger_s3_client", s3)
+    monkeypatch.setattr(polling_handler, "ssm_client", boto3.client("ssm"))
+    monkeypatch.setattr(polling_handler, "ecs_client", ecs)
+    return ecs
+
+
+def source_key(day):
+    """A final source file of this month, where the poller lists."""
+    month = f"{datetime.now(timezone.utc):%Y%m}"
+    return f"data/v2.1/avhrr/{month}/oisst-avhrr-v02r01.{month}{day:02d}.nc"
+
+
+def put_source(s3, key, body):
+    s3.put_object(Bucket=SOURCE_BUCKET, Key=key, Body=body)
+    return f"s3://{SOURCE_BUCKET}/{key}"
+
+
+def complete(s3, task):
+    """Record the files of a launched task as converted, as the converter does on success."""
+    write_completion_record(task["COMPLETED_LEDGER"], json.loads(task["INPUT_FILES"]),
+                            json.loads(task["INPUT_VERSIONS"]), s3=s3)
+
+
+def test_entries_are_keyed_by_key_and_etag(s3):
+    ledger = ProcessedLedger(s3, DEST_BUCKET, "ledger.json").load()
+    assert ledger.entries == {}
+    ledger.add("a.nc", '"etag-1"')
+    assert ledger.contains("a.nc", "etag-1")
+    assert not ledger.contains("a.nc", "etag-2")
+    assert ledger.contains_key("a.nc") and not ledger.contains_key("a")
+    ledger.save()
+    assert ProcessedLedger(s3, DEST_BUCKET, "ledger.json").load().contains("a.nc", '"etag-1"')
+
+
+def test_expired_and_excess_entries_are_dropped(s3):
+    ledger = ProcessedLedger(s3, DEST_BUCKET, "ledger.json", max_entries=2, ttl_days=1)
+    now = datetime.now(timezone.utc)
+    ledger.add("old.nc", "e", when=now - timedelta(days=2))
+    for index in range(3):
+        ledger.add(f"{index}.nc", "e", when=now - timedelta(minutes=3 - index))
+    ledger.save()
+    assert set(ledger.entries) == {"1.nc#e", "2.nc#e"}
+
+    # Entries that expire while stored no longer count once loaded.
+    s3.put_object(Bucket=DEST_BUCKET, Key="ledger.json",
+                  Body=json.dumps({"entries": {"old.nc#e": (now - timedelta(days=2)).isoformat()}}))
+    ledger = ProcessedLedger(s3, DEST_BUCKET, "ledger.json", ttl_days=1).load()
+    assert not ledger.contains("old.nc", "e")
+
+
+def test_completion_records_are_merged_and_deleted(s3):
+    for index in range(3):
+        write_completion_record(f"s3://{DEST_BUCKET}/{COMPLETED_PREFIX}", [f"s3://{SOURCE_BUCKET}/{index}.nc"],
+                                {f"s3://{SOURCE_BUCKET}/{index}.nc": f'"e{index}"'}, s3=s3)
+    ledger = ProcessedLedger(s3, DEST_BUCKET, "ledger.json").load()
+    merged = ledger.merge_records(COMPLETED_PREFIX)
+    assert len(merged) == 3
+    assert all(ledger.contains(f"{index}.nc", f"e{index}") for index in range(3))
+    ledger.save()
+    ledger.delete_records(merged)
+    assert "Contents" not in s3.list_objects_v2(Bucket=DEST_BUCKET, Prefix=COMPLETED_PREFIX)
+
+
+def test_files_are_launched_until_converted(s3, poller):
+    first = put_source(s3, source_key(1), b"day 1")
+    second = put_source(s3, source_key(2), b"day 2")
+    polling_handler.lambda_handler({}, None)
+    task = poller.tasks[0]
+    assert poller.launched() == [first, second]
+
+    # Launched files are in flight: not launched again while the checkpoint holds them.
+    polling_handler.lambda_handler({}, None)
+    assert poller.launched() == []
+
+    # Only the second file's conversion succeeded.
+    complete(s3, dict(task, INPUT_FILES=json.dumps([second])))
+    polling_handler.lambda_handler({}, None)
+    assert poller.launched() == []
+    ledger = ProcessedLedger.from_environment(s3).load()
+    assert ledger.contains_key(source_key(2)) and not ledger.contains_key(source_key(1))
+    assert "Contents" not in s3.list_objects_v2(Bucket=DEST_BUCKET, Prefix=COMPLETED_PREFIX)
+
+    # Once the launch checkpoint expires, the unconverted file is launched again.
+    checkpoint = polling_handler.get_launch_checkpoint()
+    expired = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    s3.put_object(Bucket=DEST_BUCKET, Key=checkpoint.key,
+                  Body=json.dumps({"entries": {entry: expired for entry in checkpoint.entries}}))
+    polling_handler.lambda_handler({}, None)
+    assert poller.launched() == [first]
+
+
+def test_replaced_file_is_launched_again(s3, poller):
+    url = put_source(s3, source_key(1), b"day 1")
+    polling_handler.lambda_handler({}, None)
+    complete(s3, poller.tasks[0])
+    assert poller.launched() == [url]
+    polling_handler.lambda_handler({}, None)
+    assert poller.launched() == []
+
+    # Replaced in place: same key, new ETag, behind the listing cursor.
+    put_source(s3, source_key(1), b"day 1, revised")
+    polling_handler.lambda_handler({}, None)
+    assert poller.launched() == [url]
@@ -0,0 +1,78 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from supersession import final_version, is_preliminary, object_exists, schedule_conversions
+
+BUCKET = "source"
+
+
+def url(day, month="202501", preliminary=False):
+    return (f"s3://{BUCKET}/data/{month}/oisst-avhrr-v02r01.{month}{day:02d}"
+            f"{'_preliminary' if preliminary else ''}.nc")
+
+
+def test_final_version_of_a_preliminary_file():
+    assert is_preliminary(url(1, preliminary=True)) and not is_preliminary(url(1))
+    assert final_version(url(1, preliminary=True)) == final_version(url(1)) == url(1)
+    # The suffix only counts in the file name, and no suffix means no preliminary files.
+    assert not is_preliminary("s3://b/_preliminary/oisst.20250101.nc")
+    assert not is_preliminary(url(1, preliminary=True), suffix="")
+    assert final_version("oisst.20250101_prelim.nc", suffix="_prelim") == "oisst.20250101.nc"
+
+
+def test_final_file_replaces_its_preliminary_file():
+    for files in ([url(1, preliminary=True), url(1)], [url(1), url(1, preliminary=True)]):
+        assert schedule_conversions(files) == ([url(1)], [url(1, preliminary=True)])
+
+
+def test_repeated_requests_are_one_conversion():
+    assert schedule_conversions([url(2), url(2, preliminary=True), url(2), url(2)]) == (
+        [url(2)], [url(2, preliminary=True)])
+    # A file of the same date under another prefix has another final version.
+    other = url(1, preliminary=True).replace("data/", "mirror/")
+    assert schedule_conversions([other, url(1, preliminary=True)]) == ([url(1, preliminary=True), other], [])
+
+
+def test_preliminary_file_with_a_known_final_version_is_skipped():
+    asked = []
+
+    def final_known(final):
+        asked.append(final)
+        return final == url(1)
+
+    scheduled, superseded = schedule_conversions([url(1, preliminary=True), url(2, preliminary=True), url(3)],
+                                                 final_known=final_known)
+    assert scheduled == [url(2, preliminary=True), url(3)]
+    assert superseded == [url(1, preliminary=True)]
+    # Final files are never looked up.
+    assert asked == [url(1), url(2)]
+
+
+def test_conversions_are_ordered_by_date():
+    files = [url(3), url(1, "202502"), url(31, "202412", preliminary=True), url(2)]
+    scheduled, _ = schedule_conversions(files)
+    assert scheduled == [url(31, "202412", preliminary=True), url(2), url(3), url(1, "202502")]
+
+
+class ForbiddenS3:
+    """HEAD answers of a caller without s3:ListBucket, or another error."""
+
+    def __init__(self, code):
+        self.code = code
+
+    def head_object(self, **kwargs):
+        raise ClientError({"Error": {"Code": self.code}}, "HeadObject")
+
+
+def test_object_exists():
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        s3.put_object(Bucket=BUCKET, Key=url(1).split(f"{BUCKET}/", 1)[1], Body=b"final")
+        assert object_exists(s3, url(1))
+        assert not object_exists(s3, url(2))
+    assert not object_exists(ForbiddenS3("403"), url(1))
+    with pytest.raises(ClientError):
+        object_exists(ForbiddenS3("SlowDown"), url(1))
@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import zarr
+
+from conftest import CHUNKS, ROOT, assert_same_contents, open_store
+from ecs.batch_conversion import convert_files_to_zarr
+from ecs.converter import add_verifier_pubkeys, convert_netcdf_to_zarr, load_dataset
+from ecs.hashing import add_spatial_hashes
+from ecs.sources import partition_days
+from ecs.store_io import split_store_url
+from ecs.store_writes import create_presized_store
+from ecs.time_delta import CODEC_NAME, TimeDeltaCodec, delta_decode, delta_encode
+
+
+def assert_bitwise_equal(actual, expected):
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual.view(f"u{actual.itemsize}"), expected.view(f"u{expected.itemsize}"))
+
+
+def sample(dtype, shape=(5, 3, 4)):
+    rng = np.random.default_rng(0)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        values = rng.integers(info.min, info.max, size=shape, endpoint=True).astype(dtype)
+        values.flat[:2] = [info.min, info.max]  # deltas that wrap around
+        return values
+    values = rng.normal(20, 5, size=shape).astype(dtype)
+    values.flat[:3] = [np.nan, np.inf, -0.0]
+    return values
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.float32, np.float64])
+@pytest.mark.parametrize("axis", [0, 1, -1])
+def test_delta_round_trip_is_exact(dtype, axis):
+    values = sample(dtype)
+    encoded = delta_encode(values, axis)
+    assert encoded.dtype == values.dtype and encoded.shape == values.shape
+    assert_bitwise_equal(delta_decode(encoded, axis), values)
+
+
+def test_single_slice_passes_through():
+    values = sample(np.float32, shape=(1, 3, 4))
+    assert_bitwise_equal(delta_encode(values), values)
+    assert_bitwise_equal(delta_decode(values), values)
+
+
+def test_slowly_varying_values_encode_to_small_deltas():
+    days = np.cumsum(np.ones((10, 8), dtype=np.int16), axis=0) + 1500
+    encoded = delta_encode(days)
+    np.testing.assert_array_equal(encoded[1:], 1)
+
+
+def test_codec_metadata_round_trip():
+    codec = TimeDeltaCodec(axis=2)
+    assert codec.to_dict() == {"name": CODEC_NAME, "configuration": {"axis": 2}}
+    assert TimeDeltaCodec.from_dict(codec.to_dict()) == codec
+
+
+@pytest.mark.parametrize("dtype", ["int16", "float32"])
+def test_zarr_array_round_trip(dtype):
+    store = zarr.storage.MemoryStore()
+    values = sample(np.dtype(dtype), shape=(6, 4, 5))
+    array = zarr.create_array(store, name="v", shape=values.shape, dtype=dtype, chunks=(4, 2, 5),
+                              filters=[TimeDeltaCodec(axis=0)], fill_value=0)
+    array[...] = values
+    reopened = zarr.open_array(store, path="v", mode="r")
+    assert reopened.filters == (TimeDeltaCodec(axis=0),)
+    assert_bitwise_equal(reopened[...], values)
+
+
+def delta_config(conversion_config, days=3):
+    """Store sst and err with the codec in chunks of `days` days."""
+    variables = dict(conversion_config["variables"])
+    for name in ("sst", "err"):
+        variables[name] = {"chunks": dict(CHUNKS, time=days)}
+    return dict(conversion_config, packing="source", variables=variables, time_delta=["sst", "err"])
+
+
+def stored_bytes(store_url, name):
+    _, path = split_store_url(store_url)
+    directory = os.path.join(path, name, "c")
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(directory) for f in files)
+
+
+def test_slowly_varying_days_are_smaller_on_disk():
+    rng = np.random.default_rng(0)
+    base = rng.integers(-200, 3000, size=(36, 72))
+    days = (base + np.cumsum(rng.integers(-2, 3, size=(30, 36, 72)), axis=0)).astype(np.int16)
+    sizes = {}
+    for delta in (False, True):
+        store = zarr.storage.MemoryStore()
+        array = zarr.create_array(store, name="v", shape=days.shape, dtype=days.dtype, chunks=(10, 18, 36),
+                                  filters=[TimeDeltaCodec()] if delta else None, fill_value=0)
+        array[...] = days
+        assert_bitwise_equal(array[...], days)
+        sizes[delta] = sum(len(value) for key, value in store._store_dict.items() if "/c/" in key)
+    assert sizes[True] < 0.6 * sizes[False]
+
+
+@pytest.mark.parametrize("write", ["append", "batch", "region"])
+def test_multi_day_chunks_match_plain(source_files, conversion_config, tmp_path, write):
+    conversion_config["packing"] = "source"
+    plain = f"file://{tmp_path}/plain"
+    delta = f"file://{tmp_path}/delta"
+    config = delta_config(conversion_config)
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, plain, "", conversion_config)
+    if write == "append":
+        for netcdf_file in source_files:
+            convert_netcdf_to_zarr(netcdf_file, delta, "", config)
+    elif write == "batch":
+        # The second batch starts inside the first time chunk and crosses into the next.
+        convert_files_to_zarr(source_files[:2], delta, "", config)
+        convert_files_to_zarr(source_files[2:], delta, "", config)
+    else:
+        ds, _ = load_dataset(source_files[0], "", config)
+        create_presized_store(add_verifier_pubkeys(add_spatial_hashes(ds)), delta,
+                              pd.date_range("2025-01-01T12:00", periods=len(source_files), freq="D"))
+        for netcdf_file in reversed(source_files):
+            convert_netcdf_to_zarr(netcdf_file, delta, "", config, write_mode="region")
+    assert_same_contents(delta, plain)
+    stored = open_store(delta)
+    assert stored["sst"].encoding["chunks"][0] == 3 and stored["anom"].encoding["chunks"][0] == 1
+    assert stored["sst"].encoding["filters"] == (TimeDeltaCodec(axis=0),)
+    # Rewriting a day in the middle of a chunk keeps the other days of the chunk.
+    convert_netcdf_to_zarr(source_files[1], delta, "", config)
+    assert_same_contents(delta, plain)
+
+
+def test_repeated_days_are_stored_once_per_chunk(source_files, conversion_config, tmp_path):
+    conversion_config["packing"] = "source"
+    plain = f"file://{tmp_path}/plain"
+    delta = f"file://{tmp_path}/delta"
+    for day in range(1, 4):
+        repeated = tmp_path / f"oisst-avhrr-v02r01.202501{day:02d}.nc"
+        shutil.copy(source_files[0], repeated)
+        convert_netcdf_to_zarr(str(repeated), plain, "", conversion_config)
+        convert_netcdf_to_zarr(str(repeated), delta, "", delta_config(conversion_config))
+    assert_same_contents(delta, plain)
+    # After the first day of a chunk the deltas are all zero.
+    assert stored_bytes(delta, "sst") < 0.5 * stored_bytes(plain, "sst")
+
+
+def test_backfill_ranges_hold_whole_time_chunks():
+    days = [f"2025-01-{day:02d}" for day in (1, 2, 3, 4, 5, 7, 8, 9, 10)]
+    assert partition_days(days, 4) == [days[:4], days[4:8], days[8:]]
+    # Three-day chunks from 2025-01-01: [1-3], [4-6], [7-9], [10-12].
+    assert partition_days(days, 4, time_chunk=3, first_day="2025-01-01") == [days[:3], days[3:5], days[5:]]
+    assert partition_days(days, 5, time_chunk=3, first_day="2025-01-01") == [days[:5], days[5:]]
+    assert partition_days(days, 1, time_chunk=3, first_day="2025-01-01")[0] == days[:3]
+
+
+def test_backfill_cli_with_multi_day_chunks(source_files, conversion_config, tmp_path):
+    conversion_config["packing"] = "source"
+    config_path = tmp_path / "app_config.json"
+    config_path.write_text(json.dumps({"defined_suffix": "", "sub_folder": "oisst-data",
+                                       "conversion": delta_config(conversion_config)}))
+    subprocess.run([sys.executable, os.path.join(ROOT, "scripts", "backfill.py"),
+                    "--start", "2025-01-01", "--end", "2025-01-04", "--source", os.path.dirname(source_files[0]),
+                    "--dest-bucket", f"file://{tmp_path}/bucket", "--config", str(config_path),
+                    "--workers", "2", "--days-per-range", "2", "--checkpoint", str(tmp_path / "checkpoint.json")],
+                   check=True, capture_output=True, cwd=tmp_path)
+    plain = f"file://{tmp_path}/plain"
+    for netcdf_file in source_files:
+        convert_netcdf_to_zarr(netcdf_file, plain, "", conversion_config)
+    assert_same_contents(f"file://{tmp_path}/bucket/oisst-data", plain)